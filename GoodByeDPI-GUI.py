@@ -1,48 +1,84 @@
+import os
 import sys
-import json
-import subprocess
+import threading
+from startup_trace import StartupTrace
+TRACE = StartupTrace.from_env()
+from control_channel import forward_to_running
+if __name__ == "__main__":
+    # A second launch hands its command to the running instance and exits before Qt is even imported
+    forwarded = forward_to_running(sys.argv[1:], prog="GoodByeDPI-GUI")
+    if forwarded is not None:
+        sys.exit(forwarded)
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QFormLayout,
     QGroupBox, QLabel, QLineEdit, QCheckBox, QPushButton, QScrollArea,
-    QSpinBox, QComboBox, QTextEdit, QSystemTrayIcon,
-    QMenu, QMessageBox
+    QSpinBox, QComboBox, QPlainTextEdit, QSystemTrayIcon,
+    QMenu, QMessageBox, QInputDialog
 )
-from PySide6.QtCore import QThread, Signal
-from PySide6.QtGui import QIcon, QAction, QCloseEvent
-import ctypes
-import time
+from PySide6.QtCore import QThread, QTimer, Signal
+from PySide6.QtGui import QIcon, QAction, QActionGroup, QCloseEvent, QTextCursor
 import winsound
+from process_watcher import PROCESS_NAME
+from log_sink import RotatingLogSink
+from goodbyedpi_core import FLAGS, MODES, ProfileError, Supervisor, build_command, stop_strays
+from output_mux import OutputMultiplexer
+from instances import INSTANCES_CONFIG, InstanceGroup
+from profile_store import ProfileStore
+from health_probe import HEALTH_CONFIG, HealthMonitor
+from output_events import EVENT_TYPES, EventStore
+from control_channel import ControlError, ControlServer
+from profile_remote import REMOTE_CONFIG, RemoteProfileSync
+from diagnostics import Diagnostics
+from blacklist_hits import PRUNED_FILE, REPORT_FILE, HitCounter, analyze, format_report, write_pruned
+from dns_select import DNS_CONFIG, DnsBenchmark, DnsSelector, format_results, redirected_versions, with_resolvers
+from metrics import METRICS_ENV, MetricsCollector, MetricsServer, parse_address
+TRACE.mark("imports")
 
 
-CONFIG_FILE = "profile.json"
+OUTPUT_MAX_LINES = 5000
+EVENT_VIEW_LINES = 1000
+OUTPUT_FLUSH_INTERVAL_MS = 100
+AUTOSAVE_DELAY_MS = 1000
+CONTROL_TIMEOUT = 10.0
+CONTROL_TAIL_LINES = 100
 
-# noinspection SpellCheckingInspection
-MODES = {
-    "-1": {"-p": True, "-r": True, "-s": True, "-f": 2, "-k": 2, "-n": True, "-e": 2},
-    "-2": {"-p": True, "-r": True, "-s": True, "-f": 2, "-k": 2, "-n": True, "-e": 40},
-    "-3": {"-p": True, "-r": True, "-s": True, "-e": 40},
-    "-4": {"-p": True, "-r": True, "-s": True},
-    "-5": {"-f": 2, "-e": 2, "--auto-ttl": "1-4-10", "--reverse-frag": True, "--max-payload": 1200},
-    "-6": {"-f": 2, "-e": 2, "--wrong-seq": True, "--reverse-frag": True, "--max-payload": 1200},
-    "-7": {"-f": 2, "-e": 2, "--wrong-chksum": True, "--reverse-frag": True, "--max-payload": 1200},
-    "-8": {"-f": 2, "-e": 2, "--wrong-chksum": True, "--wrong-seq": True, "--reverse-frag": True,
-           "--max-payload": 1200},
-    "-9": {"-q": True, "-f": 2, "-e": 2, "--wrong-chksum": True, "--wrong-seq": True, "--reverse-frag": True,
-           "--max-payload": 1200}
-}
 
 class GoodbyeDPIGUI(QWidget):
-    output_signal = Signal(str)
+    profile_switched = Signal(str, object)
+    control_call = Signal(object)
+    shutdown_finished = Signal()
+
     def __init__(self):
         super().__init__()
-        self.mode_combo = QComboBox()
-        self.output_connected = False
+        self.mode_combo = None
+        self.profile_combo = None
+        self.output_box = None
+        self.event_filter = None
+        self.search_line = None
+        self.store = ProfileStore()
+        self.multiplexer = OutputMultiplexer()
+        self.supervisor = Supervisor(multiplexer=self.multiplexer)
+        self.output = self.supervisor.output
+        self.watcher = self.supervisor.watcher
+        self.log_sink = RotatingLogSink()
+        self.output.add_sink(self.log_sink.write)
+        self.instances = self.load_instances()
+        if self.instances is not None:
+            # The tray status must not show the main goodbyedpi as running because an extra instance is
+            self.watcher.exclude = self.instances.owned_pids
+        self.events = EventStore()
+        self.output.add_sink(self.events.add)
+        self.hits = HitCounter()
+        self.output.add_sink(self.hits.add_line)
+        self.hits.start()
+        self.profile = {}
+        self.applying_profile = False
         self.command = None
+        self.starting = False
         self.exiting = False
+        self.exit_requested = threading.Event()
         self.exception_msg = None
         self.icon_update_thread = QThread()
-        self.command_runner = QThread()
-        self.message_box = QMessageBox()
 
         self.icon_update_thread.run = self.update_tray_icon
         self.setWindowTitle("GoodbyeDPI-GUI v1.1")
@@ -53,8 +89,85 @@ class GoodbyeDPIGUI(QWidget):
         self.line_values = {}
 
         self.tray = None
-        self.runner = None
 
+        # Tray Icon Setup
+        self.tray = QSystemTrayIcon(self)
+        self.tray.setIcon(QIcon(r"Resources/Icon1.ico"))
+        self.tray_menu = QMenu()
+        self.start = QAction(QIcon(r"Resources/Icon1.ico"), "Start GoodByeDPI")
+        self.start.triggered.connect(self.run_goodbyedpi)
+        self.stop = QAction(QIcon(r"Resources/forbidden.ico"), "Stop GoodByeDPI")
+        self.stop.triggered.connect(self.manual_stop)
+        self.tray_menu.addSeparator()
+        self.quit_app = QAction(QIcon(r"Resources/exit.ico"), "Quit")
+        self.quit_app.triggered.connect(self.shutting_down)
+        self.diagnostics = Diagnostics()
+        self.diagnostics_menu = QMenu("Diagnostics")
+        self.profiling_action = QAction("CPU Profiling", self.diagnostics_menu)
+        self.profiling_action.setCheckable(True)
+        self.profiling_action.toggled.connect(self.toggle_profiling)
+        self.tracing_action = QAction("Memory Tracing", self.diagnostics_menu)
+        self.tracing_action.setCheckable(True)
+        self.tracing_action.toggled.connect(self.toggle_tracing)
+        self.snapshot_action = QAction("Memory Snapshot", self.diagnostics_menu)
+        self.snapshot_action.setEnabled(False)
+        self.snapshot_action.triggered.connect(self.memory_snapshot)
+        self.diagnostics_menu.addAction(self.profiling_action)
+        self.diagnostics_menu.addAction(self.tracing_action)
+        self.diagnostics_menu.addAction(self.snapshot_action)
+        self.dns_action = QAction("Pick Fastest DNS")
+        self.dns_action.triggered.connect(self.pick_fastest_dns)
+        self.blacklist_action = QAction("Blacklist Hit Report")
+        self.blacklist_action.triggered.connect(self.blacklist_report)
+        self.profiles_menu = QMenu("Profiles")
+        self.profile_actions = QActionGroup(self)
+        self.profile_actions.triggered.connect(lambda action: self.switch_profile(action.text()))
+        self.tray_menu.addAction(self.start)
+        self.tray_menu.addAction(self.stop)
+        self.tray_menu.addMenu(self.profiles_menu)
+        self.instances_menu = QMenu("Instances")
+        self.instances_menu.aboutToShow.connect(self.refresh_instances_menu)
+        if self.instances is not None:
+            self.tray_menu.addMenu(self.instances_menu)
+        self.tray_menu.addAction(self.dns_action)
+        self.tray_menu.addAction(self.blacklist_action)
+        self.tray_menu.addMenu(self.diagnostics_menu)
+        self.tray_menu.addAction(self.quit_app)
+        self.tray.setContextMenu(self.tray_menu)
+        self.profile_switched.connect(self.on_profile_switched)
+        self.control_call.connect(self.run_control_call)
+        self.shutdown_finished.connect(self.finish_shutdown)
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setSingleShot(True)
+        self.autosave_timer.setInterval(AUTOSAVE_DELAY_MS)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.tray.setToolTip("GoodByeDPI-GUI")
+        (self.tray.activated.
+         connect(lambda reason: self.show() if reason == QSystemTrayIcon.ActivationReason.Trigger else None))
+        self.tray.show()
+        TRACE.mark("tray")
+        self.auto_load_last_profile()
+        self.refresh_profiles()
+        TRACE.mark("profile load")
+        self.run_goodbyedpi()
+        TRACE.mark("spawn")
+        self.health = self.start_health_monitor()
+        self.metrics = self.start_metrics()
+        self.control = self.start_control_server()
+        self.remote = self.start_remote_profiles()
+        self.dns = self.start_dns_selector()
+        self.icon_update_thread.start()
+
+    # The settings widgets are only needed once the window is opened, the app itself starts hidden
+    def showEvent(self, event):
+        if self.output_box is None:
+            TRACE.restart()
+            self.build_window()
+            TRACE.mark("widget build")
+        super().showEvent(event)
+
+    def build_window(self):
+        self.mode_combo = QComboBox()
         layout = QVBoxLayout(self)
         scroll = QScrollArea()
         scroll.setWidgetResizable(True)
@@ -63,6 +176,9 @@ class GoodbyeDPIGUI(QWidget):
 
         self.create_menu_buttons()
         self.add_groups()
+        self.apply_profile(self.profile)
+        self.connect_autosave()
+        self.refresh_profiles()
 
         run_box = QHBoxLayout()
         self.run_button = QPushButton("✅Run GoodByeDPI")
@@ -72,49 +188,45 @@ class GoodbyeDPIGUI(QWidget):
         run_box.addWidget(self.run_button)
         run_box.addWidget(self.stop_button)
 
-        self.output_box = QTextEdit()
+        self.output_box = QPlainTextEdit()
         self.output_box.setStyleSheet("""
-    QTextEdit {
+    QPlainTextEdit {
         border: 1px solid gray;
         outline: none;
     }
 
-    QTextEdit:focus {
+    QPlainTextEdit:focus {
         border: 1px solid gray;
         outline: none;
     }
 """)
         self.output_box.setMinimumHeight(200)
         self.output_box.setReadOnly(True)
+        self.output_box.setMaximumBlockCount(OUTPUT_MAX_LINES)
+        self.output_timer = QTimer(self)
+        self.output_timer.timeout.connect(self.flush_output)
+        self.output_timer.start(OUTPUT_FLUSH_INTERVAL_MS)
+
+        filter_box = QHBoxLayout()
+        self.event_filter = QComboBox()
+        self.event_filter.addItem("All output", None)
+        for event_type in EVENT_TYPES:
+            self.event_filter.addItem(event_type.capitalize(), event_type)
+        self.event_filter.currentIndexChanged.connect(self.refresh_event_view)
+        self.search_line = QLineEdit()
+        self.search_line.setPlaceholderText("Search output or host")
+        self.search_line.textChanged.connect(self.refresh_event_view)
+        filter_box.addWidget(QLabel("Output:"))
+        filter_box.addWidget(self.event_filter)
+        filter_box.addWidget(self.search_line)
 
         self.scroll_layout.addLayout(run_box)
-        self.scroll_layout.addWidget(QLabel("Output:"))
+        self.scroll_layout.addLayout(filter_box)
         self.scroll_layout.addWidget(self.output_box)
 
         scroll.setWidget(content)
         layout.addWidget(scroll)
-        # Tray Icon Setup
-        self.tray = QSystemTrayIcon(self)
-        self.tray.setIcon(QIcon(r"Resources/Icon1.ico"))
-        self.tray_menu = QMenu()
-        self.start = QAction(QIcon(r"Resources/Icon1.ico"), "Start GoodByeDPI")
-        self.start.triggered.connect(self.run_goodbyedpi)
-        self.stop = QAction(QIcon(r"Resources/forbidden.ico"), "Stop GoodByeDPI")
-        self.stop.triggered.connect(self.manual_stop)
-        self.tray_menu.addSeparator()
-        self.quit_app = QAction(QIcon(r"Resources/exit.ico"), "Quit")
-        self.quit_app.triggered.connect(self.shutting_down)
-        self.tray_menu.addAction(self.start)
-        self.tray_menu.addAction(self.stop)
-        self.tray_menu.addAction(self.quit_app)
-        self.tray.setContextMenu(self.tray_menu)
-        self.tray.setToolTip("GoodByeDPI-GUI")
-        (self.tray.activated.
-         connect(lambda reason: self.show() if reason == QSystemTrayIcon.ActivationReason.Trigger else None))
-        self.tray.show()
-        self.auto_load_last_profile()
-        self.run_goodbyedpi()
-        self.icon_update_thread.start()
+        self.flush_output()
 
     def exception_show_msg(self):
         warning_message_box = QMessageBox()
@@ -128,12 +240,43 @@ class GoodbyeDPIGUI(QWidget):
 
     # noinspection SpellCheckingInspection
     def manual_stop(self):
-        self.command_runner.terminate()
-        subprocess.call(["taskkill", "/f", "/im", "goodbyedpi.exe"],
-                        creationflags=subprocess.CREATE_NO_WINDOW,
-                        shell=True)
-        self.output_box.clear()
-        self.output_box.append("GoodByeDPI Stopped...")
+        self.clear_output()
+        threading.Thread(target=self.stop_worker, name="stop", daemon=True).start()
+
+    def stop_worker(self):
+        self.stop_all()
+        self.output.push("GoodByeDPI Stopped...")
+
+    # Our instances are stopped first, anything still left is a goodbyedpi we did not start
+    def stop_all(self):
+        if self.instances is not None:
+            self.instances.stop_all()
+        elapsed = self.supervisor.stop()
+        stop_strays(self.watcher.scanner, exclude=self.owned_pids())
+        return elapsed
+
+    # cProfile observes the thread that enables it, so profiling is started and stopped here on the GUI thread
+    def toggle_profiling(self, enabled):
+        if enabled:
+            self.diagnostics.start_profiling()
+            self.output.push("CPU profiling started")
+        else:
+            path = self.diagnostics.stop_profiling()
+            self.output.push(f"CPU profile written to {path}")
+
+    def toggle_tracing(self, enabled):
+        self.snapshot_action.setEnabled(enabled)
+        if enabled:
+            self.diagnostics.start_tracing()
+            self.output.push("Memory tracing started")
+        else:
+            path = self.diagnostics.stop_tracing()
+            self.output.push(f"Memory report written to {path}")
+
+    def memory_snapshot(self):
+        path = self.diagnostics.snapshot()
+        if path is not None:
+            self.output.push(f"Memory snapshot written to {path}")
 
     def closeEvent(self, event: QCloseEvent):
         self.on_close()
@@ -142,23 +285,48 @@ class GoodbyeDPIGUI(QWidget):
     def on_close(self):
         self.hide()
 
-    # noinspection SpellCheckingInspection
     def shutting_down(self):
+        if self.exiting:
+            return
         self.exiting = True
+        self.exit_requested.set()
         self.tray.setToolTip("Shutting Down")
-        subprocess.call(["taskkill", "/f", "/im", "goodbyedpi.exe"],
-                        creationflags=subprocess.CREATE_NO_WINDOW,
-                        shell=True)
-        time.sleep(3)
+        self.quit_app.setEnabled(False)
+        threading.Thread(target=self.shutdown_worker, name="shutdown").start()
+
+    # Takes as long as goodbyedpi needs to exit (bounded by STOP_TIMEOUT) instead of blocking the GUI thread.
+    # A failing step does not skip the others, and the app always quits.
+    def shutdown_worker(self):
+        steps = [service.stop for service in (self.control, self.remote, self.dns, self.metrics, self.health)
+                 if service is not None]
+        steps += [self.stop_all, self.multiplexer.stop, self.hits.stop, self.log_sink.close]
+        try:
+            for step in steps:
+                try:
+                    step()
+                except Exception as e:
+                    print(f"Shutdown step failed: {e!r}", file=sys.stderr)
+        finally:
+            self.shutdown_finished.emit()
+
+    def finish_shutdown(self):
+        self.icon_update_thread.wait()
         QApplication.instance().quit()
 
     def create_menu_buttons(self):
         menu = QHBoxLayout()
+        self.profile_combo = QComboBox()
+        self.profile_combo.textActivated.connect(self.switch_profile)
         save_btn = QPushButton("💾 Save Profile")
+        save_as_btn = QPushButton("📝 Save Profile As")
         load_btn = QPushButton("📂 Load Profile")
         save_btn.clicked.connect(self.save_profile)
+        save_as_btn.clicked.connect(self.save_profile_as)
         load_btn.clicked.connect(self.load_profile)
+        menu.addWidget(QLabel("Profile:"))
+        menu.addWidget(self.profile_combo)
         menu.addWidget(save_btn)
+        menu.addWidget(save_as_btn)
         menu.addWidget(load_btn)
         self.scroll_layout.addLayout(menu)
 
@@ -235,7 +403,8 @@ class GoodbyeDPIGUI(QWidget):
         self.line_values["--blacklist"] = self.add_line(layout, "--blacklist")
         self.line_values["--blacklist"].setToolTip("<txtfile> perform circumvention tricks only to host names and"
                                                    " subdomains from supplied text file (HTTP Host/TLS SNI)."
-                                                   " This option can be supplied multiple times.")
+                                                   " Several files can be separated by ';', they are merged,"
+                                                   " deduplicated and cached before launch.")
         self.checkbox_flags["--frag-by-sni"] = self.add_checkbox(layout, "--frag-by-sni")
         self.checkbox_flags["--frag-by-sni"].setToolTip("if SNI is detected in TLS packet, fragment the packet right"
                                                         " before SNI value.")
@@ -310,6 +479,7 @@ class GoodbyeDPIGUI(QWidget):
         self.mode_combo.addItems([""] + list(MODES.keys()))
         self.mode_combo.currentTextChanged.connect(self.update_tooltip)
         self.mode_combo.currentTextChanged.connect(self.apply_modeset)
+        self.mode_combo.currentTextChanged.connect(self.restart_if_changed)
         layout.addWidget(QLabel("Select Modeset:"))
         layout.addWidget(self.mode_combo)
         group.setLayout(layout)
@@ -341,11 +511,12 @@ class GoodbyeDPIGUI(QWidget):
 
         config = MODES.get(mode, {})
         for key, value in config.items():
-            if key in self.checkbox_flags and value is True:
-                self.checkbox_flags[key].setChecked(True)
-            elif key in self.spin_values and isinstance(value, int):
+            kind = FLAGS[key].kind
+            if kind == "check" and key in self.checkbox_flags:
+                self.checkbox_flags[key].setChecked(value)
+            elif kind == "spin" and key in self.spin_values:
                 self.spin_values[key].setValue(value)
-            elif key in self.line_values and isinstance(value, str):
+            elif kind == "line" and key in self.line_values:
                 self.line_values[key].setText(value)
 
     @staticmethod
@@ -383,163 +554,497 @@ class GoodbyeDPIGUI(QWidget):
         return group
 
     # noinspection PyTypeChecker,SpellCheckingInspection
+    def current_profile(self):
+        if self.mode_combo is None:
+            return self.profile
+        return {
+            "modeset": self.mode_combo.currentText(),
+            "checkbox_flags": {k: v.isChecked() for k, v in self.checkbox_flags.items()},
+            "spin_values": {k: v.value() for k, v in self.spin_values.items()},
+            "line_values": {k: v.text() for k, v in self.line_values.items()}
+        }
+
     def save_profile(self):
-        if CONFIG_FILE:
-            profile = {
-                "modeset": self.mode_combo.currentText(),
-                "checkbox_flags": {k: v.isChecked() for k, v in self.checkbox_flags.items()},
-                "spin_values": {k: v.value() for k, v in self.spin_values.items()},
-                "line_values": {k: v.text() for k, v in self.line_values.items()}
-            }
-            with open(CONFIG_FILE, "w") as f:
-                json.dump(profile, f, indent=2)
+        self.autosave_timer.stop()
+        try:
+            self.profile = self.current_profile()
+            self.store.save(self.store.active, self.profile)
+            self.output.push(f"Profile '{self.store.active}' Saved and Will Be Loaded Automatically"
+                             f" on Application Start.")
+            self.restart_if_changed()
+        except Exception as e:
+            self.exception_msg = f"Failed to save profile: {e}"
+            self.exception_show_msg()
+
+    def save_profile_as(self):
+        name, ok = QInputDialog.getText(self, "Save Profile As", "Profile name:")
+        name = name.strip()
+        if ok and name:
+            self.store.set_active(name)
+            self.save_profile()
+            self.refresh_profiles()
 
     # noinspection SpellCheckingInspection
     def load_profile(self):
-        if CONFIG_FILE and os.path.exists(CONFIG_FILE):
+        try:
+            self.profile = self.store.load()
+            self.apply_profile(self.profile)
+        except Exception as e:
+            self.exception_msg = f"Failed to load profile: {e}"
+            self.exception_show_msg()
+
+    def connect_autosave(self):
+        schedule = lambda *_: self.autosave_timer.start()  # noqa
+        self.mode_combo.currentTextChanged.connect(schedule)
+        for cb in self.checkbox_flags.values():
+            cb.toggled.connect(schedule)
+        for spin in self.spin_values.values():
+            spin.valueChanged.connect(schedule)
+        for le in self.line_values.values():
+            le.textChanged.connect(schedule)
+
+    # Debounced: runs once the widgets have been left alone for AUTOSAVE_DELAY_MS, the write happens off
+    # the GUI thread and is skipped by the store when nothing changed
+    def autosave(self):
+        self.profile = self.current_profile()
+        threading.Thread(target=self.store.save, args=(self.store.active, self.profile), daemon=True).start()
+
+    def refresh_profiles(self):
+        names = self.store.names()
+        if self.store.active not in names:
+            names.append(self.store.active)
+        for action in self.profile_actions.actions():
+            self.profile_actions.removeAction(action)
+        self.profiles_menu.clear()
+        for name in sorted(names):
+            action = QAction(name, self.profiles_menu)
+            action.setCheckable(True)
+            action.setChecked(name == self.store.active)
+            self.profile_actions.addAction(action)
+            self.profiles_menu.addAction(action)
+        if self.profile_combo is not None:
+            self.profile_combo.blockSignals(True)
+            self.profile_combo.clear()
+            self.profile_combo.addItems(sorted(names))
+            self.profile_combo.setCurrentText(self.store.active)
+            self.profile_combo.blockSignals(False)
+
+    def switch_profile(self, name):
+        if name == self.store.active:
+            return
+        # Pending edits belong to the profile being left
+        if self.autosave_timer.isActive():
+            self.autosave_timer.stop()
+            self.store.save(self.store.active, self.current_profile())
+        threading.Thread(target=self.switch_profile_worker, args=(name,), daemon=True).start()
+
+    # Loading, blacklist compilation and the restart run here so the GUI thread never waits on them
+    def switch_profile_worker(self, name):
+        try:
+            profile = self.store.load(name)
+            cmd = build_command(profile, on_message=self.output.push)
+        except Exception as e:
+            self.output.push(f"Failed to load profile '{name}': {e}")
+            return
+        self.store.set_active(name)
+        self.apply_command(cmd, f"Profile '{name}'")
+        self.profile_switched.emit(name, profile)
+
+    # Called when a save or preset change may have changed the command line. The profile is read on the
+    # GUI thread, building and restarting happen on a worker thread.
+    def restart_if_changed(self):
+        if self.applying_profile or not self.supervisor.active():
+            return
+        profile = self.current_profile()
+        threading.Thread(target=self.restart_if_changed_worker, args=(profile,), daemon=True).start()
+
+    def restart_if_changed_worker(self, profile):
+        try:
+            cmd = build_command(profile)
+        except ProfileError as e:
+            self.output.push(f"Invalid profile, GoodByeDPI not restarted: {e}")
+            return
+        self.apply_command(cmd, "Profile changed")
+
+    # The taskkill/respawn cycle only happens when the effective argv differs from the running one
+    def apply_command(self, cmd, reason):
+        if cmd == self.supervisor.command and self.supervisor.active():
+            self.output.push(f"{reason}: command unchanged, GoodByeDPI keeps running")
+            return
+        self.output.push(f"\n> {reason}: {' '.join(cmd)}\n")
+        self.command = cmd
+        self.log_sink.set_command(cmd)
+        try:
+            self.supervisor.apply(cmd)
+        except Exception as e:
+            self.output.push(f"Error: {e}")
+
+    # Probes are configured in health.json; without it nothing is started
+    def start_health_monitor(self):
+        if not os.path.exists(HEALTH_CONFIG):
+            return None
+        try:
+            monitor = HealthMonitor.from_config(on_failover=self.on_health_failover, is_active=self.supervisor.active)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            self.output.push(f"Health probes disabled: {e}")
+            return None
+        monitor.start()
+        return monitor
+
+    # Only served when GOODBYEDPI_METRICS is set, e.g. to 9464 or 127.0.0.1:9464
+    def start_metrics(self):
+        address = os.environ.get(METRICS_ENV)
+        if not address:
+            return None
+        collector = MetricsCollector(self.supervisor, profile=lambda: (self.store.active, self.profile),
+                                     health=self.health)
+        try:
+            server = MetricsServer(collector, *parse_address(address))
+        except (OSError, ValueError) as e:
+            self.output.push(f"Metrics endpoint disabled: {e}")
+            return None
+        server.start()
+        return server
+
+    def start_control_server(self):
+        server = ControlServer({
+            "status": self.control_status,
+            "start": lambda: self.call_in_gui(self.run_goodbyedpi),
+            "stop": self.control_stop,
+            "reload": self.control_reload,
+            "switch-profile": self.control_switch_profile,
+            "tail-log": self.control_tail_log,
+        })
+        try:
+            server.start()
+        except OSError as e:
+            self.output.push(f"Control channel disabled: {e}")
+            return None
+        return server
+
+    # Control handlers run on the control thread; anything touching widgets goes through call_in_gui
+    def call_in_gui(self, func, *args):
+        done = threading.Event()
+        result = {}
+
+        def call():
             try:
-                with open(CONFIG_FILE, "r") as f:
-                    profile = json.load(f)
-                self.mode_combo.setCurrentText(profile.get("modeset", ""))
-                for k, v in profile.get("checkbox_flags", {}).items():
-                    if k in self.checkbox_flags:
-                        self.checkbox_flags[k].setChecked(v)
-                for k, v in profile.get("spin_values", {}).items():
-                    if k in self.spin_values:
-                        self.spin_values[k].setValue(v)
-                for k, v in profile.get("line_values", {}).items():
-                    if k in self.line_values:
-                        self.line_values[k].setText(v)
+                result["value"] = func(*args)
             except Exception as e:
-                self.exception_msg = f"Failed to load profile: {e}"
-                self.exception_show_msg()
+                result["error"] = e
+            finally:
+                done.set()
 
-    def auto_load_last_profile(self):
-        if os.path.exists(CONFIG_FILE):
+        self.control_call.emit(call)
+        if not done.wait(CONTROL_TIMEOUT):
+            raise TimeoutError("GUI did not respond")
+        if "error" in result:
+            raise ControlError(str(result["error"]))
+        return result.get("value")
+
+    # A bound method so the connection is queued onto the GUI thread
+    # noinspection PyMethodMayBeStatic
+    def run_control_call(self, call):
+        call()
+
+    def control_status(self):
+        process = self.supervisor.process
+        return {
+            "running": self.watcher.is_running(),
+            "pid": process.pid if process is not None and process.poll() is None else None,
+            "profile": self.store.active,
+            "command": self.supervisor.command,
+            "stats": self.supervisor.stats.as_dict(),
+            "restart_pending": self.supervisor.restart_pending,
+            "circuit_open": self.supervisor.circuit_open,
+            "instances": self.instances.status() if self.instances is not None else {},
+        }
+
+    def control_stop(self):
+        elapsed = self.stop_all()
+        self.output.push("GoodByeDPI Stopped...")
+        return elapsed
+
+    def control_reload(self):
+        self.store.reload()
+        self.switch_profile_worker(self.store.active)
+        return self.supervisor.command
+
+    def control_tail_log(self, lines=CONTROL_TAIL_LINES):
+        try:
+            lines = int(lines)
+        except (TypeError, ValueError):
+            raise ControlError(f"Line count must be a number: {lines}") from None
+        if lines < 1:
+            raise ControlError(f"Line count must be at least 1: {lines}")
+        return self.events.tail(lines)
+
+    def control_switch_profile(self, name):
+        self.store.reload()
+        if name not in self.store:
+            raise ControlError(f"Unknown profile: {name}")
+        self.call_in_gui(self.switch_profile, name)
+
+    # A profile pulled from the URL or shared file in remote_profile.json; without it nothing is started
+    def start_remote_profiles(self):
+        if not os.path.exists(REMOTE_CONFIG):
+            return None
+        try:
+            sync = RemoteProfileSync.from_config(
+                lambda name, profile: self.on_remote_profile(name, profile, sync.activate), self.output.push)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            self.output.push(f"Remote profile disabled: {e}")
+            return None
+        sync.start()
+        return sync
+
+    # Runs on the sync thread. The process is only restarted when the effective argv changed.
+    def on_remote_profile(self, name, profile, activate):
+        if not self.store.save(name, profile):
+            return
+        self.output.push(f"Remote profile '{name}' updated")
+        if activate or self.store.active == name:
+            self.switch_profile_worker(name)
+
+    # Without dns_select.json the default resolver list is only tested on demand from the tray menu
+    def start_dns_selector(self):
+        selector = DnsSelector(DnsBenchmark(), self.on_dns_selected, self.output.push, redirected=self.dns_redirected)
+        if os.path.exists(DNS_CONFIG):
             try:
-                self.load_profile()
-            except Exception as e:
-                self.exception_msg = f"Failed to auto-load last profile: {e}"
-                self.exception_show_msg()
+                selector = DnsSelector.from_config(self.on_dns_selected, self.output.push,
+                                                   redirected=self.dns_redirected)
+            except (OSError, ValueError, TypeError, KeyError) as e:
+                self.output.push(f"DNS selection schedule disabled: {e}")
+        selector.start()
+        return selector
+
+    def dns_redirected(self):
+        supervisors = [self.supervisor] + ([s for _, s in self.instances] if self.instances is not None else [])
+        return set().union(*(redirected_versions(s.command) for s in supervisors if s.active()))
 
-    # noinspection PyTypeChecker
-    def save_last_profile_path(self, path):
+    def pick_fastest_dns(self):
+        self.output.push("Testing DNS resolvers...")
+        threading.Thread(target=self.dns.evaluate, name="dns-select", daemon=True).start()
+
+    # Hits are counted from --dns-verb lines; the report covers the --blacklist sources of the current profile
+    def blacklist_report(self):
+        text = self.current_profile().get("line_values", {}).get("--blacklist", "")
+        paths = [path.strip() for path in text.split(";") if path.strip()]
+        if not paths:
+            self.output.push("No --blacklist set in the current profile")
+            return
+        threading.Thread(target=self.blacklist_report_worker, args=(paths,), daemon=True).start()
+
+    def blacklist_report_worker(self, paths):
+        self.hits.flush()
         try:
-            with open(CONFIG_FILE, "w") as f:
-                json.dump({"last_profile": path}, f)
+            report = analyze(paths)
+            with open(REPORT_FILE, "w") as f:
+                f.write(format_report(report))
+            write_pruned(report, PRUNED_FILE)
+        except OSError as e:
+            self.output.push(f"Blacklist report failed: {e}")
+            return
+        self.output.push(f"Blacklist: {len(report['kept'])} of {report['entries']} entries hit, "
+                         f"{len(report['never'])} never hit. Report in {REPORT_FILE}, "
+                         f"pruned list in {PRUNED_FILE}")
 
-            self.output_box.append("Settings Saved and Will Be Loaded Automatically on Application Start.")
+    # Runs on the selector thread. The active profile is updated and applied like a remote profile update.
+    def on_dns_selected(self, selection, results):
+        self.output.push("DNS resolvers (* selected):\n" + "\n".join(format_results(results, selection)))
+        name = self.store.active
+        try:
+            profile = with_resolvers(self.store.load(name), selection)
+        except (OSError, ValueError, KeyError) as e:
+            self.output.push(f"Failed to load profile '{name}': {e}")
+            return
+        if not self.store.save(name, profile):
+            self.output.push(f"Profile '{name}' already uses the fastest DNS resolvers")
+            return
+        self.output.push(f"Profile '{name}' now redirects DNS to "
+                         f"{', '.join(resolver.spec for resolver in selection.values())}")
+        self.switch_profile_worker(name)
+
+    # Runs on an executor thread of the probe loop
+    def on_health_failover(self, fallback, rate):
+        self.output.push(f"Connectivity degraded ({rate:.0%} of probes succeeding), failing over to {fallback}")
+        if fallback in MODES:
+            try:
+                cmd = build_command({"modeset": fallback})
+            except ProfileError as e:
+                self.output.push(f"Failover failed: {e}")
+                return
+            self.apply_command(cmd, f"Failover to preset {fallback}")
+        else:
+            self.switch_profile_worker(fallback)
+
+    def on_profile_switched(self, name, profile):
+        self.profile = profile
+        self.apply_profile(profile)
+        self.autosave_timer.stop()
+        self.refresh_profiles()
+
+    # noinspection SpellCheckingInspection
+    def apply_profile(self, profile):
+        if self.mode_combo is None:
+            return
+        self.applying_profile = True
+        try:
+            self.mode_combo.setCurrentText(profile.get("modeset", ""))
+            for k, v in profile.get("checkbox_flags", {}).items():
+                if k in self.checkbox_flags:
+                    self.checkbox_flags[k].setChecked(v)
+            for k, v in profile.get("spin_values", {}).items():
+                if k in self.spin_values:
+                    self.spin_values[k].setValue(v)
+            for k, v in profile.get("line_values", {}).items():
+                if k in self.line_values:
+                    self.line_values[k].setText(v)
+        finally:
+            self.applying_profile = False
+
+    def auto_load_last_profile(self):
+        if self.store.import_error:
+            self.exception_msg = self.store.import_error
+            self.exception_show_msg()
+        try:
+            self.profile = self.store.load()
         except Exception as e:
-            self.exception_msg = f"Failed to save config: {e}"
+            self.exception_msg = f"Failed to auto-load last profile: {e}"
             self.exception_show_msg()
 
     # noinspection SpellCheckingInspection
     def run_goodbyedpi(self):
-        if self.is_process_running("goodbyedpi.exe"):
-            self.output_box.append("\n> GoodByeDPI Already Running Won't Start a New Instance.\n")
+        if self.starting or self.watcher.owns_running() or self.external_pids():
+            self.output.push("\n> GoodByeDPI Already Running Won't Start a New Instance.\n")
+            return
+        else:
+            self.clear_output()
+            # The profile is read from the widgets here; blacklist compilation and the spawn happen on a worker
+            self.starting = True
+            threading.Thread(target=self.run_goodbyedpi_worker, args=(self.current_profile(),), name="start",
+                             daemon=True).start()
+
+    def run_goodbyedpi_worker(self, profile):
+        try:
+            try:
+                cmd = build_command(profile, on_message=self.output.push)
+            except ProfileError as e:
+                self.output.push(f"Invalid profile: {e}")
+                return
+            self.output.push(f"\n> {' '.join(cmd)}\n")
+            self.command = cmd
+            self.log_sink.set_command(cmd)
+            self.run(cmd)
+        finally:
+            self.starting = False
+        if self.instances is not None:
+            self.instances.start_all(self.output.push)
+
+    # Extra instances from instances.json, each running its own profile; without it there is only the main one
+    def load_instances(self):
+        if not os.path.exists(INSTANCES_CONFIG):
+            return None
+        try:
+            return InstanceGroup.from_config(self.store, self.output, self.multiplexer, scanner=self.watcher.scanner,
+                                             exclude=self.owned_pids)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.output.push(f"Instances disabled: {e}")
+            return None
+
+    # Built each time the menu opens, so the states are current without touching widgets from other threads
+    def refresh_instances_menu(self):
+        self.instances_menu.clear()
+        for (name, supervisor), line in zip(self.instances, self.instances.status_lines()):
+            action = QAction(line, self.instances_menu)
+            action.setCheckable(True)
+            action.setChecked(supervisor.owned_pid() is not None)
+            action.toggled.connect(lambda enabled, instance=name: self.toggle_instance(instance, enabled))
+            self.instances_menu.addAction(action)
+
+    def toggle_instance(self, name, enabled):
+        if enabled:
+            target, args = self.instances.start, (name, self.output.push)
+        else:
+            target, args = self.instances.stop, (name,)
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+    def owned_pids(self):
+        pids = self.instances.owned_pids() if self.instances is not None else set()
+        if self.supervisor.owned_pid() is not None:
+            pids.add(self.supervisor.owned_pid())
+        return pids
+
+    def external_pids(self):
+        owned = self.owned_pids()
+        return [pid for pid in self.watcher.scanner.find_all(PROCESS_NAME) if pid not in owned]
+
+    def flush_output(self):
+        batch = self.output.take_batch()
+        if batch is None:
             return
+        if self.filter_active():
+            self.refresh_event_view()
         else:
+            self.output_box.appendPlainText(batch)
+
+    def filter_active(self):
+        return self.event_filter.currentData() is not None or bool(self.search_line.text().strip())
+
+    # Filtered views are answered from the event store indexes, so the cost depends on the number of lines
+    # shown rather than on the length of the log
+    def refresh_event_view(self):
+        event_type = self.event_filter.currentData()
+        text = self.search_line.text().strip()
+        if event_type is None and not text:
+            lines = self.events.tail(OUTPUT_MAX_LINES)
+        elif self.events.has_host(text):
+            lines = self.events.query(event_type, host=text, limit=EVENT_VIEW_LINES)
+        else:
+            lines = self.events.query(event_type, text=text, limit=EVENT_VIEW_LINES)
+        self.output_box.setPlainText("\n".join(lines))
+        self.output_box.moveCursor(QTextCursor.MoveOperation.End)
+
+    def clear_output(self):
+        self.output.clear()
+        if self.output_box is not None:
             self.output_box.clear()
-            cmd = [r"bin/goodbyedpi.exe"]
-            mode = self.mode_combo.currentText()
-            if mode:
-                cmd.append(mode)  # Preset mode like "-9"
-            else:
-                # Only append flags manually if no preset mode is selected
-                for flag, cb in self.checkbox_flags.items():
-                    if cb.isChecked():
-                        cmd.append(flag)
-
-                for flag, spin in self.spin_values.items():
-                    if spin.value() > 0:
-                        cmd.extend([flag, str(spin.value())])
-
-                for flag, le in self.line_values.items():
-                    text = le.text().strip()
-                    if text:
-                        cmd.extend([flag, text])
-
-            self.output_box.append(f"\n> {' '.join(cmd)}\n")
-            if not self.output_connected:
-                self.output_signal.connect(self.output_box.append)
-                self.output_connected = True
-            self.command = " ".join(cmd)
-            self.run()
-
-    def process_output(self, process):
-        for line in process.stdout:
-            self.output_signal.emit(line)
 
     # noinspection SpellCheckingInspection
-    def run(self):
+    def run(self, cmd):
         try:
-            process = subprocess.Popen(
-                self.command,
-                creationflags=subprocess.CREATE_NO_WINDOW,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                shell=False
-            )
-
-            self.command_runner.run = lambda: self.process_output(process)
-            self.command_runner.start()
-
-            status = self.is_process_running("goodbyedpi.exe")
+            process = self.supervisor.start(cmd)
+            status = process.poll() is None
             if status:
-                self.output_box.append("GoodByeDPI Is Running...")
+                self.output.push("GoodByeDPI Is Running...")
             else:
-                self.output_box.append("GoodByeDPI Is Failed to Start...")
+                self.output.push("GoodByeDPI Is Failed to Start...")
 
         except Exception as e:
-            self.output_signal.emit(f"Error: {e}")
+            self.output.push(f"Error: {e}")
 
     # noinspection SpellCheckingInspection
     def update_tray_icon(self):
+        last_status = None
+        last_tooltip = None
         while not self.exiting:
-            status = self.is_process_running("goodbyedpi.exe")
-            if status:
-                self.tray.setToolTip("GoodByeDPI Running")
-                self.tray.setIcon(QIcon(r"Resources\Icon1.ico"))
-                time.sleep(3)
-            else:
-                self.tray.setToolTip("GoodByeDPI Stopped")
-                self.tray.setIcon(QIcon(r"Resources\forbidden.ico"))
-                time.sleep(3)
-
-    @staticmethod
-    def is_process_running(process_name):
-        process_query_limited_information = 0x1000
-        try:
-            processes = (ctypes.c_ulong * 2048)()  # noqa
-            cb = ctypes.c_ulong(ctypes.sizeof(processes))
-            ctypes.windll.psapi.EnumProcesses(ctypes.byref(processes), cb, ctypes.byref(cb))
-
-            process_count = cb.value // ctypes.sizeof(ctypes.c_ulong)
-            for i in range(process_count):
-                process_id = processes[i]
-                process_handle = ctypes.windll.kernel32.OpenProcess(process_query_limited_information, False,
-                                                                    process_id)
-
-                if process_handle:
-                    buffer_size = 260
-                    buffer = ctypes.create_unicode_buffer(buffer_size)
-                    success = ctypes.windll.kernel32.QueryFullProcessImageNameW(process_handle, 0, buffer,
-                                                                                ctypes.byref(
-                                                                                    ctypes.c_ulong(buffer_size)))
-                    ctypes.windll.kernel32.CloseHandle(process_handle)
-
-                    if success:
-                        process_name_actual = os.path.basename(buffer.value)
-                        if process_name_actual == process_name:
-                            return True
-            return False
-
-        except (ctypes.ArgumentError, OSError, ValueError):
-            return False
+            status = self.watcher.is_running()
+            if status != last_status:
+                if status:
+                    self.tray.setIcon(QIcon(r"Resources\Icon1.ico"))
+                else:
+                    self.tray.setIcon(QIcon(r"Resources\forbidden.ico"))
+                last_status = status
+            tooltip = self.supervisor.status_text()
+            if self.instances is not None:
+                tooltip = "\n".join([tooltip] + self.instances.status_lines())
+            if tooltip != last_tooltip:
+                self.tray.setToolTip(tooltip)
+                last_tooltip = tooltip
+            # Wakes up as soon as the child we own exits or the app quits instead of sleeping out the interval
+            self.watcher.wait(3, self.exit_requested)
 
 if __name__ == "__main__":
-    import os
     os.environ["QT_SCALE_FACTOR"] = "0.9"
     app = QApplication(sys.argv)
     gui = GoodbyeDPIGUI()
@@ -0,0 +1,214 @@
+import os
+import sys
+import argparse
+
+from startup_trace import StartupTrace
+TRACE = StartupTrace.from_env()
+from goodbyedpi_core import MODES, ProfileError, Supervisor, build_command, read_profile
+from profile_store import ProfileStore
+from output_mux import OutputMultiplexer
+from instances import INSTANCES_CONFIG, InstanceGroup
+from health_probe import HEALTH_CONFIG, HealthMonitor
+from profile_remote import REMOTE_CONFIG, RemoteProfileSync
+from blacklist_hits import HitCounter
+from dns_select import DNS_CONFIG, DnsBenchmark, DnsSelector, format_results, redirected_versions, with_resolvers
+from metrics import METRICS_ENV, MetricsCollector, MetricsServer, parse_address
+from log_sink import RotatingLogSink
+TRACE.mark("imports")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run and supervise GoodByeDPI without the GUI")
+    parser.add_argument("--profile", help="profile name or profile file to load (default: the active profile)")
+    parser.add_argument("--no-log", action="store_true", help="do not write the rotating log file")
+    parser.add_argument("--quiet", action="store_true", help="do not echo goodbyedpi output")
+    parser.add_argument("--no-restart", action="store_true", help="exit when goodbyedpi exits")
+    parser.add_argument("--dry-run", action="store_true", help="print the command and exit")
+    parser.add_argument("--metrics", metavar="[HOST:]PORT", default=os.environ.get(METRICS_ENV),
+                        help="serve Prometheus and JSON metrics on this address")
+    parser.add_argument("--pick-dns", action="store_true",
+                        help="redirect DNS to the fastest resolver before starting (resolvers from dns_select.json)")
+    args = parser.parse_args(argv)
+
+    store = ProfileStore()
+    if store.import_error:
+        print(store.import_error, file=sys.stderr)
+    from_file = bool(args.profile and os.path.isfile(args.profile))
+    try:
+        if from_file:
+            profile = read_profile(args.profile)
+        else:
+            profile = store.load(args.profile)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Failed to load profile: {e}", file=sys.stderr)
+        return 2
+    active = {"name": args.profile or store.active, "profile": profile}
+    supervisor = None
+
+    def dns_update(selection, results):
+        say = print if supervisor is None else supervisor.output.push
+        updated = with_resolvers(active["profile"], selection)
+        # Scheduled re-evaluations only report when the choice changes
+        if updated == active["profile"] and supervisor is not None:
+            return
+        say("DNS resolvers (* selected):\n" + "\n".join(format_results(results, selection)))
+        if updated == active["profile"]:
+            return
+        active["profile"] = updated
+        if not (from_file or args.dry_run):
+            store.save(active["name"], updated)
+        say(f"DNS redirected to {', '.join(resolver.spec for resolver in selection.values())}")
+        if supervisor is None or not supervisor.active():
+            return
+        try:
+            dns_cmd = build_command(updated)
+        except ProfileError as error:
+            say(f"Invalid profile: {error}")
+            return
+        if log_sink is not None and dns_cmd != supervisor.command:
+            log_sink.set_command(dns_cmd)
+        supervisor.apply(dns_cmd)
+
+    def dns_redirected():
+        if supervisor is None or not supervisor.active():
+            return set()
+        return redirected_versions(supervisor.command)
+
+    dns = None
+    if args.pick_dns or os.path.exists(DNS_CONFIG):
+        try:
+            if os.path.exists(DNS_CONFIG):
+                dns = DnsSelector.from_config(dns_update, print, redirected=dns_redirected)
+            else:
+                dns = DnsSelector(DnsBenchmark(), dns_update, print, redirected=dns_redirected)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f"DNS selection disabled: {e}", file=sys.stderr)
+    if args.pick_dns and dns is not None:
+        dns.evaluate()
+    try:
+        cmd = build_command(active["profile"], on_message=print)
+    except ProfileError as e:
+        print(f"Invalid profile: {e}", file=sys.stderr)
+        return 2
+    TRACE.mark("profile load")
+    print(f"> {' '.join(cmd)}", flush=True)
+    if args.dry_run:
+        return 0
+
+    multiplexer = OutputMultiplexer()
+    supervisor = Supervisor(auto_restart=not args.no_restart, multiplexer=multiplexer)
+    log_sink = None
+    if not args.no_log:
+        log_sink = RotatingLogSink()
+        log_sink.set_command(cmd)
+        supervisor.output.add_sink(log_sink.write)
+    hits = HitCounter()
+    supervisor.output.add_sink(hits.add_line)
+    if not args.quiet:
+        supervisor.output.add_sink(lambda line: print(line, flush=True))
+    if dns is not None:
+        dns.on_error = supervisor.output.push
+
+    def failover(fallback, rate):
+        supervisor.output.push(f"Connectivity degraded ({rate:.0%} of probes succeeding), failing over to {fallback}")
+        try:
+            fallback_profile = {"modeset": fallback} if fallback in MODES else store.load(fallback)
+            fallback_cmd = build_command(fallback_profile)
+        except (OSError, ValueError, KeyError) as error:
+            supervisor.output.push(f"Failover failed: {error}")
+            return
+        active.update(name=fallback, profile=fallback_profile)
+        if log_sink is not None:
+            log_sink.set_command(fallback_cmd)
+        supervisor.apply(fallback_cmd)
+
+    def remote_update(name, remote_profile):
+        if not store.save(name, remote_profile):
+            return
+        supervisor.output.push(f"Remote profile '{name}' updated")
+        if not (remote.activate or active["name"] == name):
+            return
+        try:
+            remote_cmd = build_command(remote_profile)
+        except ProfileError as error:
+            supervisor.output.push(f"Invalid remote profile: {error}")
+            return
+        active.update(name=name, profile=remote_profile)
+        store.set_active(name)
+        if log_sink is not None and remote_cmd != supervisor.command:
+            log_sink.set_command(remote_cmd)
+        supervisor.apply(remote_cmd)
+
+    # A malformed optional config disables that feature, like in the GUI, instead of stopping the runner
+    instances = None
+    if os.path.exists(INSTANCES_CONFIG):
+        try:
+            instances = InstanceGroup.from_config(store, supervisor.output, multiplexer)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f"Instances disabled: {e}", file=sys.stderr)
+        else:
+            for _, instance in instances:
+                instance.auto_restart = not args.no_restart
+    remote = None
+    if os.path.exists(REMOTE_CONFIG):
+        try:
+            remote = RemoteProfileSync.from_config(remote_update, supervisor.output.push)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f"Remote profile disabled: {e}", file=sys.stderr)
+    health = None
+    if os.path.exists(HEALTH_CONFIG):
+        try:
+            health = HealthMonitor.from_config(on_failover=failover, is_active=supervisor.active)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f"Health probes disabled: {e}", file=sys.stderr)
+    metrics = None
+    if args.metrics:
+        collector = MetricsCollector(supervisor, profile=lambda: (active["name"], active["profile"]), health=health)
+        try:
+            metrics = MetricsServer(collector, *parse_address(args.metrics))
+        except (OSError, ValueError) as e:
+            print(f"Metrics endpoint disabled: {e}", file=sys.stderr)
+    try:
+        supervisor.start(cmd)
+        if instances is not None:
+            instances.start_all(print)
+        TRACE.mark("spawn")
+        hits.start()
+        if health is not None:
+            health.start()
+        if remote is not None:
+            remote.start()
+        if dns is not None:
+            dns.start()
+        if metrics is not None:
+            metrics.start()
+        # Crashes are restarted by the supervisor; this returns once it gives up (crash loop)
+        while supervisor.active() or (instances is not None and instances.active()):
+            supervisor.watcher.wait(1)
+        supervisor.reader.join(1)
+        return supervisor.stats.last_exit_code or 0
+    except KeyboardInterrupt:
+        if instances is not None:
+            instances.stop_all()
+        supervisor.stop()
+        return 0
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if remote is not None:
+            remote.stop()
+        if dns is not None:
+            dns.stop()
+        if metrics is not None:
+            metrics.stop()
+        if health is not None:
+            health.stop()
+        multiplexer.stop()
+        hits.stop()
+        if log_sink is not None:
+            log_sink.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
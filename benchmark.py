@@ -0,0 +1,637 @@
+import os
+import sys
+import json
+import time
+import random
+import ctypes
+import struct
+import asyncio
+import argparse
+import importlib.util
+import platform
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+from contextlib import contextmanager
+
+import goodbyedpi_core
+from output_pipeline import OutputPipeline, TaggedOutput
+from output_mux import OutputMultiplexer
+from output_events import EVENT_STORE_CAPACITY, EventStore
+from goodbyedpi_core import FLAGS, MODES, RestartPolicy, Supervisor, build_argv
+from process_watcher import PROCESS_NAME, create_scanner
+from profile_store import ProfileStore
+from goodbyedpi_stub import STUB_ENV
+from blacklist_hits import HitCounter, analyze
+from dns_select import DnsBenchmark, Resolver, select
+from startup_trace import TRACE_ENV
+
+
+SAMPLE_LINE = "[DNS] 192.168.1.10:53124 -> 1.1.1.1:1253 request for example-{0}.com"
+
+
+def bench_output(lines=1_000_000, flush_interval=0.1, view_max_lines=5000):
+    # Producer pushes synthetic stdout lines as fast as it can while a consumer drains batches on a
+    # fixed interval, the same way the GUI timer does. The consumer keeps a bounded list standing in
+    # for the log view.
+    pipeline = OutputPipeline()
+    view = []
+    batches = 0
+    done = threading.Event()
+
+    def consume():
+        nonlocal batches, view
+        while True:
+            finished = done.is_set()
+            batch = pipeline.take_batch()
+            if batch is not None:
+                batches += 1
+                view.extend(batch.split("\n"))
+                if len(view) > view_max_lines:
+                    view = view[-view_max_lines:]
+            if finished:
+                return
+            time.sleep(flush_interval)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    start = time.perf_counter()
+    for i in range(lines):
+        pipeline.push(SAMPLE_LINE.format(i))
+    produced = time.perf_counter() - start
+    done.set()
+    consumer.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "lines": lines,
+        "push_seconds": round(produced, 4),
+        "total_seconds": round(elapsed, 4),
+        "lines_per_second": round(lines / produced),
+        "batches": batches,
+        "dropped": pipeline.buffer.dropped,
+        "view_lines": len(view),
+    }
+
+
+# One startup banner and option block followed by a mix of DNS redirects, warnings and errors, roughly what a
+# long --dns-verb run looks like
+EVENT_HEADER = [
+    "GoodbyeDPI 0.2.2: Passive DPI blocker and Active DPI circumvention utility",
+    "https://github.com/ValdikSS/GoodbyeDPI",
+    "Block passive: 1",
+    "Fragment HTTP: 2",
+    "Fragment HTTPS: 2",
+    "Opening filter",
+    "Filter activated, GoodbyeDPI is now running!",
+]
+EVENT_LINES = [
+    SAMPLE_LINE,
+    SAMPLE_LINE,
+    SAMPLE_LINE,
+    "[DNS] 192.168.1.10:53124 <- 1.1.1.1:1253 response for example-{0}.com",
+    "Warning: TCP window for host-{0}.net is too small",
+    "Error: could not send packet {0}",
+    "Connection {0} reset",
+]
+
+
+def bench_events(lines=1_000_000, queries=200):
+    # The GUI's store at its default capacities: a million lines stream through it, the newest are queried.
+    # Memory is the steady state after twice the total capacity has streamed through a fresh store.
+    synthetic = EVENT_HEADER + [EVENT_LINES[i % len(EVENT_LINES)].format(i % 5000) for i in range(lines)]
+    store = EventStore()
+    start = time.perf_counter()
+    for line in synthetic:
+        store.add(line)
+    parse_seconds = time.perf_counter() - start
+    tracemalloc.start()
+    full = EventStore()
+    for line in synthetic[:EVENT_STORE_CAPACITY * 2]:
+        full.add(line)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del full
+
+    def latency(**kwargs):
+        # Median of `queries` runs, in milliseconds
+        samples = []
+        for _ in range(queries):
+            begin = time.perf_counter()
+            store.query(**kwargs)
+            samples.append(time.perf_counter() - begin)
+        samples.sort()
+        return round(samples[len(samples) // 2] * 1000, 4)
+
+    return {
+        "lines": len(synthetic),
+        "parse_seconds": round(parse_seconds, 4),
+        "lines_per_second": round(len(synthetic) / parse_seconds),
+        "retained": len(store),
+        "memory_mib": round(memory / 2 ** 20, 2),
+        "counts": store.counts(),
+        "hosts": len(store.hosts()),
+        "query_ms": {
+            "latest": latency(),
+            "type_error": latency(event_type="error"),
+            "type_banner": latency(event_type="banner"),
+            "host": latency(host="example-42.com"),
+            "host_and_type": latency(host="example-42.com", event_type="dns"),
+            "text_common": latency(text="response"),
+            "text_rare": latency(text="packet 4999", limit=10),
+        },
+    }
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + [
+        (name, ctypes.c_size_t) for name in ("PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                                             "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                                             "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+
+def win32_peak_rss_kib(process):
+    # Peak working set of a child on Windows, which has no wait4; the handle stays valid after it exits
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    # noinspection PyProtectedMember
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(int(process._handle), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize // 1024
+
+
+def wait_rss_kib(process):
+    # Reaps the child and returns its peak RSS in KiB, or None where it cannot be read. A child that poll()
+    # already reaped has no rusage left to collect on POSIX.
+    if hasattr(os, "wait4") and process.returncode is None:
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return usage.ru_maxrss
+    process.wait()
+    return win32_peak_rss_kib(process) if sys.platform == "win32" else None
+
+
+def measure_process(cmd, runs=5):
+    # Wall time and peak RSS (KiB) of a child process, best of runs
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        rss = wait_rss_kib(process)
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            return {"error": process.stderr.read().decode(errors="replace").strip().splitlines()[-1:]}
+        process.stderr.close()
+        if best is None or elapsed < best["seconds"]:
+            best = {"seconds": round(elapsed, 4), "max_rss_kib": rss}
+    return best
+
+
+def read_trace(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)["phases"]
+    except (OSError, ValueError, KeyError):
+        return []
+
+
+def measure_startup_trace(cmd, last_phase, runs=5, timeout=60.0):
+    # Per-phase timings of the real __main__ path, read from the startup trace the process writes. The GUI
+    # never exits on its own, so it is killed once last_phase is recorded. It runs in an empty directory:
+    # no saved profile and no bin/goodbyedpi.exe, so the spawn fails fast instead of starting anything.
+    # The peak RSS is read when the process is reaped, so it covers startup up to that phase.
+    best = None
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            stderr_path = os.path.join(directory, "stderr.txt")
+            env = dict(os.environ, **{TRACE_ENV: path})
+            with open(stderr_path, "wb") as stderr:
+                start = time.perf_counter()
+                process = subprocess.Popen(cmd, cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+                phases = []
+                deadline = time.monotonic() + timeout
+                while time.monotonic() < deadline and process.poll() is None:
+                    phases = read_trace(path)
+                    if any(phase["phase"] == last_phase for phase in phases):
+                        break
+                    time.sleep(0.005)
+                elapsed = time.perf_counter() - start
+                if process.poll() is None:
+                    process.kill()
+                rss = wait_rss_kib(process)
+            phases = read_trace(path)
+            if not any(phase["phase"] == last_phase for phase in phases):
+                with open(stderr_path, "r", errors="replace") as f:
+                    tail = f.read().strip().splitlines()[-1:]
+                return {"error": tail or [f"no {last_phase!r} phase within {timeout:.0f}s"]}
+        if best is None or elapsed < best["seconds"]:
+            best = {"seconds": round(elapsed, 4), "max_rss_kib": rss,
+                    "phases": {phase["phase"]: phase["seconds"] for phase in phases}}
+    return best
+
+
+def bench_startup(runs=5):
+    # The headless figure is the whole --dry-run process; the GUI one is the real __main__ path up to the
+    # goodbyedpi spawn, split into the startup trace phases (imports, tray, profile load, spawn)
+    with tempfile.TemporaryDirectory() as directory:
+        profile = os.path.join(directory, "profile.json")
+        with open(profile, "w") as f:
+            json.dump({"modeset": "-9"}, f)
+        results = {
+            "headless": measure_process([sys.executable, "GoodByeDPI-Headless.py", "--dry-run",
+                                         "--profile", profile], runs),
+        }
+    missing = [module for module in ("PySide6", "winsound") if importlib.util.find_spec(module) is None]
+    if missing:
+        results["gui"] = {"skipped": f"needs {', '.join(missing)}"}
+    else:
+        results["gui"] = measure_startup_trace([sys.executable, os.path.join(HERE, "GoodByeDPI-GUI.py")], "spawn",
+                                               runs)
+    return results
+
+
+STUB_PATH = os.path.join(HERE, "goodbyedpi_stub.py")
+# Every option set, roughly the largest argv the settings window can produce
+FULL_PROFILE = {
+    "modeset": "",
+    "checkbox_flags": {name: True for name, flag in FLAGS.items() if flag.kind == "check"},
+    "spin_values": {name: max(1, flag.minimum or 0) for name, flag in FLAGS.items() if flag.kind == "spin"},
+    "line_values": {"--dns-addr": "77.88.8.8", "--dnsv6-addr": "2a02:6b8::feed:0ff"},
+}
+
+
+def timed(func, iterations):
+    # Mean microseconds per call
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return round((time.perf_counter() - start) / iterations * 1e6, 3)
+
+
+def stub_command(profile):
+    return [sys.executable, STUB_PATH] + build_argv(profile)[1:]
+
+
+@contextmanager
+def stub_settings(**settings):
+    saved = dict(os.environ)
+    os.environ.update({STUB_ENV + name.upper(): str(value) for name, value in settings.items()})
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def bench_argv(iterations=20000):
+    profiles = {mode: {"modeset": mode} for mode in MODES}
+    profiles["full"] = FULL_PROFILE
+
+    def cold():
+        for profile in profiles.values():
+            goodbyedpi_core._ARGV_CACHE.clear()
+            build_argv(profile)
+
+    def cached():
+        for profile in profiles.values():
+            build_argv(profile)
+
+    return {
+        "profiles": len(profiles),
+        "full_argv_length": len(build_argv(FULL_PROFILE)),
+        "cold_us_per_profile": round(timed(cold, iterations // 10) / len(profiles), 3),
+        "cached_us_per_profile": round(timed(cached, iterations) / len(profiles), 3),
+    }
+
+
+def bench_profiles(count=50, iterations=200):
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        store = ProfileStore(os.path.join(directory, "profiles"), legacy_file=None)
+        open_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for i in range(count):
+            store.save(f"profile {i}", dict(FULL_PROFILE, modeset=list(MODES)[i % len(MODES)]))
+        save_ms = (time.perf_counter() - start) * 1000 / count
+        return {
+            "profiles": count,
+            "open_empty_ms": round(open_ms, 3),
+            "save_ms": round(save_ms, 3),
+            "save_unchanged_us": timed(lambda: store.save("profile 0", store.load("profile 0")), iterations),
+            "load_us": timed(lambda: store.load("profile 1"), iterations),
+            "names_us": timed(store.names, iterations),
+            "reload_us": timed(store.reload, iterations),
+        }
+
+
+def bench_status(iterations=200):
+    # Cost of the tray poll: the owned child is checked through its handle, anything else through a scan
+    with stub_settings(lines=0):
+        supervisor = Supervisor(auto_restart=False)
+        supervisor.start(stub_command({"modeset": "-9"}))
+        try:
+            watcher = supervisor.watcher
+            cold_scanner = create_scanner()
+            return {
+                "owned_us": timed(watcher.is_running, iterations * 10),
+                "scan_cold_us": timed(lambda: (cold_scanner._names.clear(), cold_scanner.find(PROCESS_NAME)),
+                                      max(1, iterations // 10)),
+                "scan_cached_us": timed(lambda: watcher.scanner.find(PROCESS_NAME), iterations),
+                "status_text_us": timed(supervisor.status_text, iterations * 10),
+            }
+        finally:
+            supervisor.stop()
+
+
+def first_line_latency(supervisor, command, timeout=10.0):
+    seen = threading.Event()
+    supervisor.output.add_sink(lambda line: seen.set())
+    start = time.perf_counter()
+    supervisor.start(command)
+    seen.wait(timeout)
+    return time.perf_counter() - start
+
+
+def bench_lifecycle(runs=5, stop_timeout=0.5):
+    # Start: until the first output line arrives. Stop: graceful, and with a child ignoring SIGTERM so the
+    # kill escalation is measured. Recover: crash to restarted process with a minimal backoff.
+    start_ms, stop_ms, kill_ms = [], [], []
+    for _ in range(runs):
+        with stub_settings(lines=0):
+            supervisor = Supervisor(auto_restart=False)
+            start_ms.append(first_line_latency(supervisor, stub_command({"modeset": "-9"})) * 1000)
+            stop_ms.append(supervisor.stop(stop_timeout) * 1000)
+        with stub_settings(lines=0, ignore_term=1):
+            supervisor = Supervisor(auto_restart=False)
+            first_line_latency(supervisor, stub_command({"modeset": "-9"}))
+            kill_ms.append(supervisor.stop(stop_timeout) * 1000)
+    with stub_settings(lines=0, crash_after=0.2, exit_code=3):
+        policy = RestartPolicy(base_delay=0.05, multiplier=1, jitter=0, crash_loop_limit=runs + 1)
+        supervisor = Supervisor(policy=policy)
+        supervisor.start(stub_command({"modeset": "-9"}))
+        deadline = time.monotonic() + 10
+        while supervisor.stats.restarts < runs and time.monotonic() < deadline:
+            time.sleep(0.05)
+        supervisor.stop(stop_timeout)
+    if platform.system() == "Windows":
+        kill_ms = None
+    return {
+        "runs": runs,
+        "start_ms": round(min(start_ms), 3),
+        "stop_ms": round(min(stop_ms), 3),
+        "stop_escalated_ms": round(min(kill_ms), 3) if kill_ms else None,
+        "recover_seconds": supervisor.stats.last_recover_seconds,
+        "restarts": supervisor.stats.restarts,
+    }
+
+
+def bench_stub_output(lines=200_000, flush_interval=0.1):
+    # End to end: the stub writes as fast as it can, the supervisor's reader pushes into the pipeline and
+    # a consumer drains it on the GUI timer interval
+    received = 0
+    done = threading.Event()
+    with stub_settings(lines=lines, stay=0):
+        supervisor = Supervisor(auto_restart=False)
+        pipeline = supervisor.output
+
+        def consume():
+            nonlocal received
+            while True:
+                finished = done.is_set()
+                batch = pipeline.take_batch()
+                if batch is not None:
+                    received += batch.count("\n") + 1
+                if finished:
+                    return
+                time.sleep(flush_interval)
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        start = time.perf_counter()
+        supervisor.start(stub_command({"modeset": "-9"}))
+        supervisor.watcher.wait(60)
+        supervisor.reader.join(60)
+        elapsed = time.perf_counter() - start
+        done.set()
+        consumer.join()
+    return {
+        "lines": pipeline.buffer.pushed,
+        "seconds": round(elapsed, 4),
+        "lines_per_second": round(pipeline.buffer.pushed / elapsed),
+        "dropped": pipeline.buffer.dropped,
+        "received": received,
+    }
+
+
+def bench_mux_output(instances=4, lines=50_000):
+    # Several stub instances writing at once into one pipeline, read by the single multiplexer thread
+    pipeline = OutputPipeline(capacity=instances * lines + 100)
+    multiplexer = OutputMultiplexer()
+    supervisors = [Supervisor(TaggedOutput(pipeline, f"i{i}"), auto_restart=False, multiplexer=multiplexer)
+                   for i in range(instances)]
+    threads_before = threading.active_count()
+    with stub_settings(lines=lines, stay=0):
+        start = time.perf_counter()
+        for supervisor in supervisors:
+            supervisor.start(stub_command({"modeset": "-9"}))
+        threads_running = threading.active_count()
+        # watcher.wait() sleeps out its timeout once the process has exited, so wait for the pipes' EOF
+        for supervisor in supervisors:
+            supervisor.reader.join(60)
+        elapsed = time.perf_counter() - start
+    multiplexer.stop()
+    return {
+        "instances": instances,
+        "lines": pipeline.buffer.pushed,
+        "seconds": round(elapsed, 4),
+        "lines_per_second": round(pipeline.buffer.pushed / elapsed),
+        # The multiplexer thread plus one exit watcher per instance
+        "extra_threads": threads_running - threads_before,
+    }
+
+
+class StandInResolver(asyncio.DatagramProtocol):
+    # Local stand-in DNS server: answers every query with an empty NOERROR response after `delay` seconds,
+    # or drops it with probability `loss`
+    def __init__(self, delay=0.0, loss=0.0, rcode=0):
+        self.delay = delay
+        self.loss = loss
+        self.rcode = rcode
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12 or random.random() < self.loss:
+            return
+        query_id, flags = struct.unpack_from("!HH", data)
+        response = struct.pack("!HHHHHH", query_id, 0x8000 | flags & 0x0100 | 0x0080 | self.rcode, 1, 0, 0, 0)
+        response += data[12:]
+        asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, response, addr)
+
+
+# (delay, loss, rcode) per stand-in; the fastest one drops too many queries and one refuses everything, so
+# the 20 ms server is the right pick
+DNS_STAND_INS = [(0.002, 0.5, 0), (0.02, 0.0, 0), (0.05, 0.0, 0), (0.001, 0.0, 5)]
+
+
+def bench_dns_select(names=20, rounds=5):
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        servers = []
+        for delay, loss, rcode in DNS_STAND_INS:
+            transport, _ = await loop.create_datagram_endpoint(lambda: StandInResolver(delay, loss, rcode),
+                                                               local_addr=("127.0.0.1", 0))
+            servers.append(transport)
+        resolvers = [Resolver(f"127.0.0.1:{transport.get_extra_info('sockname')[1]}") for transport in servers]
+        benchmark = DnsBenchmark(resolvers, [f"name-{i}.example" for i in range(names)], rounds, timeout=0.5)
+        start = time.perf_counter()
+        results = await benchmark.run()
+        elapsed = time.perf_counter() - start
+        for transport in servers:
+            transport.close()
+        return resolvers, results, elapsed
+
+    resolvers, results, elapsed = asyncio.run(scenario())
+    selection = select(results)
+    queries = sum(stats.queries for stats in results.values())
+    return {
+        "queries": queries,
+        "seconds": round(elapsed, 4),
+        "queries_per_second": round(queries / elapsed),
+        "selected_expected": selection.get(4) is resolvers[1],
+        "resolvers": {f"delay={delay * 1000:g}ms loss={loss:g} rcode={rcode}": results[resolver.spec].as_dict()
+                      for (delay, loss, rcode), resolver in zip(DNS_STAND_INS, resolvers)},
+    }
+
+
+def bench_blacklist_hits(lines=1_000_000, entries=100_000, hosts=5000):
+    # Counting --dns-verb lines (one in four of the stream) into the on-disk hit log, then the pruning
+    # analysis of a large blacklist against it
+    directory = tempfile.mkdtemp()
+    blacklist = os.path.join(directory, "blacklist.txt")
+    with open(blacklist, "w") as f:
+        f.writelines(f"example-{i}.com\n" for i in range(entries))
+    stream = [SAMPLE_LINE.format(i % hosts) if i % 4 == 0 else f"goodbyedpi line {i}" for i in range(10_000)]
+    counter = HitCounter(os.path.join(directory, "hits.log"))
+    start = time.perf_counter()
+    for i in range(lines // len(stream)):
+        for line in stream:
+            counter.add_line(line)
+        if i % 10 == 0:
+            counter.flush()
+    counter.flush()
+    count_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    report = analyze([blacklist], counter.path)
+    analyze_seconds = time.perf_counter() - start
+    log_bytes = os.path.getsize(counter.path)
+    shutil.rmtree(directory)
+    return {
+        "lines": counter.lines,
+        "hits": counter.hits,
+        "lines_per_second": round(counter.lines / count_seconds),
+        "log_bytes": log_bytes,
+        "analyze_seconds": round(analyze_seconds, 4),
+        "entries_kept": len(report["kept"]),
+        "entries_never_hit": len(report["never"]),
+    }
+
+
+BENCHMARKS = {
+    "argv": bench_argv,
+    "profiles": bench_profiles,
+    "output": bench_output,
+    "stub_output": bench_stub_output,
+    "mux_output": bench_mux_output,
+    "events": bench_events,
+    "dns_select": bench_dns_select,
+    "blacklist_hits": bench_blacklist_hits,
+    "status": bench_status,
+    "lifecycle": bench_lifecycle,
+    "startup": bench_startup,
+}
+
+
+def metadata():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                  text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {
+        "revision": revision,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def lower_is_better(key):
+    name = key.rsplit(".", 1)[-1]
+    if name.endswith("per_second"):
+        return False
+    if name.endswith(("_ms", "_us", "seconds")) or name == "seconds":
+        return True
+    return None
+
+
+def compare(results, baseline, tolerance):
+    # Timings that got worse than the baseline by more than tolerance (a fraction)
+    previous = dict(flatten(baseline))
+    regressions = []
+    for key, value in flatten(results):
+        direction = lower_is_better(key)
+        old = previous.get(key)
+        if direction is None or not old:
+            continue
+        change = (value - old) / old if direction else (old - value) / old
+        if change > tolerance:
+            regressions.append({"metric": key, "baseline": old, "current": value, "change": round(change, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GoodByeDPI-GUI benchmarks")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--output", help="also write the results with run metadata to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="results file of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline as a fraction (default: 0.2)")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    results = {}
+    for name in args.names or BENCHMARKS:
+        results[name] = BENCHMARKS[name]()
+    report = {"meta": metadata(), "results": results}
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(results, baseline.get("results", baseline), args.tolerance)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
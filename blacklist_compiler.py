@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import json
+import hashlib
+
+
+BLACKLIST_CACHE_DIR = os.path.join("cache", "blacklists")
+# Compiled lists kept besides the one in use; every edit of a source list produces a new entry
+BLACKLIST_CACHE_ENTRIES = 8
+
+
+def normalize_host(line):
+    # Accepts plain host lines as well as URLs and "0.0.0.0 host" style entries; comments are dropped
+    line = line.split("#", 1)[0].strip()
+    if not line:
+        return None
+    if " " in line or "\t" in line:
+        line = line.split()[-1]
+    if "://" in line:
+        line = line.split("://", 1)[1]
+    line = line.split("/", 1)[0].split(":", 1)[0].lower()
+    if line.startswith("*."):
+        line = line[2:]
+    line = line.strip(".")
+    # goodbyedpi matches whole hosts and their subdomains only, any other wildcard would never match
+    if not line or "*" in line:
+        return None
+    try:
+        line = line.encode("idna").decode("ascii")
+    except UnicodeError:
+        if not line.isascii():
+            return None
+    return line
+
+
+class HostTrie:
+    # Hosts stored by reversed labels ("www.example.com" -> com, example, www). A node marked as terminal
+    # covers its whole subtree, since goodbyedpi matches subdomains of every blacklist entry.
+    def __init__(self):
+        self.root = {}
+
+    def add(self, host):
+        node = self.root
+        for label in reversed(host.split(".")):
+            if node.get(None):
+                return False
+            node = node.setdefault(label, {})
+        if node.get(None):
+            return False
+        node.clear()
+        node[None] = True
+        return True
+
+    def hosts(self):
+        stack = [(self.root, [])]
+        while stack:
+            node, labels = stack.pop()
+            for label, child in node.items():
+                if label is None:
+                    yield ".".join(reversed(labels))
+                else:
+                    stack.append((child, labels + [label]))
+
+
+def source_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def prune_cache(cache_dir, keep=BLACKLIST_CACHE_ENTRIES):
+    # Entries are ordered by the mtime of their compiled list, which a cache hit refreshes
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".txt"):
+            path = os.path.join(cache_dir, name)
+            try:
+                entries.append((os.stat(path).st_mtime_ns, path))
+            except OSError:
+                pass
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        for stale in (path, f"{path[:-len('.txt')]}.json"):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def compile_blacklists(paths, cache_dir=BLACKLIST_CACHE_DIR, keep=BLACKLIST_CACHE_ENTRIES):
+    # Returns (compiled_path, stats). The output is keyed by the hash of the source contents, so an
+    # unchanged set of lists is served from the cache without being parsed again.
+    start = time.perf_counter()
+    key = source_digest(paths)
+    output = os.path.join(cache_dir, f"{key[:16]}.txt")
+    stats_path = os.path.join(cache_dir, f"{key[:16]}.json")
+    stats = {"sources": len(paths), "input_entries": None, "output_entries": None, "cached": True}
+    if os.path.exists(output) and os.path.exists(stats_path):
+        with open(stats_path, "r") as f:
+            stats.update(json.load(f))
+        try:
+            os.utime(output)
+        except OSError:
+            pass
+    else:
+        trie = HostTrie()
+        entries = 0
+        for path in paths:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    host = normalize_host(line)
+                    if host:
+                        entries += 1
+                        trie.add(host)
+        hosts = sorted(trie.hosts())
+        os.makedirs(cache_dir, exist_ok=True)
+        temp = f"{output}.tmp"
+        with open(temp, "w", encoding="ascii") as f:
+            f.write("\n".join(hosts))
+            f.write("\n")
+        os.replace(temp, output)
+        stats.update(input_entries=entries, output_entries=len(hosts), cached=False)
+        # noinspection PyTypeChecker
+        with open(stats_path, "w") as f:
+            json.dump({"input_entries": entries, "output_entries": len(hosts)}, f)
+        prune_cache(cache_dir, keep)
+    stats["seconds"] = round(time.perf_counter() - start, 4)
+    return output, stats
+
+
+def format_stats(stats):
+    if stats["cached"]:
+        return (f"Blacklist unchanged: {stats['input_entries']} entries -> {stats['output_entries']},"
+                f" using cached list ({stats['seconds']}s)")
+    return (f"Blacklist compiled: {stats['input_entries']} entries from {stats['sources']} file(s)"
+            f" -> {stats['output_entries']} in {stats['seconds']}s")
+
+
+if __name__ == "__main__":
+    compiled, result = compile_blacklists(sys.argv[1:])
+    print(format_stats(result))
+    print(compiled)
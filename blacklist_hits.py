@@ -0,0 +1,263 @@
+import os
+import sys
+import gzip
+import time
+import argparse
+import threading
+
+from blacklist_compiler import normalize_host
+from output_events import HOST_PATTERN
+
+
+HITS_FILE = os.path.join("cache", "blacklist_hits.log")
+PRUNED_FILE = "blacklist_pruned.txt"
+REPORT_FILE = "blacklist_report.txt"
+# The log is rewritten as one line per host once it holds this many lines per distinct host
+COMPACT_RATIO = 4
+
+
+def line_host(line):
+    # The queried name of a --dns-verb line, or None. Lines without "dns" are rejected before any lower-casing
+    # or regex work, since they are the bulk of the output.
+    if "DNS" not in line and "dns" not in line:
+        return None
+    lower = line.lower()
+    last = lower.rsplit(None, 1)[-1].rstrip(".") if lower.strip() else ""
+    if HOST_PATTERN.fullmatch(last):
+        return last
+    found = HOST_PATTERN.search(lower)
+    return found.group(1) if found else None
+
+
+def read_hits(path=HITS_FILE):
+    # Folds the append-only log into {host: [hits, last seen]}. Only distinct hosts are held in memory; a
+    # truncated last line from an interrupted append is skipped.
+    hits = {}
+    records = 0
+    try:
+        f = open(path, "r", encoding="ascii", errors="replace")
+    except FileNotFoundError:
+        return hits, records
+    with f:
+        for record in f:
+            parts = record.split("\t")
+            if len(parts) != 3 or not record.endswith("\n"):
+                continue
+            try:
+                seen, count = int(parts[0]), int(parts[1])
+            except ValueError:
+                continue
+            records += 1
+            host = parts[2].rstrip("\n")
+            entry = hits.get(host)
+            if entry is None:
+                hits[host] = [count, seen]
+            else:
+                entry[0] += count
+                entry[1] = max(entry[1], seen)
+    return hits, records
+
+
+class HitCounter:
+    # Per-host hit counts from the goodbyedpi output stream. add_line() only updates an in-memory dict of
+    # hosts seen since the last flush; flush() appends "<time>\t<hits>\t<host>" lines to `path`, so a
+    # flush costs one small append no matter how long the history is. The log is compacted in place when
+    # it has grown to COMPACT_RATIO lines per distinct host.
+    def __init__(self, path=HITS_FILE, flush_interval=60.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.lines = 0
+        self.hits = 0
+        self._records = None
+        self._hosts = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_line(self, line):
+        self.lines += 1
+        host = line_host(line)
+        if host is not None:
+            self.add(host)
+
+    def add(self, host, count=1):
+        with self._lock:
+            self.pending[host] = self.pending.get(host, 0) + count
+            self.hits += count
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="blacklist-hits", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def run(self):
+        # A failed flush (disk full, the log locked by a virus scanner) keeps its counts for the next interval
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        now = int(time.time())
+        with self._flush_lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="ascii", errors="replace") as f:
+                    f.writelines(f"{now}\t{count}\t{host}\n" for host, count in pending.items())
+            except OSError:
+                with self._lock:
+                    for host, count in pending.items():
+                        self.pending[host] = self.pending.get(host, 0) + count
+                raise
+            # The first flush reads the existing log once to learn its size
+            if self._records is None:
+                self.compact()
+            else:
+                self._records += len(pending)
+                if self._records > COMPACT_RATIO * max(1, self._hosts):
+                    self.compact()
+        return len(pending)
+
+    def compact(self):
+        # Rewrites the log as one line per host; appends from other processes during the rewrite are lost,
+        # the counters are statistics and only one goodbyedpi front-end runs at a time
+        hits, records = read_hits(self.path)
+        self._hosts = len(hits)
+        if records <= len(hits):
+            self._records = records
+            return
+        temp = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp, "w", encoding="ascii", errors="replace") as f:
+            f.writelines(f"{seen}\t{count}\t{host}\n" for host, (count, seen) in hits.items())
+        os.replace(temp, self.path)
+        self._records = len(hits)
+
+    def ingest(self, path):
+        # Counts the DNS lines of an existing log file (plain or gzip), streaming; returns the line count
+        opener = gzip.open if path.endswith(".gz") else open
+        lines = 0
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                lines += 1
+                self.add_line(line)
+                if len(self.pending) >= 100_000:
+                    self.flush()
+        self.flush()
+        return lines
+
+
+def read_entries(paths):
+    # Blacklist entries in file order, without duplicates; several paths can be given like --blacklist
+    # accepts them, separated by ";"
+    entries = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                host = normalize_host(line)
+                if host:
+                    entries[host] = None
+    return list(entries)
+
+
+def entry_hits(entries, hits):
+    # goodbyedpi matches every subdomain of an entry, so a host counts for each entry among its suffixes.
+    # Returns {entry: [hits, last seen]} for every entry, walking the (small) set of counted hosts rather
+    # than the blacklist.
+    result = {entry: [0, 0] for entry in entries}
+    for host, (count, seen) in hits.items():
+        labels = host.split(".")
+        for i in range(len(labels)):
+            entry = result.get(".".join(labels[i:]))
+            if entry is not None:
+                entry[0] += count
+                entry[1] = max(entry[1], seen)
+    return result
+
+
+def analyze(paths, hits_path=HITS_FILE, min_hits=1, max_age_days=None, now=None):
+    # Splits the blacklist into kept, rarely hit (fewer than min_hits, or no hit within max_age_days) and
+    # never hit entries
+    now = time.time() if now is None else now
+    hits, records = read_hits(hits_path)
+    counted = entry_hits(read_entries(paths), hits)
+    cutoff = now - max_age_days * 86400 if max_age_days else None
+    report = {"entries": len(counted), "hosts": len(hits), "records": records, "kept": [], "rare": [], "never": []}
+    for entry, (count, seen) in counted.items():
+        if not count:
+            report["never"].append(entry)
+        elif count < min_hits or cutoff is not None and seen < cutoff:
+            report["rare"].append(entry)
+        else:
+            report["kept"].append(entry)
+    report["hits"] = counted
+    return report
+
+
+def write_pruned(report, path=PRUNED_FILE):
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w", encoding="ascii") as f:
+        f.writelines(f"{entry}\n" for entry in report["kept"])
+    os.replace(temp, path)
+    return path
+
+
+def format_report(report, limit=None):
+    hits = report["hits"]
+    lines = [f"{report['entries']} blacklist entries, {report['hosts']} distinct hosts counted",
+             f"{len(report['kept'])} kept, {len(report['rare'])} rarely hit, {len(report['never'])} never hit"]
+    rare = sorted(report["rare"], key=lambda entry: hits[entry][0])
+    lines += ["", "Rarely hit (hits, last hit)"]
+    for entry in rare[:limit]:
+        count, seen = hits[entry]
+        lines.append(f"{count:10d}  {time.strftime('%Y-%m-%d', time.localtime(seen))}  {entry}")
+    lines += ["", "Never hit"]
+    lines += sorted(report["never"])[:limit]
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Blacklist hit counts from goodbyedpi --dns-verb output")
+    parser.add_argument("--hits", default=HITS_FILE, help="hit counter log")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="count the DNS lines of saved goodbyedpi logs")
+    ingest.add_argument("logs", nargs="+")
+    report = commands.add_parser("report", help="report rarely and never hit entries and write a pruned list")
+    report.add_argument("blacklist", nargs="+", help="blacklist file(s)")
+    report.add_argument("--min-hits", type=int, default=1)
+    report.add_argument("--max-age", type=float, metavar="DAYS", help="entries without a hit since are rarely hit")
+    report.add_argument("--pruned", default=PRUNED_FILE, help="write the kept entries here")
+    report.add_argument("--report", default=REPORT_FILE, help="write the full report here")
+    args = parser.parse_args(argv)
+
+    if args.command == "ingest":
+        counter = HitCounter(args.hits)
+        for path in args.logs:
+            start = time.perf_counter()
+            lines = counter.ingest(path)
+            print(f"{path}: {lines} lines in {time.perf_counter() - start:.1f}s")
+        print(f"{counter.hits} DNS hits counted")
+        return 0
+    paths = [path.strip() for arg in args.blacklist for path in arg.split(";") if path.strip()]
+    result = analyze(paths, args.hits, args.min_hits, args.max_age)
+    with open(args.report, "w") as f:
+        f.write(format_report(result))
+    print(format_report(result, limit=20), end="")
+    print(f"\nFull report: {args.report}\nPruned list ({len(result['kept'])} entries): "
+          f"{write_pruned(result, args.pruned)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import socket
+import getpass
+import secrets
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Listener, AuthenticationError
+
+
+CONTROL_NAME = f"goodbyedpi-gui-{getpass.getuser()}"
+CONTROL_COMMANDS = ("status", "start", "stop", "reload", "switch-profile", "tail-log")
+NOFOLLOW_FLAGS = getattr(os, "O_NOFOLLOW", 0) | getattr(os, "O_BINARY", 0)
+
+
+def control_address():
+    # Named pipe on Windows, Unix socket elsewhere; both are only reachable from this machine
+    if sys.platform == "win32":
+        return rf"\\.\pipe\{CONTROL_NAME}"
+    return os.path.join(tempfile.gettempdir(), f"{CONTROL_NAME}.sock")
+
+
+def control_key_path():
+    return os.path.join(tempfile.gettempdir(), f"{CONTROL_NAME}.key")
+
+
+def control_key(create=False):
+    # Shared secret for the connection handshake, readable only by the user running the app. A key file that
+    # another user owns or can read is refused.
+    if create:
+        key = secrets.token_bytes(32)
+        write_control_key(key)
+        return key
+    path = control_key_path()
+    with os.fdopen(os.open(path, os.O_RDONLY | NOFOLLOW_FLAGS), "rb") as f:
+        check_private(path, os.fstat(f.fileno()))
+        return f.read()
+
+
+def write_control_key(key):
+    # The path is predictable, so the file is always created fresh, never through a planted file or symlink
+    path = control_key_path()
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | NOFOLLOW_FLAGS, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        check_private(path, os.fstat(f.fileno()))
+        f.write(key)
+
+
+def check_private(path, stat):
+    # Windows keeps the temp directory per user and has no POSIX modes to check
+    if sys.platform == "win32":
+        return
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise PermissionError(f"{path} is not private to {getpass.getuser()}")
+
+
+class ControlError(Exception):
+    pass
+
+
+class ControlServer:
+    # Accepts local connections on its own thread. Each request is a JSON object
+    # {"command": name, "args": {...}} answered with {"ok": true, "result": ...} or
+    # {"ok": false, "error": message}; handlers map command names to callables taking the args.
+    def __init__(self, handlers, address=None):
+        self.handlers = handlers
+        self.address = address if address is not None else control_address()
+        self.listener = None
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        # The address is bound before the key file is written, so a second launch that fails to bind never
+        # replaces the key (or the socket) of the instance that is already listening
+        key = secrets.token_bytes(32)
+        with self._bind_lock():
+            self.listener = self._bind(key)
+        try:
+            write_control_key(key)
+        except OSError:
+            self.listener.close()
+            self.listener = None
+            raise
+        self._thread = threading.Thread(target=self._accept, name="control-server", daemon=True)
+        self._thread.start()
+
+    def _bind(self, key):
+        # Windows pipes are created as the first instance, so binding fails while another instance exists. A
+        # Unix socket path can outlive an instance that did not shut down cleanly; it is only removed once
+        # connecting to it has failed.
+        try:
+            return Listener(self.address, authkey=key)
+        except OSError:
+            if sys.platform == "win32" or not os.path.exists(self.address) or socket_alive(self.address):
+                raise
+        os.unlink(self.address)
+        return Listener(self.address, authkey=key)
+
+    @contextmanager
+    def _bind_lock(self):
+        # Serializes the stale socket check of launches started at the same time
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        fd = os.open(f"{self.address}.lock", os.O_RDWR | os.O_CREAT | NOFOLLOW_FLAGS, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def stop(self):
+        self._closed = True
+        if self.listener is not None:
+            self.listener.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                connection = self.listener.accept()
+            except (EOFError, AuthenticationError):
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            threading.Thread(target=self._serve, args=(connection,), name="control-connection",
+                             daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            while True:
+                try:
+                    request = json.loads(connection.recv_bytes())
+                except (OSError, EOFError, ValueError):
+                    return
+                try:
+                    response = json.dumps(self.handle(request)).encode()
+                except (TypeError, ValueError) as e:
+                    response = json.dumps({"ok": False, "error": f"Unserializable result: {e}"}).encode()
+                try:
+                    connection.send_bytes(response)
+                except OSError:
+                    return
+
+    def handle(self, request):
+        # Any failure of a handler is reported to the client; a bad request must not end the connection thread
+        if not isinstance(request, dict) or not isinstance(request.get("args", {}), dict):
+            return {"ok": False, "error": "Malformed request"}
+        command = request.get("command")
+        handler = self.handlers.get(command)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command: {command}"}
+        try:
+            return {"ok": True, "result": handler(**request.get("args", {}))}
+        except Exception as e:
+            return {"ok": False, "error": str(e) or type(e).__name__}
+
+
+def socket_alive(address):
+    probe = socket.socket(socket.AF_UNIX)
+    probe.settimeout(1.0)
+    try:
+        probe.connect(address)
+    except OSError:
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def send_command(command, address=None, **args):
+    # Raises ConnectionError when no instance is listening
+    address = address if address is not None else control_address()
+    try:
+        key = control_key()
+        connection = Client(address, authkey=key)
+    except (OSError, EOFError, AuthenticationError) as e:
+        raise ConnectionError(f"No running instance: {e}") from e
+    with connection:
+        try:
+            connection.send_bytes(json.dumps({"command": command, "args": args}).encode())
+            response = json.loads(connection.recv_bytes())
+        except (OSError, EOFError) as e:
+            raise ConnectionError(f"Running instance closed the connection: {e}") from e
+    if not isinstance(response, dict):
+        raise ControlError("Malformed response")
+    if not response.get("ok"):
+        raise ControlError(response.get("error"))
+    return response.get("result")
+
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Control a running GoodByeDPI-GUI instance")
+    parser.add_argument("command", choices=CONTROL_COMMANDS)
+    parser.add_argument("argument", nargs="?", help="profile name for switch-profile, line count for tail-log")
+    return parser
+
+
+def request_args(args):
+    if args.command == "switch-profile":
+        if not args.argument:
+            raise ControlError("switch-profile needs a profile name")
+        return {"name": args.argument}
+    if args.command == "tail-log" and args.argument:
+        if not args.argument.isdigit() or int(args.argument) < 1:
+            raise ControlError(f"tail-log needs a positive line count, not {args.argument}")
+        return {"lines": int(args.argument)}
+    return {}
+
+
+def forward(argv, prog=None):
+    # Sends the command in argv to the running instance and prints the result; returns an exit code
+    args = build_parser(prog).parse_args(argv)
+    try:
+        result = send_command(args.command, **request_args(args))
+    except ConnectionError as e:
+        print(e, file=sys.stderr)
+        return 3
+    except (ControlError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if isinstance(result, list):
+        print("\n".join(result))
+    elif isinstance(result, dict):
+        print(json.dumps(result, indent=2))
+    elif result is not None:
+        print(result)
+    return 0
+
+
+def instance_running(address=None):
+    try:
+        send_command("status", address)
+    except (ConnectionError, ControlError):
+        return False
+    return True
+
+
+def forward_to_running(argv, prog=None):
+    # For a new launch: returns an exit code when the launch was handled by the running instance,
+    # or None when this process should start the app itself
+    if not argv or argv[0] == "start":
+        if not instance_running():
+            return None
+        if not argv:
+            print("GoodByeDPI-GUI is already running", file=sys.stderr)
+            return 0
+    return forward(argv, prog)
+
+
+if __name__ == "__main__":
+    sys.exit(forward(sys.argv[1:]))
@@ -0,0 +1,155 @@
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import traceback
+import tracemalloc
+from collections import Counter
+
+
+DIAGNOSTICS_DIR = "diagnostics"
+REPORT_TOP = 40
+TRACE_FRAMES = 25
+SAMPLE_INTERVAL = 0.01
+
+
+class StackSampler:
+    # Records the innermost frames of every thread at a fixed interval. cProfile only sees the thread that
+    # enabled it, this covers the reader, watcher and icon threads as well.
+    def __init__(self, interval=SAMPLE_INTERVAL, depth=5):
+        self.interval = interval
+        self.depth = depth
+        self.samples = Counter()
+        self.ticks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # noqa
+                if ident == own:
+                    continue
+                stack = tuple(f"{summary.name} ({os.path.basename(summary.filename)}:{summary.lineno})"
+                              for summary in traceback.extract_stack(frame, self.depth)[::-1])
+                self.samples[(names.get(ident, str(ident)), stack)] += 1
+            self.ticks += 1
+
+    def report(self, top=REPORT_TOP):
+        lines = [f"{self.ticks} ticks every {self.interval * 1000:.0f} ms"]
+        for (thread, stack), count in self.samples.most_common(top):
+            lines.append(f"\n{count:6d} {count / max(1, self.ticks):6.1%}  [{thread}]")
+            lines.extend(f"         {frame}" for frame in stack)
+        return "\n".join(lines) + "\n"
+
+
+class Diagnostics:
+    # Runtime CPU profiling and allocation tracing, toggled on demand. Nothing is installed while they are
+    # off. Reports are written as timestamped text files to `directory`; start_profiling/stop_profiling
+    # must be called from the same thread (the GUI thread), since that is the one cProfile observes.
+    def __init__(self, directory=DIAGNOSTICS_DIR):
+        self.directory = directory
+        self.profiler = None
+        self.sampler = None
+        self.profile_started = None
+        self.last_snapshot = None
+        self.snapshots = 0
+
+    @property
+    def profiling(self):
+        return self.profiler is not None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def _path(self, kind, extension="txt"):
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}"
+        return os.path.join(self.directory, f"{kind}-{stamp}.{extension}")
+
+    def start_profiling(self):
+        if self.profiler is not None:
+            return
+        self.sampler = StackSampler()
+        self.sampler.start()
+        self.profiler = cProfile.Profile()
+        self.profile_started = time.monotonic()
+        self.profiler.enable()
+
+    def stop_profiling(self):
+        # Returns the report path
+        if self.profiler is None:
+            return None
+        self.profiler.disable()
+        self.sampler.stop()
+        profiler, sampler = self.profiler, self.sampler
+        self.profiler = self.sampler = None
+        elapsed = time.monotonic() - self.profile_started
+        path = self._path("profile")
+        profiler.dump_stats(path[:-len("txt")] + "prof")
+        text = io.StringIO()
+        text.write(f"Profiled for {elapsed:.1f}s\n\nGUI thread (cProfile), by cumulative time\n")
+        stats = pstats.Stats(profiler, stream=text)
+        stats.sort_stats("cumulative").print_stats(REPORT_TOP)
+        text.write("GUI thread (cProfile), by own time\n")
+        stats.sort_stats("tottime").print_stats(REPORT_TOP)
+        text.write("All threads (sampled)\n")
+        text.write(sampler.report())
+        with open(path, "w") as f:
+            f.write(text.getvalue())
+        return path
+
+    def start_tracing(self):
+        if self.tracing:
+            return
+        tracemalloc.start(TRACE_FRAMES)
+        self.last_snapshot = None
+        self.snapshots = 0
+
+    def snapshot(self):
+        # Top allocation sites, the largest tracebacks and the growth since the previous snapshot; returns
+        # the report path
+        if not self.tracing:
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        self.snapshots += 1
+        lines = [f"Snapshot {self.snapshots}: {current / 1024:.0f} KiB traced, peak {peak / 1024:.0f} KiB",
+                 "", "Top allocation sites"]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:REPORT_TOP]]
+        if self.last_snapshot is not None:
+            lines += ["", "Growth since previous snapshot"]
+            lines += [str(stat) for stat in snapshot.compare_to(self.last_snapshot, "lineno")[:REPORT_TOP]]
+        lines += ["", "Largest tracebacks"]
+        for stat in snapshot.statistics("traceback")[:5]:
+            lines.append(f"\n{stat.count} blocks, {stat.size / 1024:.1f} KiB")
+            lines += stat.traceback.format()
+        self.last_snapshot = snapshot
+        path = self._path("memory")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def stop_tracing(self):
+        # Writes a final snapshot report before tracing stops; returns its path
+        path = self.snapshot()
+        tracemalloc.stop()
+        self.last_snapshot = None
+        return path
@@ -0,0 +1,342 @@
+import sys
+import json
+import math
+import time
+import random
+import struct
+import asyncio
+import argparse
+import ipaddress
+import threading
+
+from goodbyedpi_core import FLAGS, MODES, PROFILE_SECTIONS
+
+
+DNS_CONFIG = "dns_select.json"
+# Some resolvers also answer on a non-standard port, which providers that intercept port 53 leave alone
+DEFAULT_RESOLVERS = (
+    "1.1.1.1", "8.8.8.8", "9.9.9.9", "77.88.8.8:1253",
+    "[2606:4700:4700::1111]:53", "[2001:4860:4860::8888]:53", "[2a02:6b8::feed:0ff]:1253",
+)
+DEFAULT_NAMES = ("example.com", "wikipedia.org", "github.com", "cloudflare.com")
+QUERY_TYPES = {"A": 1, "AAAA": 28, "HTTPS": 65}
+HEADER = struct.Struct("!HHHHHH")
+# Both mean the resolver answered; anything else (SERVFAIL, REFUSED, ...) counts as a failure
+ANSWERED_RCODES = (0, 3)
+ADDRESS_FLAGS = {4: ("--dns-addr", "--dns-port"), 6: ("--dnsv6-addr", "--dnsv6-port")}
+
+
+class Resolver:
+    # "1.1.1.1", "1.1.1.1:5353", "2606:4700::1111" or "[2606:4700::1111]:5353"
+    def __init__(self, spec):
+        self.spec = spec
+        address, port = spec, 53
+        if spec.startswith("["):
+            address, _, rest = spec[1:].partition("]")
+            if rest:
+                port = rest.lstrip(":")
+        elif spec.count(":") == 1:
+            address, port = spec.split(":")
+        try:
+            ip = ipaddress.ip_address(address)
+            port = int(port)
+        except ValueError:
+            raise ValueError(f"Invalid resolver {spec}")
+        if not 1 <= port <= 65535:
+            raise ValueError(f"Invalid resolver port in {spec}")
+        self.address = str(ip)
+        self.port = port
+        self.version = ip.version
+
+    def __repr__(self):
+        return self.spec
+
+
+def build_query(query_id, name, query_type=1):
+    labels = [label for label in name.encode("idna").split(b".") if label]
+    question = b"".join(bytes([len(label)]) + label for label in labels) + b"\0" + struct.pack("!HH", query_type, 1)
+    # Recursion desired, one question
+    return HEADER.pack(query_id, 0x0100, 1, 0, 0, 0) + question
+
+
+class _QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, query, result):
+        self.query = query
+        self.result = result
+
+    def connection_made(self, transport):
+        transport.sendto(self.query)
+
+    def datagram_received(self, data, addr):
+        # Stray or spoofed datagrams without our ID and question are ignored, the query keeps waiting
+        if len(data) < HEADER.size or self.result.done():
+            return
+        query_id, flags = struct.unpack_from("!HH", data)
+        question = self.query[HEADER.size:]
+        if query_id != struct.unpack_from("!H", self.query)[0] or not flags & 0x8000:
+            return
+        if data[HEADER.size:HEADER.size + len(question)].lower() != question.lower():
+            return
+        self.result.set_result(flags & 0x000F)
+
+    def error_received(self, exc):
+        if not self.result.done():
+            self.result.set_exception(exc)
+
+
+def percentile(values, fraction):
+    # Nearest rank over the sorted values
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+class ResolverStats:
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.latencies = []
+        self.failures = 0
+
+    @property
+    def queries(self):
+        return len(self.latencies) + self.failures
+
+    def failure_rate(self):
+        return self.failures / self.queries if self.queries else None
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            "queries": self.queries,
+            "failures": self.failures,
+            "failure_rate": self.failure_rate(),
+            "p50_ms": percentile(latencies, 0.5),
+            "p90_ms": percentile(latencies, 0.9),
+            "p99_ms": percentile(latencies, 0.99),
+        }
+
+
+class DnsBenchmark:
+    # Sends `rounds` queries per name to every resolver, all concurrently on one event loop (bounded by
+    # `concurrency`). A query that is not answered within `timeout` seconds is a failure; there are no
+    # retransmissions, since a resolver that loses queries is what we want to avoid.
+    def __init__(self, resolvers=DEFAULT_RESOLVERS, names=DEFAULT_NAMES, rounds=3, timeout=1.0, concurrency=32,
+                 query_type="A"):
+        self.resolvers = [resolver if isinstance(resolver, Resolver) else Resolver(resolver)
+                          for resolver in resolvers]
+        self.names = list(names)
+        self.rounds = rounds
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.query_type = QUERY_TYPES[query_type.upper()]
+
+    def measure(self, resolvers=None):
+        return asyncio.run(self.run(resolvers))
+
+    async def run(self, resolvers=None):
+        resolvers = self.resolvers if resolvers is None else resolvers
+        results = {resolver.spec: ResolverStats(resolver) for resolver in resolvers}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Interleaved so that no resolver gets all of its queries in while the others wait on the semaphore
+        jobs = [(resolver, name) for _ in range(self.rounds) for name in self.names for resolver in resolvers]
+        await asyncio.gather(*[self.query(semaphore, results[resolver.spec], name) for resolver, name in jobs])
+        return results
+
+    async def query(self, semaphore, stats, name):
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            result = loop.create_future()
+            resolver = stats.resolver
+            transport = None
+            start = time.perf_counter()
+            try:
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _QueryProtocol(build_query(random.getrandbits(16), name, self.query_type), result),
+                    remote_addr=(resolver.address, resolver.port))
+                rcode = await asyncio.wait_for(result, self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                stats.failures += 1
+                return
+            finally:
+                if transport is not None:
+                    transport.close()
+            if rcode in ANSWERED_RCODES:
+                stats.latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                stats.failures += 1
+
+
+def select(results, max_failure_rate=0.1):
+    # Fastest healthy resolver per address family by median latency, p90 breaking ties; families without a
+    # healthy candidate are left out
+    best = {}
+    for stats in results.values():
+        rate = stats.failure_rate()
+        if rate is None or rate > max_failure_rate or not stats.latencies:
+            continue
+        latencies = sorted(stats.latencies)
+        key = (percentile(latencies, 0.5), percentile(latencies, 0.9))
+        version = stats.resolver.version
+        if version not in best or key < best[version][0]:
+            best[version] = (key, stats.resolver)
+    return {version: resolver for version, (_, resolver) in best.items()}
+
+
+def with_resolvers(profile, selection):
+    # Returns a copy of the profile redirecting DNS to the selected resolvers. Presets ignore individual
+    # flags, so a preset is expanded into its flags first.
+    profile = dict(profile)
+    sections = {section: dict(profile.get(section, {})) for section in PROFILE_SECTIONS.values()}
+    mode = profile.get("modeset", "")
+    if mode in MODES:
+        for name, value in MODES[mode].items():
+            sections[PROFILE_SECTIONS[FLAGS[name].kind]][name] = value
+        profile["modeset"] = ""
+    for version, resolver in selection.items():
+        address_flag, port_flag = ADDRESS_FLAGS[version]
+        sections["line_values"][address_flag] = resolver.address
+        sections["spin_values"][port_flag] = resolver.port
+    profile.update(sections)
+    return profile
+
+
+def redirected_versions(command):
+    # Address families goodbyedpi currently redirects; queries to port 53 of those would be measuring the
+    # redirect target instead of the resolver
+    return {version for version, (address_flag, _) in ADDRESS_FLAGS.items() if command and address_flag in command}
+
+
+def format_results(results, selection):
+    chosen = {resolver.spec for resolver in selection.values()}
+    summaries = {spec: stats.as_dict() for spec, stats in results.items()}
+    lines = []
+    for spec, summary in sorted(summaries.items(), key=lambda item: (item[1]["failure_rate"] or 0,
+                                                                     item[1]["p50_ms"] or float("inf"))):
+        if summary["p50_ms"] is None:
+            timing = "no answers"
+        else:
+            timing = f"p50 {summary['p50_ms']:.1f} ms, p90 {summary['p90_ms']:.1f} ms"
+        lines.append(f"{'*' if spec in chosen else ' '} {spec}: {timing}, "
+                     f"{summary['failures']}/{summary['queries']} failed")
+    return lines
+
+
+class DnsSelector:
+    # Runs the benchmark on its own thread, once or every `interval` seconds, and hands the selection to
+    # on_select(selection, results). Candidates on port 53 of a family goodbyedpi is already redirecting
+    # (per redirected(), returning the set of versions) are skipped.
+    def __init__(self, benchmark, on_select, on_error=None, interval=None, max_failure_rate=0.1,
+                 redirected=None):
+        self.benchmark = benchmark
+        self.on_select = on_select
+        self.on_error = on_error
+        self.interval = interval
+        self.max_failure_rate = max_failure_rate
+        self.redirected = redirected
+        self.last_results = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, on_select, on_error=None, path=DNS_CONFIG, redirected=None):
+        # {"resolvers": ["1.1.1.1", "[2606:4700::1111]:53"], "names": ["example.com"], "rounds": 3,
+        #  "timeout": 1.0, "interval": 3600, "max_failure_rate": 0.1}
+        with open(path, "r") as f:
+            config = json.load(f)
+        interval = config.pop("interval", None)
+        max_failure_rate = config.pop("max_failure_rate", 0.1)
+        return cls(DnsBenchmark(**config), on_select, on_error, interval, max_failure_rate, redirected)
+
+    def start(self):
+        if not self.interval:
+            return
+        self._thread = threading.Thread(target=self.run, name="dns-select", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        # A failed evaluation (a bad name, a profile that cannot be saved in on_select) is reported and the
+        # schedule goes on
+        while True:
+            try:
+                self.evaluate()
+            except Exception as e:
+                self._error(f"DNS selection failed: {e!r}")
+            if self._stop.wait(self.interval):
+                return
+
+    def candidates(self):
+        skipped = self.redirected() if self.redirected is not None else set()
+        return [resolver for resolver in self.benchmark.resolvers
+                if not (resolver.port == 53 and resolver.version in skipped)]
+
+    def evaluate(self):
+        # Returns the selection, empty when no resolver is healthy. Overlapping calls (the schedule and a
+        # manual run) are serialized.
+        with self._lock:
+            candidates = self.candidates()
+            if not candidates:
+                self._error("No DNS resolvers to test: port 53 is already redirected by goodbyedpi")
+                return {}
+            results = self.benchmark.measure(candidates)
+            selection = select(results, self.max_failure_rate)
+            self.last_results = results
+        if not selection:
+            self._error("No healthy DNS resolver found")
+            return {}
+        self.on_select(selection, results)
+        return selection
+
+    def _error(self, message):
+        if self.on_error is not None:
+            self.on_error(message)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the fastest DNS resolver for --dns-addr/--dnsv6-addr")
+    parser.add_argument("resolvers", nargs="*", default=DEFAULT_RESOLVERS,
+                        help="ADDRESS, ADDRESS:PORT or [IPV6]:PORT (default: a list of public resolvers)")
+    parser.add_argument("--name", action="append", dest="names", help="name to query, repeatable")
+    parser.add_argument("--type", default="A", choices=QUERY_TYPES, help="query type")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-failure-rate", type=float, default=0.1)
+    parser.add_argument("--apply", metavar="PROFILE", nargs="?", const="",
+                        help="write the selection into this profile (default: the active profile)")
+    parser.add_argument("--json", help="write the measurements to this file")
+    args = parser.parse_args(argv)
+    try:
+        benchmark = DnsBenchmark(args.resolvers, args.names or DEFAULT_NAMES, args.rounds, args.timeout,
+                                 args.concurrency, args.type)
+    except ValueError as e:
+        parser.error(str(e))
+    results = benchmark.measure()
+    selection = select(results, args.max_failure_rate)
+    print("\n".join(format_results(results, selection)))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({spec: stats.as_dict() for spec, stats in results.items()}, f, indent=2)
+    if not selection:
+        print("No healthy DNS resolver found", file=sys.stderr)
+        return 1
+    if args.apply is not None:
+        from profile_store import ProfileStore
+        store = ProfileStore()
+        name = args.apply or store.active
+        try:
+            store.save(name, with_resolvers(store.load(name), selection))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Failed to update profile '{name}': {e}", file=sys.stderr)
+            return 2
+        print(f"Profile '{name}' now uses {', '.join(resolver.spec for resolver in selection.values())}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+import os
+import sys
+import re
+import json
+import time
+import random
+import hashlib
+import ipaddress
+import threading
+import subprocess
+from collections import deque
+
+from process_watcher import ProcessWatcher, PROCESS_NAME
+from output_pipeline import OutputPipeline
+from blacklist_compiler import compile_blacklists, format_stats
+
+
+CONFIG_FILE = "profile.json"
+# noinspection SpellCheckingInspection
+GOODBYEDPI_PATH = r"bin/goodbyedpi.exe"
+
+# noinspection SpellCheckingInspection
+MODES = {
+    "-1": {"-p": True, "-r": True, "-s": True, "-f": 2, "-k": 2, "-n": True, "-e": 2},
+    "-2": {"-p": True, "-r": True, "-s": True, "-f": 2, "-k": 2, "-n": True, "-e": 40},
+    "-3": {"-p": True, "-r": True, "-s": True, "-e": 40},
+    "-4": {"-p": True, "-r": True, "-s": True},
+    "-5": {"-f": 2, "-e": 2, "--auto-ttl": "1-4-10", "--reverse-frag": True, "--max-payload": 1200},
+    "-6": {"-f": 2, "-e": 2, "--wrong-seq": True, "--reverse-frag": True, "--max-payload": 1200},
+    "-7": {"-f": 2, "-e": 2, "--wrong-chksum": True, "--reverse-frag": True, "--max-payload": 1200},
+    "-8": {"-f": 2, "-e": 2, "--wrong-chksum": True, "--wrong-seq": True, "--reverse-frag": True,
+           "--max-payload": 1200},
+    "-9": {"-q": True, "-f": 2, "-e": 2, "--wrong-chksum": True, "--wrong-seq": True, "--reverse-frag": True,
+           "--max-payload": 1200}
+}
+
+CREATE_NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+# Seconds to wait for the child after asking it to exit, and again after killing it
+STOP_TIMEOUT = 3.0
+
+
+class ProfileError(ValueError):
+    pass
+
+
+class Flag:
+    # One goodbyedpi option. kind is "check" (a bare switch), "spin" (integer, omitted when 0) or "line"
+    # (text, omitted when empty); check() validates a line value and returns an error message or None.
+    def __init__(self, name, kind, minimum=0, maximum=9999, check=None):
+        self.name = name
+        self.kind = kind
+        self.minimum = minimum
+        self.maximum = maximum
+        self.check = check
+
+    def validate(self, value):
+        if self.kind == "check":
+            if not isinstance(value, bool):
+                return f"{self.name} must be true or false"
+        elif self.kind == "spin":
+            if not isinstance(value, int) or isinstance(value, bool):
+                return f"{self.name} must be an integer"
+            if value and not self.minimum <= value <= self.maximum:
+                return f"{self.name} must be between {self.minimum} and {self.maximum}"
+        elif not isinstance(value, str):
+            return f"{self.name} must be text"
+        elif value.strip() and self.check is not None:
+            return self.check(self.name, value.strip())
+        return None
+
+
+def _check_int(low, high):
+    def check(name, value):
+        if not value.isdigit() or not low <= int(value) <= high:
+            return f"{name} must be a number between {low} and {high}"
+        return None
+    return check
+
+
+def _check_ip(version):
+    def check(name, value):
+        try:
+            if ipaddress.ip_address(value).version == version:
+                return None
+        except ValueError:
+            pass
+        return f"{name} must be an IPv{version} address"
+    return check
+
+
+def _check_pattern(pattern, description):
+    regex = re.compile(pattern)
+
+    def check(name, value):
+        return None if regex.fullmatch(value) else f"{name} must be {description}"
+    return check
+
+
+# Declarative option schema, in the order options are placed on the command line
+# noinspection SpellCheckingInspection
+FLAGS = {flag.name: flag for flag in [
+    Flag("-p", "check"),
+    Flag("-q", "check"),
+    Flag("-r", "check"),
+    Flag("-s", "check"),
+    Flag("-m", "check"),
+    Flag("-n", "check"),
+    Flag("-a", "check"),
+    Flag("-w", "check"),
+    Flag("--frag-by-sni", "check"),
+    Flag("--native-frag", "check"),
+    Flag("--reverse-frag", "check"),
+    Flag("--dns-verb", "check"),
+    Flag("--wrong-chksum", "check"),
+    Flag("--wrong-seq", "check"),
+    Flag("-f", "spin"),
+    Flag("-k", "spin"),
+    Flag("-e", "spin"),
+    Flag("--min-ttl", "spin", 1, 255),
+    Flag("--max-payload", "spin"),
+    Flag("--dns-port", "spin", 1, 65535),
+    Flag("--dnsv6-port", "spin", 1, 65535),
+    Flag("--fake-gen", "spin", 1, 30),
+    Flag("--fake-resend", "spin", 1, 9999),
+    Flag("--port", "line", check=_check_int(1, 65535)),
+    Flag("--ip-id", "line", check=_check_int(0, 65535)),
+    Flag("--set-ttl", "line", check=_check_int(1, 255)),
+    Flag("--auto-ttl", "line", check=_check_pattern(r"\d{1,3}(-\d{1,3}){0,2}", "in the form a1-a2-m")),
+    Flag("--blacklist", "line"),
+    Flag("--dns-addr", "line", check=_check_ip(4)),
+    Flag("--dnsv6-addr", "line", check=_check_ip(6)),
+    Flag("--fake-from-hex", "line", check=_check_pattern(r"([0-9A-Fa-f]{2})+", "an even number of hex digits")),
+    Flag("--fake-with-sni", "line", check=_check_pattern(r"[A-Za-z0-9.-]+", "a domain name")),
+]}
+PROFILE_SECTIONS = {"check": "checkbox_flags", "spin": "spin_values", "line": "line_values"}
+
+
+def validate_modes():
+    for mode, options in MODES.items():
+        for flag, value in options.items():
+            if flag not in FLAGS:
+                raise ProfileError(f"Preset {mode} uses unknown option {flag}")
+            error = FLAGS[flag].validate(value)
+            if error:
+                raise ProfileError(f"Preset {mode}: {error}")
+
+
+validate_modes()
+
+
+def read_profile(path=CONFIG_FILE):
+    # save_last_profile_path stores a pointer to another profile file instead of the profile itself. Pointers
+    # are followed to the profile; a file pointing at itself is the profile, a longer cycle is an error.
+    visited = set()
+    while True:
+        visited.add(os.path.abspath(path))
+        with open(path, "r") as f:
+            profile = json.load(f)
+        if not isinstance(profile, dict):
+            raise ValueError(f"{path} is not a profile")
+        target = profile.get("last_profile")
+        if target is None:
+            return profile
+        if not isinstance(target, str):
+            raise ValueError(f"{path} has an invalid last_profile")
+        if os.path.abspath(target) == os.path.abspath(path):
+            return profile
+        if os.path.abspath(target) in visited:
+            raise ValueError(f"{path} points back to {target}, the last_profile pointers form a cycle")
+        path = target
+
+
+def profile_hash(profile):
+    data = {k: v for k, v in profile.items() if k not in ("schema", "name")}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def build_argv(profile, executable=GOODBYEDPI_PATH):
+    # Pure: the same profile always gives the same argv list, so results are memoized by profile hash.
+    # Raises ProfileError listing every invalid option.
+    if not isinstance(profile, dict):
+        raise ProfileError("Profile must be a JSON object")
+    data = {"modeset": profile.get("modeset", "")}
+    data.update({section: profile.get(section, {}) for section in PROFILE_SECTIONS.values()})
+    invalid = [section for section, values in data.items() if section != "modeset" and not isinstance(values, dict)]
+    if invalid:
+        raise ProfileError(f"{', '.join(invalid)} must be a JSON object")
+    if not isinstance(data["modeset"], str):
+        raise ProfileError("modeset must be a string")
+    key = (profile_hash(data), executable)
+    with _ARGV_CACHE_LOCK:
+        argv = _ARGV_CACHE.get(key)
+    if argv is None:
+        argv = _build_argv(data, executable)
+        # GUI workers, instances and the DNS and remote threads build commands concurrently
+        with _ARGV_CACHE_LOCK:
+            while len(_ARGV_CACHE) >= ARGV_CACHE_SIZE:
+                _ARGV_CACHE.pop(next(iter(_ARGV_CACHE)))
+            _ARGV_CACHE[key] = argv
+    return list(argv)
+
+
+ARGV_CACHE_SIZE = 64
+_ARGV_CACHE = {}
+_ARGV_CACHE_LOCK = threading.Lock()
+
+
+def _build_argv(profile, executable):
+    argv = [executable]
+    mode = profile["modeset"]
+    if mode:
+        if mode not in MODES:
+            raise ProfileError(f"Unknown preset mode {mode}")
+        argv.append(mode)  # Preset mode like "-9"
+        return tuple(argv)
+    # Only append flags manually if no preset mode is selected
+    errors = []
+    for name, flag in FLAGS.items():
+        value = profile[PROFILE_SECTIONS[flag.kind]].get(name)
+        if value is None:
+            continue
+        error = flag.validate(value)
+        if error:
+            errors.append(error)
+        elif flag.kind == "check":
+            if value:
+                argv.append(name)
+        elif flag.kind == "spin":
+            if value > 0:
+                argv.extend([name, str(value)])
+        elif value.strip():
+            argv.extend([name, value.strip()])
+    if errors:
+        raise ProfileError("; ".join(errors))
+    return tuple(argv)
+
+
+def compile_blacklist(text, on_message=None):
+    # Several source files can be given separated by ";", they are merged into one compiled list. Returns
+    # the list files to pass: the compiled one, or the sources themselves when compilation failed, since
+    # goodbyedpi takes one file per --blacklist.
+    paths = [path.strip() for path in text.split(";") if path.strip()]
+    try:
+        compiled, stats = compile_blacklists(paths)
+    except (OSError, ValueError) as e:
+        if on_message:
+            on_message(f"Blacklist compilation failed, using the source files as is: {e}")
+        return paths
+    if on_message:
+        on_message(format_stats(stats))
+    return [compiled]
+
+
+def build_command(profile, executable=GOODBYEDPI_PATH, on_message=None):
+    # The effective argv: build_argv() with --blacklist sources replaced by the compiled list. Compiled
+    # lists are named after their content hash, so an edited blacklist also changes the argv.
+    argv = build_argv(profile, executable)
+    for i, arg in enumerate(argv[:-1]):
+        if arg == "--blacklist":
+            paths = compile_blacklist(argv[i + 1], on_message)
+            argv[i:i + 2] = [part for path in paths for part in ("--blacklist", path)]
+            break
+    return argv
+
+
+class RestartPolicy:
+    # Jittered exponential backoff between restarts. The attempt counter resets once a process has stayed
+    # up for stable_after seconds; more than crash_loop_limit crashes within crash_loop_window seconds
+    # trips the circuit breaker and automatic restarts stop until the next manual start.
+    def __init__(self, base_delay=1.0, max_delay=60.0, multiplier=2.0, jitter=0.2, stable_after=30.0,
+                 crash_loop_limit=5, crash_loop_window=120.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.stable_after = stable_after
+        self.crash_loop_limit = crash_loop_limit
+        self.crash_loop_window = crash_loop_window
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class SupervisorStats:
+    def __init__(self):
+        self.starts = 0
+        self.restarts = 0
+        self.crashes = 0
+        self.started_at = None
+        self.last_exit_code = None
+        self.last_exit_at = None
+        self.last_recover_seconds = None
+        self.last_stop_seconds = None
+
+    def uptime(self):
+        if self.started_at is None:
+            return 0.0
+        return time.monotonic() - self.started_at
+
+    def as_dict(self):
+        return {
+            "starts": self.starts,
+            "restarts": self.restarts,
+            "crashes": self.crashes,
+            "uptime_seconds": round(self.uptime(), 3),
+            "last_exit_code": self.last_exit_code,
+            "last_recover_seconds": self.last_recover_seconds,
+            "last_stop_seconds": self.last_stop_seconds,
+        }
+
+
+class Supervisor:
+    # Owns the goodbyedpi child process and its stdout reader. Front-ends (the tray GUI or the headless
+    # runner) attach to it through the output pipeline and the watcher's exit callbacks.
+    def __init__(self, output=None, watcher=None, auto_restart=True, policy=None, multiplexer=None):
+        self.output = output if output is not None else OutputPipeline()
+        # When given, stdout is read by the shared OutputMultiplexer instead of a thread of our own
+        self.multiplexer = multiplexer
+        self.watcher = watcher if watcher is not None else ProcessWatcher(PROCESS_NAME)
+        self.auto_restart = auto_restart
+        self.policy = policy if policy is not None else RestartPolicy()
+        self.stats = SupervisorStats()
+        self.command = None
+        self.process = None
+        self.reader = None
+        self.circuit_open = False
+        self._attempt = 0
+        self._crash_times = deque()
+        self._restart_timer = None
+        self._stopping = False
+        self._applying = False
+        self._lock = threading.RLock()
+        # Serializes whole stop/start sequences (apply, start, stop and timer restarts). _lock only guards
+        # state and is never held while waiting on the process, so the exit callback cannot block on it.
+        self._lifecycle = threading.RLock()
+        self.watcher.add_exit_callback(self._on_exit)
+
+    def is_running(self):
+        return self.watcher.is_running()
+
+    @property
+    def restart_pending(self):
+        return self._restart_timer is not None
+
+    def active(self):
+        # True until the exit of the current process has been handled and no restart is scheduled
+        with self._lock:
+            return self.stats.started_at is not None or self.restart_pending or self._applying
+
+    def apply(self, command):
+        # Restarts only when the effective argv differs from the one already running
+        with self._lifecycle:
+            with self._lock:
+                if command == self.command and self.active():
+                    return False
+                self._applying = True
+            try:
+                self.stop()
+                self.start(command)
+            finally:
+                self._applying = False
+            return True
+
+    def start(self, command):
+        with self._lifecycle:
+            # Never leave a process of ours running untracked
+            if self.owned_pid() is not None:
+                self.stop()
+            with self._lock:
+                self._cancel_restart()
+                self._stopping = False
+                self.circuit_open = False
+                self._attempt = 0
+                self._crash_times.clear()
+                return self._spawn(command)
+
+    def _spawn(self, command):
+        self.command = command
+        if self.multiplexer is not None:
+            process, self.reader = self.multiplexer.spawn(command, self.output.push,
+                                                          creationflags=CREATE_NO_WINDOW)
+        else:
+            process = subprocess.Popen(
+                command,
+                creationflags=CREATE_NO_WINDOW,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                shell=False
+            )
+            self.reader = threading.Thread(target=self.output.read_from, args=(process.stdout,),
+                                           name="goodbyedpi-reader", daemon=True)
+            self.reader.start()
+        self.process = process
+        self.stats.starts += 1
+        self.stats.started_at = time.monotonic()
+        self.watcher.attach(process)
+        return process
+
+    def _on_exit(self, pid, code):
+        # Runs on the watcher thread as soon as the child handle signals
+        with self._lock:
+            if self.process is None or pid != self.process.pid:
+                return
+            now = time.monotonic()
+            if now - self.stats.started_at >= self.policy.stable_after:
+                self._attempt = 0
+            self.stats.last_exit_code = code
+            self.stats.last_exit_at = now
+            self.stats.started_at = None
+            if self._stopping:
+                return
+            self._schedule_restart(f"GoodByeDPI exited with code {code}")
+
+    def _schedule_restart(self, reason):
+        now = time.monotonic()
+        self.stats.crashes += 1
+        self._crash_times.append(now)
+        while self._crash_times and now - self._crash_times[0] > self.policy.crash_loop_window:
+            self._crash_times.popleft()
+        if not self.auto_restart:
+            self.output.push(reason)
+            return
+        if len(self._crash_times) > self.policy.crash_loop_limit:
+            self.circuit_open = True
+            self.output.push(f"{reason}, crashed {len(self._crash_times)} times"
+                             f" in {self.policy.crash_loop_window:.0f}s, automatic restart disabled")
+            return
+        delay = self.policy.delay(self._attempt)
+        self._attempt += 1
+        self.output.push(f"{reason}, restarting in {delay:.1f}s")
+        self._restart_timer = threading.Timer(delay, self._restart)
+        self._restart_timer.daemon = True
+        self._restart_timer.start()
+
+    def _restart(self):
+        # A timer that already fired while start/stop/apply held the lifecycle lock has been replaced or
+        # cancelled by them; it must not spawn a second process
+        with self._lifecycle, self._lock:
+            if self._restart_timer is not threading.current_thread():
+                return
+            self._restart_timer = None
+            if self._stopping or self.owned_pid() is not None:
+                return
+            try:
+                self._spawn(self.command)
+            except OSError as e:
+                self._schedule_restart(f"Error: {e}")
+                return
+            self.stats.restarts += 1
+            self.stats.last_recover_seconds = round(time.monotonic() - self.stats.last_exit_at, 3)
+            self.output.push(f"GoodByeDPI restarted, recovered in {self.stats.last_recover_seconds}s")
+
+    def _cancel_restart(self):
+        if self._restart_timer is not None:
+            self._restart_timer.cancel()
+            self._restart_timer = None
+
+    def status_text(self):
+        stats = self.stats
+        lines = ["GoodByeDPI Running" if self.is_running() else "GoodByeDPI Stopped"]
+        if stats.started_at is not None:
+            minutes, seconds = divmod(int(stats.uptime()), 60)
+            hours, minutes = divmod(minutes, 60)
+            lines.append(f"Uptime: {hours}h{minutes:02d}m{seconds:02d}s")
+        if stats.restarts or stats.crashes:
+            lines.append(f"Restarts: {stats.restarts}, last exit code: {stats.last_exit_code}")
+        if stats.last_recover_seconds is not None:
+            lines.append(f"Last recovery: {stats.last_recover_seconds}s")
+        if self.restart_pending:
+            lines.append("Restart pending")
+        if self.circuit_open:
+            lines.append("Crash loop, automatic restart disabled")
+        return "\n".join(lines)
+
+    # noinspection SpellCheckingInspection
+    def stop(self, timeout=STOP_TIMEOUT):
+        # Blocks for at most about twice the timeout, so callers on the GUI thread should use a worker.
+        # Returns the stop latency in seconds, or None when there was nothing of ours to stop.
+        with self._lifecycle:
+            return self._stop(timeout)
+
+    def _stop(self, timeout):
+        with self._lock:
+            self._stopping = True
+            self._cancel_restart()
+            process = self.process
+            reader = self.reader
+        if process is None or process.poll() is not None:
+            return None
+        start = time.monotonic()
+        # On Windows terminate() is already TerminateProcess, the kill below only matters elsewhere
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.output.push(f"GoodByeDPI did not exit within {timeout:.1f}s, killing it")
+            process.kill()
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                pass
+        # The reader ends at EOF once the child is gone, after pushing whatever was still buffered
+        if reader is not None and reader is not threading.current_thread():
+            reader.join(timeout)
+        elapsed = time.monotonic() - start
+        self.stats.last_stop_seconds = round(elapsed, 3)
+        self.output.push(f"GoodByeDPI stopped in {elapsed * 1000:.0f} ms")
+        return elapsed
+
+    def owned_pid(self):
+        process = self.process
+        return process.pid if process is not None and process.poll() is None else None
+
+
+# noinspection SpellCheckingInspection
+def stop_strays(scanner, exclude=(), process_name=PROCESS_NAME):
+    # goodbyedpi processes we did not start, e.g. left over from a previous session. Only on Windows, where
+    # they would hold the WinDivert driver; returns the PIDs that were killed.
+    if sys.platform != "win32":
+        return []
+    pids = [pid for pid in scanner.find_all(process_name) if pid not in exclude]
+    for pid in pids:
+        subprocess.call(["taskkill", "/f", "/pid", str(pid)], creationflags=CREATE_NO_WINDOW)
+    return pids
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import signal
+
+
+# Stand-in for bin/goodbyedpi.exe used by the benchmarks. Accepts any goodbyedpi arguments and is driven by
+# environment variables so it also works behind build_command():
+#   GOODBYEDPI_STUB_LINES        lines to print after the banner (default 0)
+#   GOODBYEDPI_STUB_RATE         lines per second, 0 for as fast as possible (default 0)
+#   GOODBYEDPI_STUB_CRASH_AFTER  exit with GOODBYEDPI_STUB_EXIT_CODE after this many seconds
+#   GOODBYEDPI_STUB_EXIT_CODE    exit code for a crash (default 1)
+#   GOODBYEDPI_STUB_IGNORE_TERM  ignore SIGTERM/SIGINT when set to 1
+#   GOODBYEDPI_STUB_STAY         keep running once the lines are printed (default 1)
+STUB_ENV = "GOODBYEDPI_STUB_"
+STUB_LINE = "[DNS] 192.168.1.10:53124 -> 1.1.1.1:1253 request for example-{0}.com"
+
+
+def setting(name, default, kind=float):
+    value = os.environ.get(STUB_ENV + name)
+    return kind(value) if value not in (None, "") else default
+
+
+def main(argv):
+    lines = setting("LINES", 0, int)
+    rate = setting("RATE", 0.0)
+    crash_after = setting("CRASH_AFTER", None)
+    exit_code = setting("EXIT_CODE", 1, int)
+    stay = setting("STAY", 1, int)
+    if setting("IGNORE_TERM", 0, int):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    start = time.monotonic()
+    deadline = start + crash_after if crash_after is not None else None
+    out = sys.stdout
+    out.write("GoodbyeDPI 0.2.2: Passive DPI blocker and Active DPI circumvention utility\n")
+    out.write("https://github.com/ValdikSS/GoodbyeDPI\n\n")
+    out.write(f"Arguments: {' '.join(argv)}\n")
+    out.write("Opening filter\nFilter activated, GoodbyeDPI is now running!\n")
+    out.flush()
+    for i in range(lines):
+        out.write(STUB_LINE.format(i) + "\n")
+        if rate:
+            out.flush()
+            # Paced against the start time so the average rate holds even when a write blocks
+            delay = start + (i + 1) / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if deadline is not None and time.monotonic() >= deadline:
+            out.flush()
+            return exit_code
+    out.flush()
+    if not stay:
+        return 0
+    while deadline is None or time.monotonic() < deadline:
+        time.sleep(0.05 if deadline is not None else 3600)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
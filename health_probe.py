@@ -0,0 +1,215 @@
+import ssl
+import json
+import time
+import bisect
+import asyncio
+import threading
+from collections import deque
+
+
+HEALTH_CONFIG = "health.json"
+# Upper bounds of the latency histogram buckets in milliseconds, the last bucket is open ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+
+class LatencyHistogram:
+    # Rolling histogram over the last `window` probes; counts are updated incrementally as samples enter
+    # and leave the window, so reading it never rescans the samples
+    def __init__(self, window=50, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.samples = deque()
+        self.window = window
+        self.successes = 0
+
+    def add(self, ok, latency_ms):
+        if len(self.samples) == self.window:
+            old_ok, old_latency = self.samples.popleft()
+            if old_ok:
+                self.successes -= 1
+                self.counts[bisect.bisect_left(self.buckets, old_latency)] -= 1
+        self.samples.append((ok, latency_ms))
+        if ok:
+            self.successes += 1
+            self.counts[bisect.bisect_left(self.buckets, latency_ms)] += 1
+
+    def __len__(self):
+        return len(self.samples)
+
+    def success_rate(self):
+        return self.successes / len(self.samples) if self.samples else None
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the requested fraction of successful probes
+        if not self.successes:
+            return None
+        rank = fraction * self.successes
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return self.buckets[-1]
+
+    def clear(self):
+        self.counts = [0] * len(self.buckets)
+        self.samples.clear()
+        self.successes = 0
+
+
+class ProbeTarget:
+    # "tcp://host:port" only checks the connection, "tls://host[:port]" also completes a TLS handshake with
+    # the host as SNI, which is what DPI interferes with. probe can be replaced by any coroutine function
+    # taking the timeout, for tests or custom checks.
+    def __init__(self, spec, probe=None):
+        self.spec = spec
+        scheme, _, address = spec.rpartition("://")
+        self.kind = scheme or "tls"
+        host, _, port = address.rpartition(":")
+        if not host or not port.isdigit():
+            host, port = address, "443"
+        self.host = host.strip("[]")
+        self.port = int(port)
+        if probe is not None:
+            self.probe = probe
+
+    async def probe(self, timeout):
+        context = None
+        if self.kind == "tls":
+            context = ssl.create_default_context()
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context,
+                                    server_hostname=self.host if context else None), timeout)
+        writer.close()
+
+
+class HealthMonitor:
+    # Probes every target concurrently each `interval` seconds on its own thread and event loop. When the
+    # mean success rate stays below `threshold` for `consecutive` rounds, on_failover is called with the
+    # next entry of `fallbacks` (a MODES preset like "-9" or a profile name). on_failover blocks while goodbyedpi
+    # restarts, so it runs on an executor thread rather than on the event loop.
+    def __init__(self, targets, on_failover=None, fallbacks=(), interval=30.0, timeout=5.0, window=20,
+                 min_samples=5, threshold=0.5, consecutive=2, cooldown=300.0, is_active=None):
+        self.targets = [target if isinstance(target, ProbeTarget) else ProbeTarget(target) for target in targets]
+        self.on_failover = on_failover
+        self.fallbacks = list(fallbacks)
+        self.interval = interval
+        self.timeout = timeout
+        self.min_samples = min_samples
+        self.threshold = threshold
+        self.consecutive = consecutive
+        self.cooldown = cooldown
+        self.is_active = is_active
+        self.histograms = {target.spec: LatencyHistogram(window) for target in self.targets}
+        self.rounds = 0
+        self.degraded_rounds = 0
+        self.failovers = 0
+        self.next_fallback = 0
+        self.last_failover = None
+        self.last_error = None
+        self._loop = None
+        self._stop = None
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, path=HEALTH_CONFIG, **kwargs):
+        with open(path, "r") as f:
+            config = json.load(f)
+        fallback = config.pop("fallback", ())
+        config.setdefault("fallbacks", [fallback] if isinstance(fallback, str) else fallback)
+        config.update(kwargs)
+        return cls(**config)
+
+    def start(self):
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(),), name="health-probe", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        while not self._stop.is_set():
+            if self.is_active is None or self.is_active():
+                await self.probe_round()
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def probe_target(self, target):
+        start = time.perf_counter()
+        try:
+            await target.probe(self.timeout)
+            ok = True
+        except Exception as e:
+            # Whatever a custom probe raises counts as a failed probe, never as the end of the monitor
+            if not isinstance(e, (OSError, asyncio.TimeoutError, ssl.SSLError)):
+                self.last_error = f"{target.spec}: {e!r}"
+            ok = False
+        self.histograms[target.spec].add(ok, (time.perf_counter() - start) * 1000)
+
+    async def probe_round(self):
+        await asyncio.gather(*[self.probe_target(target) for target in self.targets])
+        self.rounds += 1
+        rate = self.success_rate()
+        if rate is None or rate >= self.threshold:
+            self.degraded_rounds = 0
+            return
+        self.degraded_rounds += 1
+        if self.degraded_rounds < self.consecutive:
+            return
+        fallback = self.failover()
+        if fallback is None or self.on_failover is None:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.on_failover, fallback, rate)
+        except Exception as e:
+            self.last_error = f"Failover to {fallback}: {e!r}"
+
+    def success_rate(self):
+        # Mean over targets that have enough samples to judge
+        rates = [histogram.success_rate() for histogram in self.histograms.values()
+                 if len(histogram) >= self.min_samples]
+        return sum(rates) / len(rates) if rates else None
+
+    def failover(self):
+        # Picks the next fallback and resets the probe state; returns None while cooling down or when the
+        # fallbacks are exhausted
+        now = time.monotonic()
+        if self.last_failover is not None and now - self.last_failover < self.cooldown:
+            return None
+        if self.next_fallback >= len(self.fallbacks):
+            return None
+        fallback = self.fallbacks[self.next_fallback]
+        self.next_fallback += 1
+        self.failovers += 1
+        self.last_failover = now
+        self.degraded_rounds = 0
+        # The new configuration is judged on its own probes
+        for histogram in self.histograms.values():
+            histogram.clear()
+        return fallback
+
+    def snapshot(self):
+        return {
+            "rounds": self.rounds,
+            "failovers": self.failovers,
+            "success_rate": self.success_rate(),
+            "last_error": self.last_error,
+            "targets": {
+                spec: {
+                    "samples": len(histogram),
+                    "success_rate": histogram.success_rate(),
+                    "p50_ms": histogram.percentile(0.5),
+                    "p90_ms": histogram.percentile(0.9),
+                    "p99_ms": histogram.percentile(0.99),
+                    "histogram": dict(zip([str(bound) for bound in histogram.buckets], histogram.counts)),
+                }
+                for spec, histogram in self.histograms.items()
+            },
+        }
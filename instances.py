@@ -0,0 +1,105 @@
+import json
+
+from goodbyedpi_core import Supervisor, build_command
+from output_pipeline import TaggedOutput
+from process_watcher import ProcessWatcher
+
+
+INSTANCES_CONFIG = "instances.json"
+
+
+class InstanceGroup:
+    # Extra goodbyedpi instances supervised next to the main one, for example with different --blacklist or
+    # --port sets. Each runs a profile from the store and restarts on its own; they all push into the shared
+    # output pipeline with lines tagged by instance name, read by the one OutputMultiplexer. exclude returns
+    # the PIDs owned outside the group, so no instance reports another one's process as its own.
+    def __init__(self, store, output, multiplexer, instances, scanner=None, exclude=None):
+        self.store = store
+        self.exclude = exclude
+        self.profiles = {}
+        self.supervisors = {}
+        for instance in instances:
+            name = instance["name"]
+            self.profiles[name] = instance.get("profile", name)
+            watcher = ProcessWatcher(scanner=scanner, exclude=self.excluded_pids)
+            self.supervisors[name] = Supervisor(TaggedOutput(output, name), watcher, multiplexer=multiplexer)
+
+    @classmethod
+    def from_config(cls, store, output, multiplexer, path=INSTANCES_CONFIG, scanner=None, exclude=None):
+        # {"instances": [{"name": "web", "profile": "web-ports"}, ...]}
+        with open(path, "r") as f:
+            config = json.load(f)
+        return cls(store, output, multiplexer, config["instances"], scanner, exclude)
+
+    def __iter__(self):
+        return iter(self.supervisors.items())
+
+    def command(self, name, on_message=None):
+        return build_command(self.store.load(self.profiles[name]), on_message=on_message)
+
+    def start(self, name, on_message=None):
+        supervisor = self.supervisors[name]
+        try:
+            cmd = self.command(name, on_message)
+        except (OSError, ValueError, KeyError) as e:
+            supervisor.output.push(f"Invalid profile '{self.profiles[name]}': {e}")
+            return False
+        supervisor.output.push(f"> {' '.join(cmd)}")
+        try:
+            supervisor.start(cmd)
+        except OSError as e:
+            supervisor.output.push(f"Error: {e}")
+            return False
+        return True
+
+    def start_all(self, on_message=None):
+        for name, supervisor in self:
+            if not supervisor.active():
+                self.start(name, on_message)
+
+    def stop(self, name):
+        return self.supervisors[name].stop()
+
+    def stop_all(self):
+        for _, supervisor in self:
+            supervisor.stop()
+
+    def active(self):
+        return any(supervisor.active() for _, supervisor in self)
+
+    def owned_pids(self):
+        return {pid for pid in (supervisor.owned_pid() for _, supervisor in self) if pid is not None}
+
+    def excluded_pids(self):
+        pids = self.owned_pids()
+        if self.exclude is not None:
+            pids.update(self.exclude())
+        return pids
+
+    def status(self):
+        return {
+            name: {
+                "profile": self.profiles[name],
+                "pid": supervisor.owned_pid(),
+                "command": supervisor.command,
+                "stats": supervisor.stats.as_dict(),
+                "restart_pending": supervisor.restart_pending,
+                "circuit_open": supervisor.circuit_open,
+            }
+            for name, supervisor in self
+        }
+
+    def status_lines(self):
+        lines = []
+        for name, supervisor in self:
+            if supervisor.owned_pid() is not None:
+                state = "running"
+            elif supervisor.restart_pending:
+                state = "restart pending"
+            elif supervisor.circuit_open:
+                state = "crash loop"
+            else:
+                state = "stopped"
+            restarts = supervisor.stats.restarts
+            lines.append(f"{name}: {state}" + (f", {restarts} restarts" if restarts else ""))
+        return lines
@@ -0,0 +1,163 @@
+import os
+import gzip
+import time
+import queue
+import shutil
+import hashlib
+import threading
+
+
+LOG_DIR = "logs"
+LOG_FILE = "goodbyedpi.log"
+
+
+class RotatingLogSink:
+    # Persists goodbyedpi output on its own writer thread. write() never blocks: lines go into a bounded
+    # queue and are dropped (and counted) when the disk cannot keep up, so the stdout reader is never
+    # held back. Each line carries a timestamp and the id of the command it came from; the full
+    # command is written once per run as a header line.
+    def __init__(self, directory=LOG_DIR, file_name=LOG_FILE, max_bytes=5 * 1024 * 1024, rotate_interval=None,
+                 backup_count=5, compress=True, queue_size=10000, flush_interval=1.0):
+        self.directory = directory
+        self.path = os.path.join(directory, file_name)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self.last_error = None
+        self.run_id = "-"
+        self._queue = queue.Queue(queue_size)
+        self._closing = threading.Event()
+        self._file = None
+        self._opened_at = 0.0
+        self._thread = threading.Thread(target=self._writer, name="log-sink", daemon=True)
+        self._thread.start()
+
+    def set_command(self, command):
+        if isinstance(command, (list, tuple)):
+            command = " ".join(command)
+        self.run_id = hashlib.sha1(command.encode()).hexdigest()[:8]
+        self._put((time.time(), "=", f"run {self.run_id}: {command}"))
+
+    def write(self, line):
+        self._put((time.time(), self.run_id, line))
+
+    def _put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        # The writer also exits once the queue is drained after _closing is set, so a full queue (the
+        # sentinel cannot be queued) does not keep close() waiting
+        self._closing.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _writer(self):
+        running = True
+        while running:
+            try:
+                records = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._closing.is_set():
+                    break
+                continue
+            while len(records) < 4096:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in records:
+                records = records[:records.index(None)]
+                running = False
+            if records:
+                self._write(records)
+        self._close_file()
+
+    def _write(self, records):
+        # A failing disk or a bad record costs those records (counted as dropped), never the writer thread;
+        # the file is reopened on the next batch
+        lines = []
+        for record in records:
+            try:
+                lines.append(self._format(record))
+            except (OSError, ValueError, OverflowError, TypeError) as e:
+                self._error(e, 1)
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write("".join(lines))
+            self._file.flush()
+            self.written += len(lines)
+        except (OSError, ValueError) as e:
+            self._error(e, len(lines))
+            self._close_file()
+            return
+        try:
+            if self._should_rotate():
+                self._rotate()
+        except (OSError, ValueError) as e:
+            self._error(e, 0)
+            self._close_file()
+
+    def _error(self, error, records):
+        self.errors += 1
+        self.dropped += records
+        self.last_error = str(error)
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+        except (OSError, ValueError):
+            pass
+        self._file = None
+
+    @staticmethod
+    def _format(record):
+        timestamp, run_id, line = record
+        millis = int(timestamp * 1000) % 1000
+        return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}.{millis:03d} [{run_id}] {line}\n"
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8", buffering=64 * 1024)
+        self._opened_at = time.time()
+
+    def _should_rotate(self):
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _segment_path(self, index):
+        return f"{self.path}.{index}.gz" if self.compress else f"{self.path}.{index}"
+
+    def _rotate(self):
+        self._close_file()
+        oldest = self._segment_path(self.backup_count)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for index in range(self.backup_count - 1, 0, -1):
+            source = self._segment_path(index)
+            if os.path.exists(source):
+                os.replace(source, self._segment_path(index + 1))
+        if self.backup_count > 0:
+            if self.compress:
+                with open(self.path, "rb") as src, gzip.open(self._segment_path(1), "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self._segment_path(1))
+        else:
+            os.remove(self.path)
+        self._open()
@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import ctypes
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from goodbyedpi_core import profile_hash
+
+
+METRICS_ENV = "GOODBYEDPI_METRICS"
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+SAMPLE_INTERVAL = 5.0
+
+
+class ResourceSampler:
+    # Returns (cpu_seconds, rss_bytes) of a process, or None when it cannot be read
+    def sample(self, pid):
+        raise NotImplementedError
+
+
+# noinspection PyPep8Naming
+class Win32ResourceSampler(ResourceSampler):
+    process_query_limited_information = 0x1000
+    process_vm_read = 0x0010
+
+    class FILETIME(ctypes.Structure):
+        _fields_ = [("low", ctypes.c_ulong), ("high", ctypes.c_ulong)]
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + [
+            (name, ctypes.c_size_t) for name in (
+                "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+    def sample(self, pid):
+        kernel32 = ctypes.windll.kernel32
+        process_handle = kernel32.OpenProcess(self.process_query_limited_information | self.process_vm_read,
+                                              False, pid)
+        if not process_handle:
+            return None
+        try:
+            times = [self.FILETIME() for _ in range(4)]
+            if not kernel32.GetProcessTimes(process_handle, *[ctypes.byref(t) for t in times]):
+                return None
+            # Kernel and user time, in 100ns units
+            cpu = sum((t.high << 32 | t.low) for t in times[2:]) / 1e7
+            counters = self.PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            if not kernel32.K32GetProcessMemoryInfo(process_handle, ctypes.byref(counters), counters.cb):
+                return cpu, None
+            return cpu, counters.WorkingSetSize
+        finally:
+            kernel32.CloseHandle(process_handle)
+
+
+class ProcfsResourceSampler(ResourceSampler):
+    def __init__(self, root="/proc"):
+        self.root = root
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def sample(self, pid):
+        try:
+            with open(os.path.join(self.root, str(pid), "stat"), "rb") as f:
+                stat = f.read()
+            with open(os.path.join(self.root, str(pid), "statm"), "rb") as f:
+                statm = f.read()
+        except OSError:
+            return None
+        # The command name may contain spaces, the fields after it are fixed; utime and stime are 14 and 15
+        fields = stat[stat.rindex(b")") + 2:].split()
+        cpu = (int(fields[11]) + int(fields[12])) / self.ticks
+        return cpu, int(statm.split()[1]) * self.page_size
+
+
+class NullResourceSampler(ResourceSampler):
+    def sample(self, pid):
+        return None
+
+
+SAMPLERS = {
+    "win32": Win32ResourceSampler,
+    "procfs": ProcfsResourceSampler,
+    "null": NullResourceSampler,
+}
+
+
+def create_sampler(backend=None):
+    if backend is None:
+        if sys.platform == "win32":
+            backend = "win32"
+        elif os.path.isdir("/proc"):
+            backend = "procfs"
+        else:
+            backend = "null"
+    return SAMPLERS[backend]()
+
+
+def parse_address(value):
+    # "PORT", "HOST:PORT" or "1"/"on" for the defaults
+    if value.lower() in ("1", "on", "true", "yes"):
+        return METRICS_HOST, METRICS_PORT
+    host, _, port = value.rpartition(":")
+    return host.strip("[]") or METRICS_HOST, int(port)
+
+
+class MetricsCollector:
+    # Samples the supervisor, output and child process counters every `interval` seconds on its own thread.
+    # Scrapes only format the latest snapshot, so they never touch the process or take the supervisor lock.
+    # profile is a callable returning (name, profile dict); health is an optional HealthMonitor.
+    def __init__(self, supervisor, profile=None, health=None, sampler=None, interval=SAMPLE_INTERVAL):
+        self.supervisor = supervisor
+        self.profile = profile
+        self.health = health
+        self.sampler = sampler if sampler is not None else create_sampler()
+        self.interval = interval
+        self._snapshot = {}
+        self._last_lines = None
+        self._last_time = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.sample()
+        self._thread = threading.Thread(target=self.run, name="metrics-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        start = time.perf_counter()
+        supervisor = self.supervisor
+        buffer = supervisor.output.buffer
+        process = supervisor.process
+        pid = process.pid if process is not None and process.poll() is None else None
+        now = time.monotonic()
+        lines = buffer.pushed
+        rate = 0.0
+        if self._last_time is not None and now > self._last_time:
+            rate = (lines - self._last_lines) / (now - self._last_time)
+        self._last_lines, self._last_time = lines, now
+        resources = self.sampler.sample(pid) if pid is not None else None
+        snapshot = {
+            "up": pid is not None,
+            "pid": pid,
+            "restart_pending": supervisor.restart_pending,
+            "circuit_open": supervisor.circuit_open,
+            "supervisor": supervisor.stats.as_dict(),
+            "cpu_seconds": resources[0] if resources else None,
+            "rss_bytes": resources[1] if resources else None,
+            "output": {"lines": lines, "dropped": buffer.dropped, "lines_per_second": round(rate, 3)},
+            "profile": None,
+        }
+        if self.profile is not None:
+            name, profile = self.profile()
+            snapshot["profile"] = {"name": name, "hash": profile_hash(profile)}
+        if self.health is not None:
+            snapshot["health"] = self.health.snapshot()
+        snapshot["sample_seconds"] = round(time.perf_counter() - start, 6)
+        snapshot["sampled_at"] = time.time()
+        with self._lock:
+            self._snapshot = snapshot
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot
+
+    def prometheus(self):
+        snapshot = self.snapshot()
+        if not snapshot:
+            return ""
+        stats = snapshot["supervisor"]
+        output = snapshot["output"]
+        metrics = [
+            ("up", "gauge", "Whether goodbyedpi is running", snapshot["up"]),
+            ("pid", "gauge", "PID of the running goodbyedpi process", snapshot["pid"]),
+            ("starts_total", "counter", "Processes started", stats["starts"]),
+            ("restarts_total", "counter", "Automatic restarts after a crash", stats["restarts"]),
+            ("crashes_total", "counter", "Unexpected exits", stats["crashes"]),
+            ("uptime_seconds", "gauge", "Uptime of the current process", stats["uptime_seconds"]),
+            ("last_exit_code", "gauge", "Exit code of the previous process", stats["last_exit_code"]),
+            ("last_recover_seconds", "gauge", "Time from the last crash to the restart",
+             stats["last_recover_seconds"]),
+            ("last_stop_seconds", "gauge", "Time the last stop took", stats["last_stop_seconds"]),
+            ("restart_pending", "gauge", "Whether a restart is scheduled", snapshot["restart_pending"]),
+            ("circuit_open", "gauge", "Whether restarts are disabled after a crash loop", snapshot["circuit_open"]),
+            ("cpu_seconds_total", "counter", "CPU time of the current process", snapshot["cpu_seconds"]),
+            ("resident_memory_bytes", "gauge", "Resident memory of the current process", snapshot["rss_bytes"]),
+            ("output_lines_total", "counter", "Output lines read", output["lines"]),
+            ("output_dropped_lines_total", "counter", "Output lines dropped before display", output["dropped"]),
+            ("output_lines_per_second", "gauge", "Output rate over the last sample interval",
+             output["lines_per_second"]),
+            ("metrics_sample_seconds", "gauge", "Time spent taking the last sample", snapshot["sample_seconds"]),
+        ]
+        health = snapshot.get("health")
+        if health is not None:
+            metrics += [
+                ("health_success_rate", "gauge", "Mean probe success rate", health["success_rate"]),
+                ("health_failovers_total", "counter", "Failovers to a fallback preset or profile",
+                 health["failovers"]),
+            ]
+        text = []
+        for name, kind, description, value in metrics:
+            if value is None:
+                continue
+            text.append(f"# HELP goodbyedpi_{name} {description}")
+            text.append(f"# TYPE goodbyedpi_{name} {kind}")
+            text.append(f"goodbyedpi_{name} {value if isinstance(value, float) else int(value)}")
+        profile = snapshot["profile"]
+        if profile is not None:
+            name = str(profile["name"]).replace("\\", "\\\\").replace('"', '\\"')
+            text.append("# HELP goodbyedpi_profile_info Active profile")
+            text.append("# TYPE goodbyedpi_profile_info gauge")
+            text.append(f'goodbyedpi_profile_info{{name="{name}",hash="{profile["hash"]}"}} 1')
+        return "\n".join(text) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa
+        collector = self.server.collector
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = collector.prometheus().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path in ("/metrics.json", "/"):
+            body = json.dumps(collector.snapshot(), indent=2).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    # Serves /metrics (Prometheus text format) and /metrics.json on its own daemon thread
+    daemon_threads = True
+
+    def __init__(self, collector, host=METRICS_HOST, port=METRICS_PORT):
+        super().__init__((host, port), MetricsHandler)
+        self.collector = collector
+        self._thread = None
+
+    def start(self):
+        self.collector.start()
+        self._thread = threading.Thread(target=self.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # shutdown() waits for serve_forever to acknowledge, which never happens if it was not started
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+        self.collector.stop()
@@ -0,0 +1,237 @@
+import re
+import time
+import heapq
+import bisect
+import threading
+from array import array
+
+
+# Lines kept per event type. With --dns-verb the DNS lines are the flood; every other type has its own
+# budget, so the one banner, filter error or warning of a long run is not pushed out by DNS lines. A full
+# store is about 12 MiB; in practice the rare types stay far below their budget.
+EVENT_TYPE_CAPACITY = {"dns": 50_000, "message": 20_000, "option": 10_000, "banner": 10_000, "filter": 10_000,
+                       "warning": 10_000, "error": 10_000}
+EVENT_STORE_CAPACITY = sum(EVENT_TYPE_CAPACITY.values())
+# Text search walks back from the newest candidate; this bounds the cost of a search with few matches
+SEARCH_SCAN_LIMIT = 20_000
+# Events of a type are stored and evicted in chunks of this many lines
+EVENT_CHUNK_SIZE = 1024
+
+EVENT_TYPES = ("banner", "option", "filter", "dns", "warning", "error", "message")
+# Checked in order against the lower-cased line, the first match wins. A rule matches when its pattern
+# matches at the start of the line or when any of its keywords occurs anywhere; plain substring tests keep
+# the per-line cost low compared to unanchored regex searches.
+# noinspection SpellCheckingInspection
+EVENT_RULES = (
+    ("banner", re.compile(r"goodbyedpi \d|https://github\.com/valdikss/goodbyedpi"), ()),
+    ("filter", re.compile(r"opening filter|filter activated|filter string:|(?:in|out)bound and "), ()),
+    ("error", re.compile(r"(?:error|fatal)\b"), ("failed", "could not", "can't")),
+    ("warning", re.compile(r"warning\b"), ("warning:",)),
+    ("dns", None, ("dns",)),
+    ("option", re.compile(r"[a-z][a-z0-9 ()/,.-]{1,60}: \S"), ()),
+)
+# Hosts are indexed for these types: the queried name ends a --dns-verb line, warnings and errors may
+# mention one anywhere (e.g. a rejected blacklist entry)
+HOST_PATTERN = re.compile(r"\b((?:[A-Za-z0-9-]+\.)+[A-Za-z]{2,})\b")
+HOST_TYPES = ("dns", "warning", "error")
+
+
+class EventParser:
+    # Classifies one output line at a time; lines never need to be re-read
+    def __init__(self, rules=EVENT_RULES):
+        self.rules = rules
+        self.type_ids = {name: i for i, name in enumerate(EVENT_TYPES)}
+
+    def parse(self, line):
+        # Returns (type id, host or None)
+        lower = line.lower()
+        for name, pattern, keywords in self.rules:
+            if not (pattern is not None and pattern.match(lower) or any(word in lower for word in keywords)):
+                continue
+            host = None
+            if name in HOST_TYPES:
+                last = lower.rsplit(None, 1)[-1].rstrip(".") if lower else ""
+                if HOST_PATTERN.fullmatch(last):
+                    host = last
+                else:
+                    found = HOST_PATTERN.search(lower)
+                    host = found.group(1) if found else None
+            return self.type_ids[name], host
+        return self.type_ids["message"], None
+
+
+class EventLog:
+    # The retained events of one type, oldest first. Positions count the events of this type; the chunk
+    # holding position p is chunks[p // chunk_size - first_chunk]. Only the newest chunk is appended to and
+    # eviction drops whole chunks from the front, so a copy of the chunk list taken under the lock stays
+    # valid for reading the positions it covered after the lock is released.
+    def __init__(self, capacity, chunk_size=EVENT_CHUNK_SIZE):
+        self.capacity = max(1, capacity)
+        self.chunk_size = max(1, min(chunk_size, self.capacity // 8))
+        self.chunks = []
+        self.first_chunk = 0
+        self.end = 0
+        # Positions of the events naming each host, ascending
+        self.host_index = {}
+
+    @property
+    def start(self):
+        return self.first_chunk * self.chunk_size
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, seq, now, line, host):
+        if len(self) >= self.capacity:
+            self._evict()
+        if self.end % self.chunk_size == 0:
+            # Sequence numbers, arrival times, lines, hosts
+            self.chunks.append((array("Q"), array("d"), [], []))
+        seqs, times, lines, hosts = self.chunks[-1]
+        seqs.append(seq)
+        times.append(now)
+        lines.append(line)
+        hosts.append(host)
+        if host is not None:
+            index = self.host_index.get(host)
+            if index is None:
+                index = self.host_index[host] = array("Q")
+            index.append(self.end)
+        self.end += 1
+
+    def _evict(self):
+        evicted_hosts = set(self.chunks.pop(0)[3])
+        evicted_hosts.discard(None)
+        self.first_chunk += 1
+        start = self.start
+        for host in evicted_hosts:
+            index = self.host_index[host]
+            del index[:bisect.bisect_left(index, start)]
+            if not index:
+                del self.host_index[host]
+
+    def find(self, seq):
+        # (time, line) of the retained event with this sequence number, or None
+        firsts = [chunk[0][0] for chunk in self.chunks]
+        i = bisect.bisect_right(firsts, seq) - 1
+        if i < 0:
+            return None
+        seqs, times, lines, _ = self.chunks[i]
+        j = bisect.bisect_left(seqs, seq)
+        if j < len(seqs) and seqs[j] == seq:
+            return times[j], lines[j]
+        return None
+
+    def snapshot(self, host=None, count=None):
+        # Everything a query needs to walk this log newest first without the lock: the chunk list, the
+        # retained range and, for a host query, the newest `count` positions naming the host
+        positions = None
+        if host is not None:
+            positions = self.host_index.get(host, array("Q"))
+            positions = positions[-count:] if count is not None else positions[:]
+        return self.first_chunk, list(self.chunks), self.start, self.end, positions
+
+    @staticmethod
+    def walk(snapshot, chunk_size):
+        # (seq, line) pairs, newest first
+        first_chunk, chunks, start, end, positions = snapshot
+        if positions is None:
+            positions = range(end - 1, start - 1, -1)
+        else:
+            positions = reversed(positions)
+        for position in positions:
+            chunk = chunks[position // chunk_size - first_chunk]
+            offset = position % chunk_size
+            yield chunk[0][offset], chunk[2][offset]
+
+
+class EventStore:
+    # One EventLog per event type, each with its own capacity; sequence numbers are global, so the logs
+    # merge back into arrival order. Per-type logs and per-host indexes mean a filtered query reads the
+    # tail of one log or index instead of scanning the output.
+    def __init__(self, capacity=None, parser=None):
+        # capacity: lines per type, either one number for every type or a {type: lines} dict
+        if capacity is None:
+            capacity = EVENT_TYPE_CAPACITY
+        if not isinstance(capacity, dict):
+            capacity = {name: capacity for name in EVENT_TYPES}
+        self.capacity = {name: capacity.get(name, EVENT_TYPE_CAPACITY[name]) for name in EVENT_TYPES}
+        self.parser = parser if parser is not None else EventParser()
+        self.next_seq = 0
+        self.logs = [EventLog(self.capacity[name]) for name in EVENT_TYPES]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(log) for log in self.logs)
+
+    def add(self, line, now=None):
+        # Parsing happens outside the lock, the reader thread only holds it for the appends
+        type_id, host = self.parser.parse(line)
+        with self._lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.logs[type_id].append(seq, time.time() if now is None else now, line, host)
+            return seq
+
+    def clear(self):
+        with self._lock:
+            self.logs = [EventLog(self.capacity[name]) for name in EVENT_TYPES]
+
+    def event(self, seq):
+        with self._lock:
+            for type_id, log in enumerate(self.logs):
+                found = log.find(seq)
+                if found is not None:
+                    return {"seq": seq, "time": found[0], "type": EVENT_TYPES[type_id], "line": found[1]}
+            return None
+
+    def counts(self):
+        with self._lock:
+            return {name: len(log) for name, log in zip(EVENT_TYPES, self.logs)}
+
+    def has_host(self, host):
+        host = host.lower()
+        with self._lock:
+            return any(host in self.logs[EVENT_TYPES.index(name)].host_index for name in HOST_TYPES)
+
+    def hosts(self, prefix=""):
+        with self._lock:
+            found = set()
+            for name in HOST_TYPES:
+                found.update(host for host in self.logs[EVENT_TYPES.index(name)].host_index
+                             if host.startswith(prefix))
+            return sorted(found)
+
+    def _walk(self, event_type=None, host=None, count=None):
+        # (seq, line) pairs of the matching events, newest first. The lock is only held to copy the chunk
+        # lists (and at most `count` host positions), never while the lines are read.
+        names = [event_type] if event_type is not None else EVENT_TYPES
+        if host is not None:
+            host = host.lower()
+            names = [name for name in names if name in HOST_TYPES]
+        with self._lock:
+            logs = [self.logs[EVENT_TYPES.index(name)] for name in names]
+            snapshots = [(log.snapshot(host, count), log.chunk_size) for log in logs]
+        walks = [EventLog.walk(snapshot, chunk_size) for snapshot, chunk_size in snapshots]
+        if len(walks) == 1:
+            return walks[0]
+        return heapq.merge(*walks, key=lambda event: event[0], reverse=True)
+
+    def query(self, event_type=None, host=None, text=None, limit=200, scan_limit=SEARCH_SCAN_LIMIT):
+        # Returns up to `limit` matching lines, oldest first
+        result = []
+        if text:
+            text = text.lower()
+        for scanned, (_, line) in enumerate(self._walk(event_type, host, scan_limit if text else limit)):
+            if len(result) >= limit or (text and scanned >= scan_limit):
+                break
+            if text and text not in line.lower():
+                continue
+            result.append(line)
+        result.reverse()
+        return result
+
+    def tail(self, limit):
+        if limit < 1:
+            return []
+        return self.query(limit=limit)
@@ -0,0 +1,98 @@
+import sys
+import locale
+import asyncio
+import threading
+import subprocess
+
+
+class _PipeProtocol(asyncio.Protocol):
+    def __init__(self, on_line, done, encoding):
+        self.on_line = on_line
+        self.done = done
+        self.encoding = encoding
+        self.partial = b""
+
+    def data_received(self, data):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.deliver(line)
+
+    def connection_lost(self, exc):
+        if self.partial:
+            self.deliver(self.partial)
+            self.partial = b""
+        self.done.set()
+
+    # An exception escaping the protocol would close the pipe and cut off the rest of the child's output
+    def deliver(self, line):
+        try:
+            self.on_line(line.decode(self.encoding, errors="replace"))
+        except Exception as e:
+            print(f"Output line dropped: {e!r}", file=sys.stderr)
+
+
+class PipeReader:
+    # Takes the place of a per-process reader thread: join() returns once the pipe has reached EOF and
+    # every line has been delivered
+    def __init__(self):
+        self.done = threading.Event()
+
+    def join(self, timeout=None):
+        self.done.wait(timeout)
+
+    def is_alive(self):
+        return not self.done.is_set()
+
+
+class OutputMultiplexer:
+    # One event loop thread reads the stdout of every child process, instead of one thread per pipe. On
+    # Windows the Proactor loop needs overlapped pipes, which asyncio's Popen variant creates; elsewhere a
+    # plain Popen pipe is registered with the selector loop.
+    def __init__(self, encoding=None):
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            if sys.platform == "win32":
+                self._loop = asyncio.ProactorEventLoop()
+            else:
+                self._loop = asyncio.SelectorEventLoop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="output-mux", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+    def spawn(self, command, on_line, **kwargs):
+        # Starts the process with stdout and stderr on one pipe and returns (process, reader)
+        self.start()
+        if sys.platform == "win32":
+            from asyncio.windows_utils import Popen
+        else:
+            Popen = subprocess.Popen  # noqa
+        process = Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0, **kwargs)
+        reader = PipeReader()
+        future = asyncio.run_coroutine_threadsafe(self._connect(process.stdout, on_line, reader.done), self._loop)
+        try:
+            future.result(5)
+        except Exception:
+            process.kill()
+            raise
+        return process, reader
+
+    async def _connect(self, pipe, on_line, done):
+        await self._loop.connect_read_pipe(lambda: _PipeProtocol(on_line, done, self.encoding), pipe)
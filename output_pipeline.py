@@ -0,0 +1,108 @@
+import threading
+from collections import deque
+
+
+OUTPUT_BUFFER_LINES = 10000
+
+
+class OutputRingBuffer:
+    # Fixed-size line buffer between the stdout reader and the view. When the view falls behind,
+    # the oldest lines are overwritten and counted as dropped instead of growing without limit.
+    def __init__(self, capacity=OUTPUT_BUFFER_LINES):
+        self._lines = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.pushed = 0
+        self.dropped = 0
+        self._dropped_reported = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    def push(self, line):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self.dropped += 1
+            self._lines.append(line)
+            self.pushed += 1
+
+    def drain(self, limit=None):
+        with self._lock:
+            if limit is None or limit >= len(self._lines):
+                lines = list(self._lines)
+                self._lines.clear()
+            else:
+                lines = [self._lines.popleft() for _ in range(limit)]
+            dropped = self.dropped - self._dropped_reported
+            self._dropped_reported = self.dropped
+        return lines, dropped
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
+            self._dropped_reported = self.dropped
+
+
+class OutputPipeline:
+    # Reader side: read_from() runs on the reader thread and pushes each line into the ring buffer
+    # and any registered sinks. View side: take_batch() is called from a timer and returns the
+    # coalesced text to append in one go.
+    def __init__(self, capacity=OUTPUT_BUFFER_LINES, batch_limit=None):
+        self.buffer = OutputRingBuffer(capacity)
+        self.batch_limit = batch_limit
+        self._sinks = []
+        self._failing = set()
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self._sinks:
+            self._sinks.remove(sink)
+
+    def push(self, line):
+        line = line.rstrip("\r\n")
+        self.buffer.push(line)
+        # A failing sink (a full disk under the log file, say) must not cost the other sinks or the reader
+        # its lines. It is reported once into the view when it starts failing and again after it recovered.
+        for sink in self._sinks:
+            try:
+                sink(line)
+            except Exception as e:
+                if id(sink) not in self._failing:
+                    self._failing.add(id(sink))
+                    self.buffer.push(f"Output sink {getattr(sink, '__qualname__', sink)} failed: {e!r}")
+            else:
+                self._failing.discard(id(sink))
+
+    def read_from(self, stream):
+        for line in stream:
+            self.push(line)
+
+    def take_batch(self):
+        lines, dropped = self.buffer.drain(self.batch_limit)
+        if dropped:
+            lines.insert(0, f"... {dropped} lines dropped ...")
+        if not lines:
+            return None
+        return "\n".join(lines)
+
+    def clear(self):
+        self.buffer.clear()
+
+
+class TaggedOutput:
+    # One instance's view of a shared pipeline: every line it pushes is prefixed with the instance name
+    def __init__(self, pipeline, tag):
+        self.pipeline = pipeline
+        self.tag = tag
+
+    @property
+    def buffer(self):
+        return self.pipeline.buffer
+
+    def push(self, line):
+        self.pipeline.push(f"[{self.tag}] {line.rstrip()}")
+
+    def read_from(self, stream):
+        for line in stream:
+            self.push(line)
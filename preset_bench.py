@@ -0,0 +1,577 @@
+import json
+import time
+import random
+import struct
+import asyncio
+import argparse
+
+from goodbyedpi_core import FLAGS, MODES, PROFILE_SECTIONS, profile_hash
+
+
+# Segments between the benchmark client, the DPI stand-in and the origin server are framed explicitly so
+# the middlebox sees the same segment boundaries, ordering and fake packets goodbyedpi would produce.
+FRAME = struct.Struct("!BII")
+DATA = 0
+FAKE = 1
+RST = 2
+FIN = 4
+INJECTED = 8
+FAKE_CHKSUM = 16
+FAKE_SEQ = 32
+FAKE_TTL = 64
+
+# noinspection SpellCheckingInspection
+FAKE_HOST = "www.w3.org"
+HTTP_METHODS = (b"GET ", b"POST ", b"HEAD ", b"PUT ", b"OPTIONS ", b"DELETE ", b"CONNECT ")
+
+
+async def read_frame(reader):
+    flags, offset, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return flags, offset, await reader.readexactly(length)
+
+
+def write_frame(writer, flags, offset=0, data=b""):
+    writer.write(FRAME.pack(flags, offset, len(data)) + data)
+
+
+def http_request(host, options):
+    # noinspection SpellCheckingInspection
+    header = "hoSt:" if options.get("-r") else "Host:"
+    if options.get("-m"):
+        host = "".join(c.upper() if i % 2 else c.lower() for i, c in enumerate(host))
+    space = "" if options.get("-s") else " "
+    method = "GET  /" if options.get("-a") else "GET /"
+    return f"{method} HTTP/1.1\r\n{header}{space}{host}\r\nUser-Agent: preset-bench\r\nAccept: */*\r\n\r\n".encode()
+
+
+def client_hello(host):
+    name = host.encode("idna")
+    server_name = struct.pack("!HBH", len(name) + 3, 0, len(name)) + name
+    extensions = struct.pack("!HH", 0, len(server_name)) + server_name
+    body = (b"\x03\x03" + random.randbytes(32) + b"\x00" + struct.pack("!H", 2) + b"\x13\x01" + b"\x01\x00"
+            + struct.pack("!H", len(extensions)) + extensions)
+    handshake = b"\x01" + len(body).to_bytes(3, "big") + body
+    return b"\x16\x03\x01" + struct.pack("!H", len(handshake)) + handshake
+
+
+def parse_sni(data):
+    # Host from a TLS ClientHello, or None when the data is not one or is cut before the SNI value ends
+    try:
+        if len(data) < 6 or data[0] != 0x16 or data[5] != 1:
+            return None
+        pos = 5 + 4 + 2 + 32
+        pos += 1 + data[pos]
+        pos += 2 + int.from_bytes(data[pos:pos + 2], "big")
+        pos += 1 + data[pos]
+        end = pos + 2 + int.from_bytes(data[pos:pos + 2], "big")
+        pos += 2
+        while pos + 4 <= min(end, len(data)):
+            ext_type, ext_len = struct.unpack("!HH", data[pos:pos + 4])
+            pos += 4
+            if ext_type == 0:
+                name_len = int.from_bytes(data[pos + 3:pos + 5], "big")
+                if pos + 5 + name_len > len(data):
+                    return None
+                return data[pos + 5:pos + 5 + name_len].decode("ascii")
+            pos += ext_len
+    except (IndexError, UnicodeDecodeError):
+        pass
+    return None
+
+
+def request_complete(data):
+    if data.startswith(HTTP_METHODS):
+        return b"\r\n\r\n" in data
+    if len(data) >= 5 and data[0] == 0x16:
+        return len(data) >= 5 + int.from_bytes(data[3:5], "big")
+    return False
+
+
+# noinspection SpellCheckingInspection
+def segments_for(payload, options, https):
+    # Splits the first request the way goodbyedpi would: -f/-e fragmentation, --frag-by-sni, reversed
+    # fragment order and an up-front fake request for the Fake Request Mode options
+    frames = []
+    fake_flags = 0
+    if options.get("--wrong-chksum"):
+        fake_flags |= FAKE_CHKSUM
+    if options.get("--wrong-seq"):
+        fake_flags |= FAKE_SEQ
+    if options.get("--set-ttl") or options.get("--auto-ttl"):
+        fake_flags |= FAKE_TTL
+    if fake_flags or options.get("--fake-gen") or options.get("--fake-with-sni"):
+        fake = client_hello(options.get("--fake-with-sni") or FAKE_HOST) if https else http_request(FAKE_HOST, {})
+        for _ in range(max(1, options.get("--fake-resend") or 1)):
+            frames.append((FAKE | (fake_flags or FAKE_TTL), 0, fake))
+    size = options.get("-e") if https else options.get("-f")
+    split = None
+    if https and options.get("--frag-by-sni"):
+        # Like goodbyedpi, falls back to -e when the payload has no SNI to split at
+        host = parse_sni(payload)
+        index = payload.find(host.encode()) if host else -1
+        if index != -1:
+            split = index
+    if split is None and size and size < len(payload):
+        split = size
+    if split:
+        parts = [(DATA, 0, payload[:split]), (DATA, split, payload[split:])]
+        if options.get("--reverse-frag"):
+            parts.reverse()
+        frames.extend(parts)
+    else:
+        frames.append((DATA, 0, payload))
+    return frames
+
+
+class DpiRules:
+    # Behaviour of the simulated middlebox. inspect "first" classifies only the first data segment of a
+    # connection, "reassemble" buffers segments in order until a full request is seen. action is "reset",
+    # "drop" or "redirect" (passive DPI injecting a 302). strict_header only matches a literal "Host: "
+    # and case_sensitive compares host names as sent.
+    def __init__(self, blocked_hosts=(), inspect="first", action="reset", strict_header=True,
+                 case_sensitive=True, validate_checksum=False, validate_seq=False, block_quic=True,
+                 reassemble_limit=4096):
+        self.blocked_hosts = {host.lower() for host in blocked_hosts}
+        self.inspect = inspect
+        self.action = action
+        self.strict_header = strict_header
+        self.case_sensitive = case_sensitive
+        self.validate_checksum = validate_checksum
+        self.validate_seq = validate_seq
+        self.block_quic = block_quic
+        self.reassemble_limit = reassemble_limit
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def is_blocked(self, host):
+        if not self.case_sensitive:
+            host = host.lower()
+        return any(host == blocked or host.endswith("." + blocked) for blocked in self.blocked_hosts)
+
+    def host_of(self, data):
+        if data.startswith(HTTP_METHODS):
+            for line in data.split(b"\r\n")[1:]:
+                if self.strict_header:
+                    if line.startswith(b"Host: "):
+                        return line[6:].decode(errors="replace")
+                elif line.lower().startswith(b"host:"):
+                    return line[5:].strip().decode(errors="replace")
+            return None
+        return parse_sni(data)
+
+    def ignores(self, flags):
+        return bool(flags & FAKE_CHKSUM and self.validate_checksum or flags & FAKE_SEQ and self.validate_seq)
+
+
+class DpiMiddlebox:
+    def __init__(self, rules, origin_tcp, origin_udp=None):
+        self.rules = rules
+        self.origin_tcp = origin_tcp
+        self.origin_udp = origin_udp
+        self.stats = {"connections": 0, "blocked": 0, "quic_dropped": 0}
+        self.server = None
+        self.udp_transport = None
+
+    async def start(self, host="127.0.0.1"):
+        self.server = await asyncio.start_server(self.handle, host, 0)
+        if self.origin_udp:
+            loop = asyncio.get_running_loop()
+            self.udp_transport, _ = await loop.create_datagram_endpoint(lambda: _QuicProxy(self), local_addr=(host, 0))
+        return self
+
+    @property
+    def tcp_address(self):
+        return self.server.sockets[0].getsockname()[:2]
+
+    @property
+    def udp_address(self):
+        return self.udp_transport.get_extra_info("sockname")[:2] if self.udp_transport else None
+
+    def close(self):
+        self.server.close()
+        if self.udp_transport:
+            self.udp_transport.close()
+
+    async def handle(self, reader, writer):
+        self.stats["connections"] += 1
+        try:
+            origin_reader, origin_writer = await asyncio.open_connection(*self.origin_tcp)
+        except OSError:
+            writer.close()
+            return
+        downstream = asyncio.ensure_future(self.pump(origin_reader, writer))
+        try:
+            await self.inspect(reader, writer, origin_writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await downstream
+            origin_writer.close()
+            writer.close()
+
+    @staticmethod
+    async def pump(reader, writer):
+        try:
+            while True:
+                flags, offset, data = await read_frame(reader)
+                write_frame(writer, flags, offset, data)
+                await writer.drain()
+                if flags & (FIN | RST):
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def inspect(self, reader, writer, origin_writer):
+        rules = self.rules
+        decided = False
+        pending = {}
+        stream = b""
+        while True:
+            flags, offset, data = await read_frame(reader)
+            if not decided:
+                host = None
+                if flags & FAKE:
+                    if not rules.ignores(flags):
+                        # The DPI takes the fake request at face value and stops looking at this connection
+                        host = rules.host_of(data)
+                        decided = host is not None
+                elif rules.inspect == "first":
+                    host = rules.host_of(data) if data.startswith(HTTP_METHODS) or data[:1] == b"\x16" else None
+                    decided = True
+                else:
+                    pending[offset] = data
+                    while len(stream) in pending:
+                        stream += pending.pop(len(stream))
+                    if request_complete(stream) or len(stream) >= rules.reassemble_limit:
+                        host = rules.host_of(stream)
+                        decided = True
+                if host is not None and rules.is_blocked(host):
+                    self.stats["blocked"] += 1
+                    if await self.block(writer, host, data.startswith(HTTP_METHODS) or stream.startswith(HTTP_METHODS)):
+                        origin_writer.close()
+                        return
+            write_frame(origin_writer, flags, offset, data)
+            await origin_writer.drain()
+            if flags & (FIN | RST):
+                return
+
+    async def block(self, writer, host, http):
+        # Returns True when the connection is torn down
+        if self.rules.action == "redirect" and http:
+            response = f"HTTP/1.1 302 Found\r\nLocation: http://blocked.invalid/?{host}\r\n\r\n".encode()
+            write_frame(writer, INJECTED, 0, response)
+            await writer.drain()
+            return False
+        if self.rules.action == "drop":
+            await asyncio.sleep(3600)
+        write_frame(writer, RST)
+        await writer.drain()
+        return True
+
+
+class _QuicProxy(asyncio.DatagramProtocol):
+    # Datagrams are b"QUIC" + 8 byte id + host; the id maps origin replies back to the client
+    def __init__(self, middlebox):
+        self.middlebox = middlebox
+        self.transport = None
+        self.clients = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr == self.middlebox.origin_udp:
+            client = self.clients.pop(data[4:12], None)
+            if client:
+                self.transport.sendto(data, client)
+            return
+        host = data[12:].decode(errors="replace")
+        if self.middlebox.rules.block_quic and self.middlebox.rules.is_blocked(host):
+            self.middlebox.stats["quic_dropped"] += 1
+            return
+        self.clients[data[4:12]] = addr
+        self.transport.sendto(data, self.middlebox.origin_udp)
+
+
+class OriginServer:
+    # Reassembles data segments by offset, discards fake ones (as the real server would drop a bad checksum
+    # or expired TTL packet) and answers a complete request with response_size bytes
+    def __init__(self, response_size=64 * 1024):
+        self.response_size = response_size
+        self.server = None
+        self.udp_transport = None
+
+    async def start(self, host="127.0.0.1"):
+        self.server = await asyncio.start_server(self.handle, host, 0)
+        loop = asyncio.get_running_loop()
+        self.udp_transport, _ = await loop.create_datagram_endpoint(_QuicEcho, local_addr=(host, 0))
+        return self
+
+    @property
+    def tcp_address(self):
+        return self.server.sockets[0].getsockname()[:2]
+
+    @property
+    def udp_address(self):
+        return self.udp_transport.get_extra_info("sockname")[:2]
+
+    def close(self):
+        self.server.close()
+        self.udp_transport.close()
+
+    async def handle(self, reader, writer):
+        pending = {}
+        stream = b""
+        try:
+            while not request_complete(stream):
+                flags, offset, data = await read_frame(reader)
+                if flags & (FIN | RST):
+                    return
+                if flags & FAKE:
+                    continue
+                pending[offset] = data
+                while len(stream) in pending:
+                    stream += pending.pop(len(stream))
+            chunk = b"x" * 16384
+            for start in range(0, self.response_size, len(chunk)):
+                write_frame(writer, DATA, start, chunk[:self.response_size - start])
+            write_frame(writer, FIN, self.response_size)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class _QuicEcho(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(data, addr)
+
+
+class _QuicClient(asyncio.DatagramProtocol):
+    def __init__(self, future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(data)
+
+
+class Site:
+    # "http://host", "https://host" or "quic://host" (HTTPS that tries QUIC first, like a browser)
+    def __init__(self, spec):
+        scheme, _, host = spec.partition("://")
+        if not host:
+            scheme, host = "https", spec
+        self.spec = spec
+        self.scheme = scheme
+        self.host = host
+
+    @property
+    def https(self):
+        return self.scheme in ("https", "quic")
+
+
+def preset_options(preset):
+    if isinstance(preset, dict):
+        # A profile dict, flattened to the options that actually end up on the command line
+        if preset.get("modeset"):
+            return dict(MODES[preset["modeset"]])
+        options = {}
+        for name, flag in FLAGS.items():
+            value = preset.get(PROFILE_SECTIONS[flag.kind], {}).get(name)
+            if value:
+                options[name] = value.strip() if isinstance(value, str) else value
+        return options
+    return dict(MODES.get(preset, {}))
+
+
+def preset_cost(options, site):
+    # Extra packets per connection, used to prefer the cheapest preset among equally working ones
+    frames = segments_for(client_hello(site.host) if site.https else http_request(site.host, options),
+                          options, site.https)
+    return len(frames) - 1
+
+
+async def run_request(site, options, middlebox, timeout, quic_timeout):
+    start = time.perf_counter()
+    fell_back = False
+    if site.scheme == "quic" and not options.get("-q"):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        transport, _ = await loop.create_datagram_endpoint(lambda: _QuicClient(future),
+                                                           remote_addr=middlebox.udp_address)
+        try:
+            transport.sendto(b"QUIC" + random.randbytes(8) + site.host.encode())
+            await asyncio.wait_for(future, quic_timeout)
+            return True, time.perf_counter() - start, 0, "quic", fell_back
+        except asyncio.TimeoutError:
+            fell_back = True  # Falls back to TCP like a browser does when QUIC is blackholed
+        finally:
+            transport.close()
+    payload = client_hello(site.host) if site.https else http_request(site.host, options)
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection(*middlebox.tcp_address)
+        for flags, offset, data in segments_for(payload, options, site.https):
+            write_frame(writer, flags, offset, data)
+        await writer.drain()
+        first_byte = None
+        received = 0
+        while True:
+            flags, offset, data = await asyncio.wait_for(read_frame(reader), timeout)
+            if flags & RST:
+                return False, None, received, "reset", fell_back
+            if flags & INJECTED:
+                # -p drops the passive DPI's injected redirect, without it the browser would follow it
+                if options.get("-p"):
+                    continue
+                return False, None, received, "redirected", fell_back
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            received += len(data)
+            if flags & FIN:
+                return True, first_byte, received, "ok", fell_back
+    except asyncio.TimeoutError:
+        return False, None, 0, "timeout", fell_back
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return False, None, 0, "reset", fell_back
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def bench_preset(name, options, site, middlebox, connections, concurrency, timeout, quic_timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await run_request(site, options, middlebox, timeout, quic_timeout)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one() for _ in range(connections)])
+    elapsed = time.perf_counter() - start
+    latencies = [latency for ok, latency, _, _, _ in results if ok]
+    fallbacks = sum(fell_back for _, _, _, _, fell_back in results)
+    failures = {}
+    for ok, _, _, reason, _ in results:
+        if not ok:
+            failures[reason] = failures.get(reason, 0) + 1
+    return {
+        "preset": name,
+        "site": site.spec,
+        "success_rate": round(len(latencies) / connections, 4),
+        "latency_ms": {key: None if value is None else round(value * 1000, 3)
+                       for key, value in (("p50", percentile(latencies, 0.5)), ("p90", percentile(latencies, 0.9)),
+                                          ("p99", percentile(latencies, 0.99)))},
+        "throughput_bytes_per_second": round(sum(received for _, _, received, _, _ in results) / elapsed),
+        "failures": failures,
+        "quic_fallbacks": fallbacks,
+        # A blackholed QUIC attempt costs a wasted datagram and a timeout on every connection
+        "cost": preset_cost(options, site) + (1 if fallbacks else 0),
+    }
+
+
+def rank(results):
+    def key(result):
+        p50 = result["latency_ms"]["p50"]
+        return -result["success_rate"], result["cost"], p50 if p50 is not None else float("inf")
+    return sorted(results, key=key)
+
+
+async def run_benchmark(sites, rules, presets=None, connections=50, concurrency=20, timeout=2.0,
+                        quic_timeout=0.25, response_size=64 * 1024):
+    presets = presets if presets is not None else {"off": {}, **{mode: mode for mode in MODES}}
+    origin = await OriginServer(response_size).start()
+    middlebox = await DpiMiddlebox(rules, origin.tcp_address, origin.udp_address).start()
+    try:
+        report = {"sites": {}, "presets": {}}
+        for spec in sites:
+            site = Site(spec)
+            results = []
+            for name, preset in presets.items():
+                results.append(await bench_preset(name, preset_options(preset), site, middlebox, connections,
+                                                  concurrency, timeout, quic_timeout))
+            ranked = rank(results)
+            working = [result for result in ranked if result["success_rate"] >= 0.99]
+            report["sites"][spec] = {"best": working[0]["preset"] if working else None, "ranking": ranked}
+        for name in presets:
+            rows = [row for site in report["sites"].values() for row in site["ranking"] if row["preset"] == name]
+            report["presets"][name] = {
+                "sites_working": sum(row["success_rate"] >= 0.99 for row in rows),
+                "mean_success_rate": round(sum(row["success_rate"] for row in rows) / len(rows), 4),
+                "cost": sum(row["cost"] for row in rows),
+            }
+        report["overall"] = sorted(report["presets"], key=lambda name: (-report["presets"][name]["sites_working"],
+                                                                         -report["presets"][name]["mean_success_rate"],
+                                                                         report["presets"][name]["cost"]))
+        report["middlebox"] = dict(middlebox.stats)
+        return report
+    finally:
+        middlebox.close()
+        origin.close()
+
+
+def format_report(report):
+    lines = []
+    for spec, site in report["sites"].items():
+        lines.append(f"{spec}  best: {site['best'] or 'none working'}")
+        for row in site["ranking"]:
+            latency = row["latency_ms"]
+            failures = ", ".join(f"{reason} {count}" for reason, count in row["failures"].items())
+            lines.append(f"  {row['preset']:>8}  success {row['success_rate'] * 100:6.1f}%  cost {row['cost']}"
+                         f"  p50 {latency['p50']} ms  p99 {latency['p99']} ms"
+                         f"  {row['throughput_bytes_per_second'] / 1e6:.1f} MB/s  {failures}")
+    lines.append("Overall: " + ", ".join(report["overall"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rank GoodByeDPI presets against a simulated DPI middlebox")
+    parser.add_argument("sites", nargs="+", help="http://host, https://host or quic://host")
+    parser.add_argument("--blocked", default="", help="comma separated hosts the middlebox blocks")
+    parser.add_argument("--dpi", help="JSON file with DpiRules settings (overrides --blocked)")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="also benchmark a profile file (can be given several times)")
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args(argv)
+
+    if args.dpi:
+        with open(args.dpi, "r") as f:
+            rules = DpiRules.from_dict(json.load(f))
+    else:
+        rules = DpiRules([host for host in args.blocked.split(",") if host])
+    presets = {"off": {}, **{mode: mode for mode in MODES}}
+    for path in args.profile:
+        with open(path, "r") as f:
+            profile = json.load(f)
+        presets[f"profile:{profile_hash(profile)[:8]}"] = profile
+    report = asyncio.run(run_benchmark(args.sites, rules, presets, args.connections, args.concurrency,
+                                       args.timeout))
+    print(format_report(report))
+    if args.json:
+        # noinspection PyTypeChecker
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
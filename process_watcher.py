@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import ctypes
+import threading
+
+
+# noinspection SpellCheckingInspection
+PROCESS_NAME = "goodbyedpi.exe"
+
+
+class CachedProcessScanner:
+    # Looks up processes we did not spawn ourselves. Image names are cached per PID so a poll only
+    # queries PIDs that appeared since the previous one; entries are refreshed after cache_ttl seconds
+    # to limit the effect of PID reuse.
+    def __init__(self, cache_ttl=30.0):
+        self.cache_ttl = cache_ttl
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def list_pids(self):
+        raise NotImplementedError
+
+    def query_name(self, pid):
+        raise NotImplementedError
+
+    def find(self, process_name):
+        pids = self._scan(process_name, first=True)
+        return pids[0] if pids else None
+
+    def find_all(self, process_name):
+        return self._scan(process_name)
+
+    def _scan(self, process_name, first=False):
+        now = time.monotonic()
+        found = []
+        with self._lock:
+            try:
+                pids = self.list_pids()
+            except OSError:
+                return found
+            live = set(pids)
+            for pid in [pid for pid in self._names if pid not in live]:
+                del self._names[pid]
+            for pid in pids:
+                entry = self._names.get(pid)
+                if entry is None or now - entry[1] > self.cache_ttl:
+                    entry = (self.query_name(pid), now)
+                    self._names[pid] = entry
+                if entry[0] == process_name:
+                    found.append(pid)
+                    if first:
+                        break
+            return found
+
+    def is_running(self, process_name):
+        return self.find(process_name) is not None
+
+
+class Win32ProcessScanner(CachedProcessScanner):
+    process_query_limited_information = 0x1000
+
+    def list_pids(self):
+        size = 1024
+        while True:
+            processes = (ctypes.c_ulong * size)()  # noqa
+            cb = ctypes.c_ulong(ctypes.sizeof(processes))
+            needed = ctypes.c_ulong()
+            if not ctypes.windll.psapi.EnumProcesses(ctypes.byref(processes), cb, ctypes.byref(needed)):
+                raise OSError("EnumProcesses failed")
+            # A full buffer means the list may have been truncated
+            if needed.value < cb.value:
+                count = needed.value // ctypes.sizeof(ctypes.c_ulong)
+                return [processes[i] for i in range(count) if processes[i]]
+            size *= 2
+
+    def query_name(self, pid):
+        process_handle = ctypes.windll.kernel32.OpenProcess(self.process_query_limited_information, False, pid)
+        if not process_handle:
+            return None
+        try:
+            buffer_size = ctypes.c_ulong(260)
+            buffer = ctypes.create_unicode_buffer(buffer_size.value)
+            if ctypes.windll.kernel32.QueryFullProcessImageNameW(process_handle, 0, buffer,
+                                                                 ctypes.byref(buffer_size)):
+                return os.path.basename(buffer.value)
+            return None
+        finally:
+            ctypes.windll.kernel32.CloseHandle(process_handle)
+
+
+class ProcfsProcessScanner(CachedProcessScanner):
+    def __init__(self, cache_ttl=30.0, root="/proc"):
+        super().__init__(cache_ttl)
+        self.root = root
+
+    def list_pids(self):
+        return [int(name) for name in os.listdir(self.root) if name.isdigit()]
+
+    def query_name(self, pid):
+        try:
+            with open(os.path.join(self.root, str(pid), "cmdline"), "rb") as f:
+                argv0 = f.read().split(b"\0", 1)[0]
+        except OSError:
+            return None
+        if not argv0:
+            return None
+        return os.path.basename(argv0.decode(errors="replace").replace("\\", "/"))
+
+
+class NullProcessScanner(CachedProcessScanner):
+    def list_pids(self):
+        return []
+
+    def query_name(self, pid):
+        return None
+
+
+SCANNERS = {
+    "win32": Win32ProcessScanner,
+    "procfs": ProcfsProcessScanner,
+    "null": NullProcessScanner,
+}
+
+
+def create_scanner(backend=None, **kwargs):
+    if backend is None:
+        if sys.platform == "win32":
+            backend = "win32"
+        elif os.path.isdir("/proc"):
+            backend = "procfs"
+        else:
+            backend = "null"
+    return SCANNERS[backend](**kwargs)
+
+
+class ProcessWatcher:
+    # Tracks the Popen object we spawned: its state comes from the child handle and exits are reported
+    # as soon as they happen. The scanner is only consulted when we do not own a live instance; exclude
+    # returns the PIDs owned by other watchers (e.g. extra instances), which the fallback ignores.
+    def __init__(self, process_name=PROCESS_NAME, scanner=None, exclude=None):
+        self.process_name = process_name
+        self.scanner = scanner if scanner is not None else create_scanner()
+        self.exclude = exclude
+        self.process = None
+        self.exit_code = None
+        self._exit_callbacks = []
+        self._exited = threading.Event()
+        self._exited.set()
+        self._lock = threading.Lock()
+
+    def add_exit_callback(self, callback):
+        self._exit_callbacks.append(callback)
+
+    def attach(self, process):
+        with self._lock:
+            self.process = process
+            self.exit_code = None
+            exited = threading.Event()
+            self._exited = exited
+        threading.Thread(target=self._wait_for_exit, args=(process, exited), daemon=True).start()
+
+    def detach(self):
+        with self._lock:
+            self.process = None
+
+    def _wait_for_exit(self, process, exited):
+        code = process.wait()
+        with self._lock:
+            if process is self.process:
+                self.exit_code = code
+        exited.set()
+        for callback in list(self._exit_callbacks):
+            try:
+                callback(process.pid, code)
+            except Exception:  # noqa
+                pass
+
+    @property
+    def pid(self):
+        process = self.process
+        if process is not None and process.poll() is None:
+            return process.pid
+        if self.exclude is None:
+            return self.scanner.find(self.process_name)
+        pids = self.external_pids()
+        return pids[0] if pids else None
+
+    def owns_running(self):
+        process = self.process
+        return process is not None and process.poll() is None
+
+    def is_running(self):
+        if self.owns_running():
+            return True
+        if self.exclude is None:
+            return self.scanner.is_running(self.process_name)
+        return bool(self.external_pids())
+
+    def external_pids(self):
+        excluded = self.exclude() if self.exclude is not None else ()
+        return [pid for pid in self.scanner.find_all(self.process_name) if pid not in excluded]
+
+    def wait(self, timeout=None, cancel=None):
+        # Returns True if the owned process exited within timeout. Without an owned process this just sleeps,
+        # or waits on the cancel event when one is given so a shutdown does not have to sit out the timeout.
+        if self.owns_running():
+            return self._exited.wait(timeout)
+        if cancel is not None:
+            cancel.wait(timeout)
+        elif timeout:
+            time.sleep(timeout)
+        return False
@@ -0,0 +1,229 @@
+import os
+import hmac
+import json
+import time
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+
+from profile_store import atomic_write_json, migrate_profile
+
+
+REMOTE_CONFIG = "remote_profile.json"
+REMOTE_CACHE_DIR = os.path.join("cache", "remote")
+REMOTE_PROFILE = "remote"
+SIGNATURE_HEADER = "X-Profile-Signature"
+DIGEST_HEADER = "X-Profile-SHA256"
+
+
+class RemoteProfileError(Exception):
+    pass
+
+
+class RemoteProfileSource:
+    # A profile published at an HTTP(S) URL or as a file on a shared directory. Polls are conditional:
+    # If-None-Match/If-Modified-Since for HTTP, mtime and size for files, so an unchanged profile costs a
+    # 304 or a stat. The body is checked against an HMAC-SHA256 signature when a key is configured, or
+    # against a published SHA-256 digest when there is one, before it replaces the local cache.
+    def __init__(self, source, cache_dir=REMOTE_CACHE_DIR, key=None, timeout=10.0):
+        self.source = source
+        self.cache_dir = cache_dir
+        self.key = key.encode() if isinstance(key, str) else key
+        self.timeout = timeout
+        self.is_http = source.startswith(("http://", "https://"))
+        name = hashlib.sha1(source.encode()).hexdigest()[:12]
+        self.cache_path = os.path.join(cache_dir, f"{name}.json")
+        self.meta_path = os.path.join(cache_dir, f"{name}.meta.json")
+        self.meta = self._read_meta() if os.path.exists(self.cache_path) else {}
+        self.meta_error = None
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def fetch(self):
+        # Returns the new profile when the source changed, None when it did not
+        if self.is_http:
+            result = self._fetch_http()
+        else:
+            result = self._fetch_file()
+        if result is None:
+            return None
+        body, validators, signature, digest = result
+        sha256 = hashlib.sha256(body).hexdigest()
+        self._verify(body, sha256, signature, digest)
+        if sha256 == self.meta.get("sha256") and os.path.exists(self.cache_path):
+            # Same content under new validators, e.g. the file was touched
+            self._save_meta(dict(validators, sha256=sha256))
+            return None
+        try:
+            profile = json.loads(body)
+            if not isinstance(profile, dict):
+                raise ValueError("not a JSON object")
+            profile = migrate_profile(profile)
+        except ValueError as e:
+            raise RemoteProfileError(f"Invalid profile from {self.source}: {e}") from e
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(temp, "wb") as f:
+                f.write(body)
+            os.replace(temp, self.cache_path)
+        except OSError as e:
+            raise RemoteProfileError(f"Cannot cache profile from {self.source}: {e}") from e
+        self._save_meta(dict(validators, sha256=sha256))
+        return profile
+
+    def _save_meta(self, meta):
+        # The validators only save work on the next poll, so failing to persist them is reported but the
+        # fetched profile is still used
+        meta["checked_at"] = time.time()
+        self.meta = meta
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            atomic_write_json(self.meta_path, meta)
+        except OSError as e:
+            self.meta_error = f"Cannot save {self.meta_path}: {e}"
+
+    def _verify(self, body, sha256, signature, digest):
+        if self.key is not None:
+            if signature is None:
+                raise RemoteProfileError(f"Unsigned profile from {self.source}")
+            expected = hmac.new(self.key, body, hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(expected, signature.strip().lower()):
+                raise RemoteProfileError(f"Bad signature on profile from {self.source}")
+        elif digest is not None and not hmac.compare_digest(sha256, digest.strip().lower()):
+            raise RemoteProfileError(f"Profile from {self.source} does not match its SHA-256")
+
+    def _get(self, url, headers=None):
+        request = urllib.request.Request(url, headers=headers or {})
+        return urllib.request.urlopen(request, timeout=self.timeout)  # noqa
+
+    def _fetch_http(self):
+        headers = {}
+        if self.meta.get("etag"):
+            headers["If-None-Match"] = self.meta["etag"]
+        if self.meta.get("last_modified"):
+            headers["If-Modified-Since"] = self.meta["last_modified"]
+        try:
+            with self._get(self.source, headers) as response:
+                body = response.read()
+                validators = {"etag": response.headers.get("ETag"),
+                              "last_modified": response.headers.get("Last-Modified")}
+                signature = response.headers.get(SIGNATURE_HEADER)
+                digest = response.headers.get(DIGEST_HEADER)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise RemoteProfileError(f"{self.source}: HTTP {e.code}") from e
+        except (OSError, ValueError) as e:
+            raise RemoteProfileError(f"{self.source}: {e}") from e
+        # Static servers cannot send custom headers, so sidecar files are the fallback
+        if self.key is not None and signature is None:
+            signature = self._sidecar_http(".sig")
+        if self.key is None and digest is None:
+            digest = self._sidecar_http(".sha256")
+        return body, validators, signature, digest
+
+    def _sidecar_http(self, suffix):
+        try:
+            with self._get(self.source + suffix) as response:
+                return response.read().decode().split()[0]
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _fetch_file(self):
+        try:
+            stat = os.stat(self.source)
+        except OSError as e:
+            raise RemoteProfileError(f"{self.source}: {e}") from e
+        validators = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+        if self.meta.get("mtime") == stat.st_mtime_ns and self.meta.get("size") == stat.st_size:
+            return None
+        try:
+            with open(self.source, "rb") as f:
+                body = f.read()
+        except OSError as e:
+            raise RemoteProfileError(f"{self.source}: {e}") from e
+        return body, validators, self._sidecar_file(".sig"), self._sidecar_file(".sha256")
+
+    def _sidecar_file(self, suffix):
+        try:
+            with open(self.source + suffix, "r") as f:
+                return f.read().split()[0]
+        except (OSError, IndexError):
+            return None
+
+
+class RemoteProfileSync:
+    # Polls a RemoteProfileSource every `interval` seconds on its own thread and hands changed profiles to
+    # on_update(name, profile); on_error(message) receives fetch and verification failures.
+    def __init__(self, source, on_update, on_error=None, name=REMOTE_PROFILE, interval=300.0, activate=False):
+        self.source = source
+        self.on_update = on_update
+        self.on_error = on_error
+        self.name = name
+        self.interval = interval
+        self.activate = activate
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, on_update, on_error=None, path=REMOTE_CONFIG):
+        with open(path, "r") as f:
+            config = json.load(f)
+        source = RemoteProfileSource(config.pop("source"), key=config.pop("key", None),
+                                     timeout=config.pop("timeout", 10.0))
+        return cls(source, on_update, on_error, **config)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="remote-profile", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        while True:
+            self.poll()
+            if self._stop.wait(self.interval):
+                return
+
+    def poll(self):
+        # A failed poll is reported and retried on the next interval; nothing ends the sync thread
+        try:
+            profile = self.source.fetch()
+        except RemoteProfileError as e:
+            self._error(str(e))
+            return False
+        except Exception as e:
+            self._error(f"Remote profile check failed: {e!r}")
+            return False
+        finally:
+            if self.source.meta_error:
+                self._error(self.source.meta_error)
+                self.source.meta_error = None
+        if profile is None:
+            return False
+        try:
+            self.on_update(self.name, profile)
+        except Exception as e:
+            # Forgetting the validators makes the next poll fetch and offer the same profile again
+            self.source.meta = {}
+            self._error(f"Applying remote profile failed: {e!r}")
+            return False
+        return True
+
+    def _error(self, message):
+        if self.on_error is None:
+            return
+        try:
+            self.on_error(message)
+        except Exception:  # noqa
+            pass
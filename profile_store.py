@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+
+from goodbyedpi_core import CONFIG_FILE, profile_hash, read_profile
+
+
+PROFILE_DIR = "profiles"
+INDEX_FILE = "index.json"
+SCHEMA_VERSION = 1
+DEFAULT_PROFILE = "default"
+
+
+def atomic_write_json(path, data):
+    # Written to a temporary file in the same directory and renamed over the target, so a crash or
+    # power loss leaves either the old or the new file, never a truncated one
+    temp = f"{path}.{os.getpid()}.tmp"
+    # noinspection PyTypeChecker
+    with open(temp, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+class UnknownProfileError(KeyError):
+    # A KeyError for callers that look names up, with a readable message instead of the quoted key
+    def __str__(self):
+        return f"Unknown profile: {self.args[0]}"
+
+
+# noinspection SpellCheckingInspection
+def migrate_profile(profile):
+    # Version 0 is the original profile.json layout without a schema field
+    version = profile.get("schema", 0)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Profile schema {version} is newer than supported ({SCHEMA_VERSION})")
+    if version < 1:
+        profile = {
+            "schema": 1,
+            "modeset": profile.get("modeset", ""),
+            "checkbox_flags": dict(profile.get("checkbox_flags", {})),
+            "spin_values": dict(profile.get("spin_values", {})),
+            "line_values": dict(profile.get("line_values", {})),
+        }
+    return profile
+
+
+class ProfileStore:
+    # Named profiles, one JSON file each, plus a small index so listing and picking the active profile
+    # never has to open every profile file
+    def __init__(self, directory=PROFILE_DIR, legacy_file=CONFIG_FILE):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self._lock = threading.Lock()
+        # Set when the legacy profile could not be imported; front-ends report it, the store starts empty
+        self.import_error = None
+        os.makedirs(directory, exist_ok=True)
+        self.index = self._read_index()
+        if self.index is None:
+            self.index = {"schema": SCHEMA_VERSION, "active": DEFAULT_PROFILE, "profiles": {}}
+            if legacy_file and os.path.exists(legacy_file):
+                try:
+                    self.save(DEFAULT_PROFILE, read_profile(legacy_file))
+                except (OSError, ValueError) as e:
+                    # The index is not written, so the import is retried once the file is fixed
+                    self.import_error = f"Failed to import {legacy_file}: {e}"
+            else:
+                self._write_index()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_index(self):
+        atomic_write_json(self.index_path, self.index)
+
+    def reload(self):
+        # Picks up profiles added or edited by another process
+        with self._lock:
+            index = self._read_index()
+            if index is not None:
+                self.index = index
+
+    @staticmethod
+    def file_name(name):
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "_", name).strip("_")[:40] or "profile"
+        return f"{slug}-{hashlib.sha1(name.encode()).hexdigest()[:8]}.json"
+
+    def names(self):
+        with self._lock:
+            return sorted(self.index["profiles"])
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self.index["profiles"]
+
+    @property
+    def active(self):
+        return self.index.get("active", DEFAULT_PROFILE)
+
+    def set_active(self, name):
+        with self._lock:
+            if name != self.index.get("active"):
+                self.index["active"] = name
+                self._write_index()
+
+    def load(self, name=None):
+        # The default profile exists implicitly (empty) until it is first saved; any other name that is not
+        # in the index raises UnknownProfileError, so a typo never runs goodbyedpi without options
+        with self._lock:
+            name = self.index.get("active", DEFAULT_PROFILE) if name is None else name
+            entry = self.index["profiles"].get(name)
+        if entry is None:
+            if name == DEFAULT_PROFILE:
+                return migrate_profile({})
+            raise UnknownProfileError(name)
+        with open(os.path.join(self.directory, entry["file"]), "r") as f:
+            return migrate_profile(json.load(f))
+
+    def save(self, name, profile):
+        profile = migrate_profile(profile)
+        digest = profile_hash(profile)
+        with self._lock:
+            entry = self.index["profiles"].get(name)
+            if entry is not None and entry.get("hash") == digest:
+                return False
+            file_name = entry["file"] if entry else self.file_name(name)
+            atomic_write_json(os.path.join(self.directory, file_name), dict(profile, name=name))
+            self.index["profiles"][name] = {"file": file_name, "hash": digest, "updated": time.time()}
+            self._write_index()
+        return True
+
+    def delete(self, name):
+        with self._lock:
+            entry = self.index["profiles"].pop(name, None)
+            if entry is None:
+                return
+            if self.index.get("active") == name:
+                self.index["active"] = DEFAULT_PROFILE
+            self._write_index()
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
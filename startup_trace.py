@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import time
+
+
+TRACE_ENV = "GOODBYEDPI_STARTUP_TRACE"
+TRACE_FLAG = "--startup-trace"
+
+
+class StartupTrace:
+    # Opt-in per-phase startup timings. Enabled by the GOODBYEDPI_STARTUP_TRACE environment variable or
+    # "--startup-trace PATH" on the command line; when disabled every call is a no-op.
+    def __init__(self, path=None):
+        self.path = path
+        self.origin = time.perf_counter()
+        self.last = self.origin
+        self.phases = []
+
+    @classmethod
+    def from_env(cls, argv=None):
+        argv = sys.argv if argv is None else argv
+        path = os.environ.get(TRACE_ENV)
+        if TRACE_FLAG in argv:
+            index = argv.index(TRACE_FLAG)
+            if index + 1 < len(argv):
+                path = argv[index + 1]
+                del argv[index:index + 2]
+        return cls(path)
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def mark(self, phase):
+        # Records the time spent since the previous mark under the given phase name
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases.append({
+            "phase": phase,
+            "seconds": round(now - self.last, 6),
+            "since_start": round(now - self.origin, 6),
+        })
+        self.last = now
+        self.dump()
+
+    def restart(self):
+        # Phases that happen later, on demand (like building the settings window), are timed from here
+        self.last = time.perf_counter()
+
+    def dump(self):
+        try:
+            # noinspection PyTypeChecker
+            with open(self.path, "w") as f:
+                json.dump({"pid": os.getpid(), "argv": sys.argv, "phases": self.phases}, f, indent=2)
+        except OSError:
+            pass
@@ -0,0 +1,88 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blacklist_compiler import HostTrie, compile_blacklists, normalize_host
+
+
+class NormalizeHostTest(unittest.TestCase):
+    def test_lines(self):
+        for line, host in (("example.com\n", "example.com"), ("  WWW.Example.COM.  ", "www.example.com"),
+                           ("https://example.com:8443/path?q=1", "example.com"), ("0.0.0.0 ads.example", "ads.example"),
+                           ("*.example.org", "example.org"), ("example.net # mirror", "example.net"),
+                           ("пример.рф", "xn--e1afmkfd.xn--p1ai"), ("ドメイン.テスト", "xn--eckwd4c7c.xn--zckzah")):
+            self.assertEqual(normalize_host(line), host, line)
+
+    def test_ignored_lines(self):
+        for line in ("", "   \n", "# comment", "  # indented comment", "*.", "*", "ads.*.example", "https:///path"):
+            self.assertIsNone(normalize_host(line), line)
+
+
+class HostTrieTest(unittest.TestCase):
+    def test_suffix_dedup(self):
+        trie = HostTrie()
+        self.assertTrue(trie.add("www.example.com"))
+        self.assertTrue(trie.add("cdn.example.com"))
+        # A parent domain replaces the subdomains it covers, later subdomains are dropped
+        self.assertTrue(trie.add("example.com"))
+        self.assertFalse(trie.add("img.example.com"))
+        self.assertFalse(trie.add("example.com"))
+        # Sharing a suffix string is not enough, only whole labels count
+        self.assertTrue(trie.add("badexample.com"))
+        self.assertEqual(sorted(trie.hosts()), ["badexample.com", "example.com"])
+
+
+class CompileBlacklistsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.cache = os.path.join(self.directory, "cache")
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_compile_and_reuse(self):
+        a = self.write("a.txt", "example.com\nwww.example.com\n# comment\n")
+        b = self.write("b.txt", "0.0.0.0 ads.example.org\nexample.com\n")
+        output, stats = compile_blacklists([a, b], cache_dir=self.cache)
+        self.assertFalse(stats["cached"])
+        self.assertEqual((stats["input_entries"], stats["output_entries"]), (4, 2))
+        with open(output) as f:
+            self.assertEqual(f.read(), "ads.example.org\nexample.com\n")
+        again, stats = compile_blacklists([a, b], cache_dir=self.cache)
+        self.assertEqual(again, output)
+        self.assertTrue(stats["cached"])
+        self.assertEqual(stats["output_entries"], 2)
+        # Edited contents are compiled again under a new name
+        self.write("b.txt", "other.example\n")
+        changed, stats = compile_blacklists([a, b], cache_dir=self.cache)
+        self.assertNotEqual(changed, output)
+        self.assertFalse(stats["cached"])
+
+    def test_cache_keeps_newest_entries(self):
+        source = os.path.join(self.directory, "list.txt")
+        outputs = []
+        for i in range(5):
+            self.write("list.txt", f"host-{i}.example\n")
+            outputs.append(compile_blacklists([source], cache_dir=self.cache, keep=3)[0])
+            os.utime(outputs[-1], ns=(0, (i + 1) * 1_000_000_000))
+        self.assertEqual(sorted(os.listdir(self.cache)), sorted(
+            name for path in outputs[-3:] for name in (os.path.basename(path), os.path.basename(path)[:-3] + "json")))
+        # A cache hit counts as a use, so the reused entry outlives newer ones
+        self.write("list.txt", "host-2.example\n")
+        self.assertTrue(compile_blacklists([source], cache_dir=self.cache, keep=3)[1]["cached"])
+        self.write("list.txt", "host-5.example\n")
+        compile_blacklists([source], cache_dir=self.cache, keep=3)
+        self.assertTrue(os.path.exists(outputs[2]))
+        self.assertFalse(os.path.exists(outputs[3]))
+
+
+if __name__ == "__main__":
+    unittest.main()
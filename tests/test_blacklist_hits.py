@@ -0,0 +1,113 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blacklist_hits
+from blacklist_hits import HitCounter, analyze, entry_hits, line_host, read_hits, write_pruned
+
+
+def dns_line(host):
+    return f"[DNS] 192.168.1.10:53120 -> 1.1.1.1:1253 request for {host}"
+
+
+class HitCounterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, "cache", "hits.log")
+
+    def test_line_host(self):
+        self.assertEqual(line_host(dns_line("WWW.Example.com.")), "www.example.com")
+        self.assertIsNone(line_host("GoodbyeDPI: Passive DPI blocker and Active DPI circumvention utility"))
+
+    def test_log_accumulates_across_flushes(self):
+        counter = HitCounter(self.path)
+        for host in ("a.example", "b.example", "a.example", "not a dns line"):
+            counter.add_line(dns_line(host) if "example" in host else host)
+        self.assertEqual(counter.flush(), 2)
+        self.assertEqual(counter.flush(), 0)
+        counter.add_line(dns_line("a.example"))
+        counter.flush()
+        # Appended records from a truncated write are skipped
+        with open(self.path, "a") as f:
+            f.write("1\t5\tc.exa")
+        hits, records = read_hits(self.path)
+        self.assertEqual(records, 3)
+        self.assertEqual({host: count for host, (count, seen) in hits.items()}, {"a.example": 3, "b.example": 1})
+        self.assertEqual(counter.lines, 5)
+
+    def test_compaction(self):
+        counter = HitCounter(self.path)
+        for _ in range(blacklist_hits.COMPACT_RATIO * 3):
+            counter.add("a.example")
+            counter.add("b.example", 2)
+            counter.flush()
+        # Compacted back to one line per host whenever it outgrows COMPACT_RATIO lines per host
+        with open(self.path) as f:
+            self.assertLessEqual(len(f.readlines()), blacklist_hits.COMPACT_RATIO * 2 + 2)
+        counter.compact()
+        hits, records = read_hits(self.path)
+        self.assertEqual(records, 2)
+        self.assertEqual(hits["a.example"][0], blacklist_hits.COMPACT_RATIO * 3)
+        self.assertEqual(hits["b.example"][0], blacklist_hits.COMPACT_RATIO * 6)
+
+    def test_failed_flush_is_retried(self):
+        counter = HitCounter(self.path, flush_interval=0.01)
+        counter.add("a.example", 2)
+        flushes = []
+        real_open = open
+
+        def failing_open(path, *args, **kwargs):
+            if path == self.path and len(flushes) < 2:
+                flushes.append(path)
+                raise OSError("disk full")
+            return real_open(path, *args, **kwargs)
+
+        with mock.patch("builtins.open", failing_open):
+            counter.start()
+            for _ in range(500):
+                if len(flushes) == 2:
+                    break
+                counter._stop.wait(0.01)
+            self.assertEqual(len(flushes), 2)
+            counter.add("a.example")
+            counter.stop()
+        self.assertEqual(read_hits(self.path)[0]["a.example"][0], 3)
+
+
+class ReportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_entry_hits_matches_whole_labels(self):
+        hits = {"www.example.com": [3, 100], "example.com": [1, 50], "badexample.com": [7, 200],
+                "cdn.example.org": [2, 300]}
+        result = entry_hits(["example.com", "example.org", "other.net"], hits)
+        self.assertEqual(result, {"example.com": [4, 100], "example.org": [2, 300], "other.net": [0, 0]})
+
+    def test_analyze_and_write_pruned(self):
+        blacklist = os.path.join(self.directory, "blacklist.txt")
+        with open(blacklist, "w") as f:
+            f.write("example.com\nold.example\nrare.example\nnever.example\n")
+        hits_path = os.path.join(self.directory, "hits.log")
+        with open(hits_path, "w") as f:
+            f.write("196400\t5\twww.example.com\n10\t9\told.example\n196400\t1\trare.example\n")
+        report = analyze([blacklist], hits_path, min_hits=2, max_age_days=1, now=200000)
+        self.assertEqual(report["kept"], ["example.com"])
+        self.assertEqual(sorted(report["rare"]), ["old.example", "rare.example"])
+        self.assertEqual(report["never"], ["never.example"])
+        pruned = write_pruned(report, os.path.join(self.directory, "pruned.txt"))
+        with open(pruned) as f:
+            self.assertEqual(f.read(), "example.com\n")
+        self.assertEqual(os.listdir(self.directory).count("pruned.txt"), 1)
+        self.assertFalse([name for name in os.listdir(self.directory) if name.endswith(".tmp")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import sys
+import stat
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from multiprocessing.connection import Listener
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import control_channel
+from control_channel import ControlError, ControlServer, build_parser, control_key, request_args, send_command
+
+
+@unittest.skipIf(sys.platform == "win32", "Unix socket and POSIX permission checks")
+class ControlChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.key_path = os.path.join(self.directory, "control.key")
+        self.address = os.path.join(self.directory, "control.sock")
+        patcher = mock.patch.object(control_channel, "control_key_path", lambda: self.key_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_key_replaces_planted_symlink(self):
+        target = os.path.join(self.directory, "target")
+        with open(target, "w") as f:
+            f.write("keep")
+        os.symlink(target, self.key_path)
+        key = control_key(create=True)
+        self.assertFalse(os.path.islink(self.key_path))
+        self.assertEqual(stat.S_IMODE(os.stat(self.key_path).st_mode), 0o600)
+        self.assertEqual(control_key(), key)
+        with open(target) as f:
+            self.assertEqual(f.read(), "keep")
+
+    def test_readable_key_is_refused(self):
+        control_key(create=True)
+        os.chmod(self.key_path, 0o644)
+        with self.assertRaises(PermissionError):
+            control_key()
+        with self.assertRaises(ConnectionError):
+            send_command("status", self.address)
+
+    def test_failing_handler_keeps_connection(self):
+        def fail():
+            raise KeyError("boom")
+
+        server = ControlServer({"status": lambda: "running", "fail": fail}, self.address)
+        server.start()
+        self.addCleanup(server.stop)
+        with self.assertRaises(ControlError):
+            send_command("fail", self.address)
+        with self.assertRaises(ControlError):
+            send_command("status", self.address, unexpected=1)
+        self.assertEqual(server.handle(["status"]), {"ok": False, "error": "Malformed request"})
+        self.assertEqual(send_command("status", self.address), "running")
+
+    def test_second_server_leaves_first_running(self):
+        first = ControlServer({"status": lambda: "first"}, self.address)
+        first.start()
+        self.addCleanup(first.stop)
+        with open(self.key_path, "rb") as f:
+            key = f.read()
+        second = ControlServer({"status": lambda: "second"}, self.address)
+        with self.assertRaises(OSError):
+            second.start()
+        with open(self.key_path, "rb") as f:
+            self.assertEqual(f.read(), key)
+        self.assertEqual(send_command("status", self.address), "first")
+
+    def test_stale_socket_is_replaced(self):
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(self.address)
+        stale.close()
+        server = ControlServer({"status": lambda: "running"}, self.address)
+        server.start()
+        self.addCleanup(server.stop)
+        self.assertEqual(send_command("status", self.address), "running")
+
+    def test_connection_closed_before_reply(self):
+        listener = Listener(self.address, authkey=control_key(create=True))
+        self.addCleanup(listener.close)
+
+        def hang_up():
+            with listener.accept() as connection:
+                connection.recv_bytes()
+
+        thread = threading.Thread(target=hang_up, daemon=True)
+        thread.start()
+        with self.assertRaises(ConnectionError):
+            send_command("status", self.address)
+        thread.join(5)
+
+
+class RequestArgsTest(unittest.TestCase):
+    def test_tail_log_count(self):
+        parser = build_parser()
+        self.assertEqual(request_args(parser.parse_args(["tail-log", "20"])), {"lines": 20})
+        self.assertEqual(request_args(parser.parse_args(["tail-log"])), {})
+        for argument in ("0", "-5", "ten"):
+            with self.assertRaises(ControlError):
+                request_args(parser.parse_args(["tail-log", "--", argument]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import sys
+import socket
+import struct
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from goodbyedpi_core import MODES, build_argv
+from dns_select import HEADER, DnsBenchmark, DnsSelector, Resolver, ResolverStats, select, with_resolvers
+
+
+class Responder:
+    # A local UDP "resolver": answers every query with `rcode`, or drops every `drop_every`-th one
+    def __init__(self, rcode=0, drop_every=None):
+        self.rcode = rcode
+        self.drop_every = drop_every
+        self.received = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.1)
+        self.spec = f"127.0.0.1:{self.socket.getsockname()[1]}"
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                data, address = self.socket.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.received += 1
+            if self.drop_every and self.received % self.drop_every == 0:
+                continue
+            query_id, flags = struct.unpack_from("!HH", data)
+            answer = HEADER.pack(query_id, flags | 0x8000 | self.rcode, 1, 0, 0, 0) + data[HEADER.size:]
+            self.socket.sendto(answer, address)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(5)
+        self.socket.close()
+
+
+class ResolverTest(unittest.TestCase):
+    def test_specs(self):
+        for spec, address, port, version in (("1.1.1.1", "1.1.1.1", 53, 4), ("77.88.8.8:1253", "77.88.8.8", 1253, 4),
+                                             ("2606:4700::1111", "2606:4700::1111", 53, 6),
+                                             ("[2a02:6b8::feed:0ff]:1253", "2a02:6b8::feed:ff", 1253, 6)):
+            resolver = Resolver(spec)
+            self.assertEqual((resolver.address, resolver.port, resolver.version), (address, port, version), spec)
+
+    def test_invalid_specs(self):
+        for spec in ("", "resolver.example", "1.1.1.1:0", "1.1.1.1:70000", "1.1.1.1:dns", "[::1]:x", "300.1.1.1"):
+            with self.assertRaises(ValueError, msg=spec):
+                Resolver(spec)
+
+
+class SelectTest(unittest.TestCase):
+    def setUp(self):
+        self.responders = []
+
+    def tearDown(self):
+        for responder in self.responders:
+            responder.close()
+
+    def responder(self, **kwargs):
+        responder = Responder(**kwargs)
+        self.responders.append(responder)
+        return responder
+
+    def test_measure_and_select(self):
+        good = self.responder()
+        lossy = self.responder(drop_every=2)
+        refusing = self.responder(rcode=5)
+        benchmark = DnsBenchmark([good.spec, lossy.spec, refusing.spec], ["example.com", "example.org"], rounds=4,
+                                 timeout=0.3)
+        results = benchmark.measure()
+        self.assertEqual(results[good.spec].failures, 0)
+        self.assertEqual(results[lossy.spec].failure_rate(), 0.5)
+        self.assertEqual(results[refusing.spec].failure_rate(), 1.0)
+        self.assertEqual(select(results, 0.1), {4: results[good.spec].resolver})
+        # With the good resolver gone, the lossy one is only picked when its failure rate is tolerated
+        del results[good.spec]
+        self.assertEqual(select(results, 0.1), {})
+        self.assertEqual(select(results, 0.5), {4: results[lossy.spec].resolver})
+
+    def test_fastest_per_family(self):
+        stats = {}
+        for spec, latencies in (("1.1.1.1", [5, 6, 7]), ("8.8.8.8", [3, 4, 30]), ("[::1]:53", [9]),
+                                ("9.9.9.9", [1, 1, 1])):
+            stats[spec] = ResolverStats(Resolver(spec))
+            stats[spec].latencies = latencies
+        stats["9.9.9.9"].failures = 1
+        selection = select(stats, 0.1)
+        self.assertEqual(selection[4].spec, "8.8.8.8")
+        self.assertEqual(selection[6].spec, "[::1]:53")
+
+
+class WithResolversTest(unittest.TestCase):
+    def test_preset_is_expanded(self):
+        selection = {4: Resolver("77.88.8.8:1253"), 6: Resolver("[2a02:6b8::feed:0ff]:1253")}
+        profile = with_resolvers({"modeset": "-9", "line_values": {}}, selection)
+        self.assertEqual(profile["modeset"], "")
+        argv = build_argv(profile, "goodbyedpi.exe")
+        for flag in MODES["-9"]:
+            self.assertIn(flag, argv)
+        self.assertEqual(argv[argv.index("--dns-addr") + 1], "77.88.8.8")
+        self.assertEqual(argv[argv.index("--dns-port") + 1], "1253")
+        self.assertEqual(argv[argv.index("--dnsv6-addr") + 1], "2a02:6b8::feed:ff")
+
+
+class FakeBenchmark:
+    resolvers = [Resolver("127.0.0.1:5353")]
+
+    def measure(self, resolvers):
+        stats = ResolverStats(resolvers[0])
+        stats.latencies = [1.0]
+        return {resolvers[0].spec: stats}
+
+
+class DnsSelectorTest(unittest.TestCase):
+    def test_schedule_survives_errors(self):
+        errors = []
+        calls = []
+
+        def on_select(selection, results):
+            calls.append(selection)
+            if len(calls) == 1:
+                raise OSError("profile not writable")
+            if len(calls) == 3:
+                # stop() would join this very thread
+                selector._stop.set()
+
+        selector = DnsSelector(FakeBenchmark(), on_select, errors.append, interval=0.01)
+        selector.start()
+        selector._thread.join(5)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("profile not writable", errors[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instances import INSTANCES_CONFIG
+from health_probe import HEALTH_CONFIG
+from profile_remote import REMOTE_CONFIG
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class HeadlessTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def run_headless(self, *args):
+        return subprocess.run([sys.executable, os.path.join(ROOT, "GoodByeDPI-Headless.py"), "--no-log", *args],
+                              cwd=self.directory, capture_output=True, text=True, timeout=60)
+
+    def test_malformed_configs_disable_features(self):
+        for name, text in ((INSTANCES_CONFIG, "{"), (REMOTE_CONFIG, "{}"), (HEALTH_CONFIG, '{"targets": 5}')):
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.write(text)
+        # There is no bin/goodbyedpi.exe here, so the runner stops with an error once the features are set up
+        result = self.run_headless("--no-restart")
+        self.assertNotIn("Traceback", result.stderr)
+        for feature in ("Instances disabled", "Remote profile disabled", "Health probes disabled"):
+            self.assertIn(feature, result.stderr)
+        self.assertEqual(result.returncode, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
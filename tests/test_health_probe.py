@@ -0,0 +1,55 @@
+import os
+import sys
+import asyncio
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from health_probe import HealthMonitor, ProbeTarget
+
+
+async def broken_probe(timeout):
+    raise RuntimeError("probe bug")
+
+
+async def good_probe(timeout):
+    pass
+
+
+class HealthMonitorTest(unittest.TestCase):
+    def monitor(self, on_failover=None):
+        targets = [ProbeTarget("tls://broken.example", broken_probe), ProbeTarget("tls://good.example", good_probe)]
+        return HealthMonitor(targets, on_failover, fallbacks=["-9"], min_samples=1, threshold=0.75,
+                             consecutive=1)
+
+    def test_unexpected_probe_error_is_a_failure(self):
+        monitor = self.monitor()
+        asyncio.run(monitor.probe_round())
+        asyncio.run(monitor.probe_round())
+        self.assertEqual(monitor.rounds, 2)
+        self.assertEqual(monitor.snapshot()["targets"]["tls://broken.example"]["success_rate"], 0.0)
+        self.assertIn("probe bug", monitor.last_error)
+
+    def test_failover_runs_off_the_loop_thread(self):
+        calls = []
+
+        def on_failover(fallback, rate):
+            calls.append((fallback, rate, threading.current_thread()))
+            raise ValueError("restart failed")
+
+        async def round_thread():
+            await monitor.probe_round()
+            return threading.current_thread()
+
+        monitor = self.monitor(on_failover)
+        loop_thread = asyncio.run(round_thread())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][:2], ("-9", 0.5))
+        self.assertIsNot(calls[0][2], loop_thread)
+        self.assertEqual(monitor.failovers, 1)
+        self.assertIn("restart failed", monitor.last_error)
+
+
+if __name__ == "__main__":
+    unittest.main()
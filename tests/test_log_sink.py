@@ -0,0 +1,123 @@
+import os
+import sys
+import gzip
+import time
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_sink import RotatingLogSink
+
+
+class BlockedSink(RotatingLogSink):
+    # Writer held inside its first batch, so the queue fills up behind it
+    def __init__(self, *args, **kwargs):
+        self.release = threading.Event()
+        super().__init__(*args, **kwargs)
+
+    def _write(self, records):
+        self.release.wait()
+        super()._write(records)
+
+
+class RotatingLogSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def read(self, sink):
+        with open(sink.path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def test_bad_record_is_dropped_and_writer_keeps_running(self):
+        sink = RotatingLogSink(self.directory, flush_interval=0.05)
+        sink._put((float("nan"), "-", "bad timestamp"))
+        sink.write("after")
+        sink.close()
+        self.assertEqual(sink.dropped, 1)
+        self.assertIn("after", self.read(sink))
+
+    def test_write_errors_are_counted_and_recovered(self):
+        blocker = os.path.join(self.directory, "logs")
+        with open(blocker, "w") as f:
+            f.write("a file where the log directory should be")
+        sink = RotatingLogSink(blocker, flush_interval=0.05)
+        sink.write("lost")
+        deadline = time.monotonic() + 5
+        while not sink.errors and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sink.dropped, 1)
+        self.assertTrue(sink._thread.is_alive())
+        os.remove(blocker)
+        sink.write("kept")
+        sink.close()
+        self.assertIn("kept", self.read(sink))
+
+    def test_close_with_full_queue_returns(self):
+        sink = BlockedSink(self.directory, queue_size=2, flush_interval=0.05)
+        for i in range(10):
+            sink.write(f"line {i}")
+        start = time.monotonic()
+        sink.close(timeout=0.5)
+        self.assertLess(time.monotonic() - start, 2)
+        sink.release.set()
+        sink._thread.join(5)
+        self.assertFalse(sink._thread.is_alive())
+
+
+class RotationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def write_batch(self, sink, batch, lines=10):
+        # One record of several lines, written before the next one is queued, since the size limit is checked
+        # after each batch the writer takes
+        expected = sink.written + 1
+        sink.write("\n".join(f"batch {batch} line {i} " + "x" * 40 for i in range(lines)))
+        deadline = time.monotonic() + 5
+        while sink.written < expected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sink.written, expected)
+
+    def test_rotates_at_size_limit(self):
+        sink = RotatingLogSink(self.directory, max_bytes=10_000, flush_interval=0.05)
+        self.write_batch(sink, 0)
+        self.assertEqual(os.listdir(self.directory), ["goodbyedpi.log"])
+        sink.max_bytes = 500
+        self.write_batch(sink, 1)
+        sink.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["goodbyedpi.log", "goodbyedpi.log.1.gz"])
+        self.assertEqual(os.path.getsize(sink.path), 0)
+
+    def test_compressed_backups_are_kept_up_to_backup_count(self):
+        sink = RotatingLogSink(self.directory, max_bytes=500, backup_count=2, flush_interval=0.05)
+        for batch in range(5):
+            self.write_batch(sink, batch)
+        sink.close()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["goodbyedpi.log", "goodbyedpi.log.1.gz", "goodbyedpi.log.2.gz"])
+        # Newest first: .1 holds the last batch
+        for index, batch in ((1, 4), (2, 3)):
+            with gzip.open(os.path.join(self.directory, f"goodbyedpi.log.{index}.gz"), "rt", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 10)
+            self.assertTrue(all(f"batch {batch} line" in line for line in lines), lines)
+
+    def test_uncompressed_and_no_backups(self):
+        plain = RotatingLogSink(self.directory, max_bytes=500, backup_count=1, compress=False, flush_interval=0.05)
+        self.write_batch(plain, 0)
+        self.write_batch(plain, 1)
+        plain.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["goodbyedpi.log", "goodbyedpi.log.1"])
+        with open(os.path.join(self.directory, "goodbyedpi.log.1"), encoding="utf-8") as f:
+            self.assertIn("batch 1 line 9", f.read())
+        directory = os.path.join(self.directory, "none")
+        sink = RotatingLogSink(directory, max_bytes=500, backup_count=0, flush_interval=0.05)
+        self.write_batch(sink, 0)
+        sink.close()
+        self.assertEqual(os.listdir(directory), ["goodbyedpi.log"])
+
+
+if __name__ == "__main__":
+    unittest.main()
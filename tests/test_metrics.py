@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+import threading
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from goodbyedpi_core import Supervisor
+from metrics import MetricsCollector, MetricsServer
+
+
+class MetricsServerTest(unittest.TestCase):
+    def server(self):
+        return MetricsServer(MetricsCollector(Supervisor(), interval=60), "127.0.0.1", 0)
+
+    def test_stop_without_start(self):
+        # The headless runner stops the server in `finally` even when goodbyedpi failed to start first
+        server = self.server()
+        thread = threading.Thread(target=server.stop, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_serves_json_then_stops(self):
+        server = self.server()
+        server.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics.json"
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertIn("up", json.load(response))
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from output_events import EVENT_TYPE_CAPACITY, SEARCH_SCAN_LIMIT, EventStore
+
+
+def dns_line(i):
+    return f"[DNS] 192.168.1.10:5312{i % 10} -> 1.1.1.1:1253 request for host-{i % 7}.example"
+
+
+class EventStoreTest(unittest.TestCase):
+    def test_default_capacity_is_bounded(self):
+        store = EventStore()
+        lines = EVENT_TYPE_CAPACITY["dns"] * 3
+        for i in range(lines):
+            store.add(dns_line(i))
+        self.assertLessEqual(len(store), EVENT_TYPE_CAPACITY["dns"])
+        self.assertEqual(store.next_seq, lines)
+        self.assertLess(SEARCH_SCAN_LIMIT, EVENT_TYPE_CAPACITY["dns"])
+
+    def test_rare_types_survive_dns_flood(self):
+        store = EventStore(capacity={"dns": 100})
+        store.add("GoodbyeDPI 0.2.2: Passive DPI blocker and Active DPI circumvention utility")
+        store.add("Error opening filter: The parameter is incorrect")
+        for i in range(5000):
+            store.add(dns_line(i))
+        self.assertEqual(len(store.query(event_type="banner")), 1)
+        self.assertEqual(store.query(event_type="error"), ["Error opening filter: The parameter is incorrect"])
+        self.assertEqual(store.query(text="parameter is incorrect", scan_limit=1000),
+                         ["Error opening filter: The parameter is incorrect"])
+        self.assertLessEqual(store.counts()["dns"], 100)
+
+    def test_queries_after_eviction(self):
+        store = EventStore(capacity=100)
+        for i in range(1000):
+            store.add(dns_line(i) if i % 2 else f"Error: failed {i}")
+        self.assertEqual(store.query(event_type="error", limit=3), ["Error: failed 994", "Error: failed 996",
+                                                                    "Error: failed 998"])
+        host = store.query(host="host-3.example", limit=1000)
+        self.assertTrue(host)
+        self.assertTrue(all(line.endswith("host-3.example") for line in host))
+        self.assertEqual(store.query(host="HOST-3.example", event_type="dns", limit=1000), host)
+        self.assertEqual(store.query(text="FAILED 998"), ["Error: failed 998"])
+        self.assertEqual(store.tail(3), [dns_line(997), "Error: failed 998", dns_line(999)])
+        self.assertEqual(store.event(999)["line"], dns_line(999))
+        self.assertIsNone(store.event(1))
+        # Hosts only seen in evicted lines are dropped from the index
+        for log in store.logs:
+            for host_name, index in log.host_index.items():
+                self.assertGreaterEqual(index[0], log.start, host_name)
+
+    def test_scan_limit_bounds_text_search(self):
+        store = EventStore(capacity=1000)
+        store.add("Error: needle")
+        for i in range(500):
+            store.add(dns_line(i))
+        self.assertEqual(store.query(text="needle", scan_limit=100), [])
+        self.assertEqual(store.query(text="needle", scan_limit=1000), ["Error: needle"])
+
+    def test_query_result_is_a_snapshot(self):
+        store = EventStore(capacity=10)
+        for i in range(10):
+            store.add(dns_line(i))
+        result = store.query(limit=5)
+        for i in range(10, 30):
+            store.add(dns_line(i))
+        self.assertEqual(result, [dns_line(i) for i in range(5, 10)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from output_mux import OutputMultiplexer
+from output_pipeline import OutputPipeline
+
+
+class OutputPipelineTest(unittest.TestCase):
+    def test_failing_sink_is_isolated(self):
+        pipeline = OutputPipeline()
+        seen = []
+        state = {"broken": True}
+
+        def flaky(line):
+            if state["broken"]:
+                raise OSError("disk full")
+
+        pipeline.add_sink(flaky)
+        pipeline.add_sink(seen.append)
+        for i in range(3):
+            pipeline.push(f"line {i}\n")
+        state["broken"] = False
+        pipeline.push("line 3")
+        state["broken"] = True
+        pipeline.push("line 4")
+        self.assertEqual(seen, [f"line {i}" for i in range(5)])
+        # Reported when the sink starts failing, not for every line
+        lines = pipeline.take_batch().splitlines()
+        failures = [line for line in lines if "disk full" in line]
+        self.assertEqual(len(failures), 2)
+        self.assertIn("flaky", failures[0])
+        self.assertEqual([line for line in lines if line.startswith("line")], [f"line {i}" for i in range(5)])
+
+
+class OutputMultiplexerTest(unittest.TestCase):
+    def test_failing_callback_keeps_reading(self):
+        multiplexer = OutputMultiplexer(encoding="utf-8")
+        self.addCleanup(multiplexer.stop)
+        seen = []
+
+        def on_line(line):
+            if line.strip() == "2":
+                raise RuntimeError("view gone")
+            seen.append(line.strip())
+
+        # One write, so every line arrives in the same data_received call; the last one only at EOF
+        script = "import sys; sys.stdout.write('0\\n1\\n2\\n3\\n4')"
+        process, reader = multiplexer.spawn([sys.executable, "-c", script], on_line)
+        process.wait(10)
+        reader.join(10)
+        self.assertFalse(reader.is_alive())
+        self.assertEqual(seen, ["0", "1", "3", "4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preset_bench import DATA, DpiRules, client_hello, run_benchmark, segments_for
+
+
+class SegmentsTest(unittest.TestCase):
+    def test_frag_by_sni_splits_at_host(self):
+        payload = client_hello("example.com")
+        frames = segments_for(payload, {"--frag-by-sni": True}, https=True)
+        self.assertEqual(len(frames), 2)
+        self.assertTrue(frames[1][2].startswith(b"example.com"))
+        self.assertEqual(frames[0][2] + frames[1][2], payload)
+
+    def test_frag_by_sni_without_sni_falls_back(self):
+        payload = b"\x16\x03\x01\x00\x10not a client hello"
+        self.assertEqual(segments_for(payload, {"--frag-by-sni": True}, https=True), [(DATA, 0, payload)])
+        frames = segments_for(payload, {"--frag-by-sni": True, "-e": 2}, https=True)
+        self.assertEqual(frames, [(DATA, 0, payload[:2]), (DATA, 2, payload[2:])])
+
+
+class BenchmarkTest(unittest.TestCase):
+    def bench(self, inspect):
+        # -3 splits the ClientHello once (cost 1), -5 sends a fake request before the two fragments (cost 2)
+        rules = DpiRules(["blocked.example"], inspect=inspect)
+        report = asyncio.run(run_benchmark(["https://www.blocked.example"], rules, {"off": {}, "-3": "-3", "-5": "-5"},
+                                           connections=4, concurrency=4, timeout=2.0, response_size=1024))
+        site = report["sites"]["https://www.blocked.example"]
+        return site, {row["preset"]: row for row in site["ranking"]}
+
+    def test_first_segment_inspection(self):
+        site, rows = self.bench("first")
+        self.assertEqual(rows["off"]["success_rate"], 0)
+        self.assertEqual(rows["off"]["failures"], {"reset": 4})
+        self.assertEqual((rows["-3"]["success_rate"], rows["-5"]["success_rate"]), (1.0, 1.0))
+        # Both work, the cheaper one ranks first
+        self.assertEqual((rows["-3"]["cost"], rows["-5"]["cost"]), (1, 2))
+        self.assertEqual([row["preset"] for row in site["ranking"]], ["-3", "-5", "off"])
+        self.assertEqual(site["best"], "-3")
+
+    def test_reassembling_dpi_defeats_fragmentation(self):
+        site, rows = self.bench("reassemble")
+        self.assertEqual(rows["-3"]["success_rate"], 0)
+        self.assertEqual(rows["-5"]["success_rate"], 1.0)
+        self.assertEqual(site["best"], "-5")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from process_watcher import PROCESS_NAME, CachedProcessScanner, ProcessWatcher
+
+
+class FakeScanner(CachedProcessScanner):
+    def __init__(self, processes):
+        super().__init__()
+        self.processes = processes
+
+    def list_pids(self):
+        return list(self.processes)
+
+    def query_name(self, pid):
+        return self.processes[pid]
+
+
+class ProcessWatcherTest(unittest.TestCase):
+    def test_fallback_ignores_excluded_pids(self):
+        # An extra instance's goodbyedpi must not make the main watcher report itself as running
+        scanner = FakeScanner({10: "explorer.exe", 20: PROCESS_NAME})
+        owned = {20}
+        watcher = ProcessWatcher(scanner=scanner, exclude=lambda: owned)
+        self.assertFalse(watcher.is_running())
+        self.assertIsNone(watcher.pid)
+        scanner.processes[30] = PROCESS_NAME
+        self.assertTrue(watcher.is_running())
+        self.assertEqual(watcher.pid, 30)
+        self.assertEqual(watcher.external_pids(), [30])
+
+    def test_fallback_without_exclude(self):
+        watcher = ProcessWatcher(scanner=FakeScanner({20: PROCESS_NAME}))
+        self.assertTrue(watcher.is_running())
+        self.assertEqual(watcher.pid, 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import os
+import sys
+import hmac
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import profile_remote
+from profile_remote import DIGEST_HEADER, RemoteProfileError, RemoteProfileSource, RemoteProfileSync
+
+
+def digest(profile):
+    return hashlib.sha256(json.dumps(profile).encode()).hexdigest()
+
+
+class ProfileServer:
+    # Serves `files` ({path: (body, headers)}) with an ETag per body and answers If-None-Match with a 304
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, self.headers.get("If-None-Match")))
+                if self.path not in server.files:
+                    self.send_error(404)
+                    return
+                body, headers = server.files[self.path]
+                etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def publish(self, path, profile, **headers):
+        body = json.dumps(profile).encode()
+        self.files[path] = (body, headers)
+        return body
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join(5)
+
+
+class RemoteProfileSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, "shared.json")
+        self.write({"modeset": "-9"})
+        self.source = RemoteProfileSource(self.path, cache_dir=os.path.join(self.directory, "cache"))
+        self.errors = []
+
+    def write(self, profile):
+        with open(self.path, "w") as f:
+            json.dump(profile, f)
+        os.utime(self.path, ns=(0, os.stat(self.path).st_mtime_ns + 1_000_000_000))
+
+    def test_failing_update_keeps_polling(self):
+        updates = []
+
+        def on_update(name, profile):
+            updates.append(profile)
+            if len(updates) == 1:
+                raise RuntimeError("apply failed")
+
+        sync = RemoteProfileSync(self.source, on_update, self.errors.append)
+        self.assertFalse(sync.poll())
+        self.assertIn("apply failed", self.errors[0])
+        # The profile that could not be applied is offered again
+        self.assertTrue(sync.poll())
+        self.assertEqual(updates[-1]["modeset"], "-9")
+        self.write({"modeset": "-5"})
+        self.assertTrue(sync.poll())
+        self.assertEqual(updates[-1]["modeset"], "-5")
+        self.assertFalse(sync.poll())
+
+    def test_unsaved_metadata_still_delivers_profile(self):
+        updates = []
+        sync = RemoteProfileSync(self.source, lambda name, profile: updates.append(profile), self.errors.append)
+        with mock.patch.object(profile_remote, "atomic_write_json", side_effect=OSError("disk full")):
+            self.assertTrue(sync.poll())
+        self.assertEqual(updates[0]["modeset"], "-9")
+        self.assertEqual(len(self.errors), 1)
+        self.assertIn("disk full", self.errors[0])
+
+    def test_unexpected_fetch_error_is_reported(self):
+        sync = RemoteProfileSync(self.source, lambda name, profile: None, self.errors.append)
+        with mock.patch.object(self.source, "_fetch_file", side_effect=KeyError("boom")):
+            self.assertFalse(sync.poll())
+        self.assertIn("boom", self.errors[0])
+        self.assertTrue(sync.poll())
+
+
+class HttpSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.server = ProfileServer()
+        self.addCleanup(self.server.close)
+        self.url = f"{self.server.url}/profile.json"
+
+    def source(self, key=None):
+        return RemoteProfileSource(self.url, cache_dir=os.path.join(self.directory, "cache"), key=key, timeout=5)
+
+    def test_conditional_requests(self):
+        self.server.publish("/profile.json", {"modeset": "-9"})
+        source = self.source()
+        self.assertEqual(source.fetch()["modeset"], "-9")
+        etag = source.meta["etag"]
+        self.assertIsNone(source.fetch())
+        self.assertEqual(self.server.requests[-1], ("/profile.json", etag))
+        # Validators are kept on disk, a new source for the same URL starts conditional
+        self.assertIsNone(self.source().fetch())
+        self.server.publish("/profile.json", {"modeset": "-5"})
+        self.assertEqual(source.fetch()["modeset"], "-5")
+        self.assertNotEqual(source.meta["etag"], etag)
+        self.assertIsNone(source.fetch())
+
+    def test_signature_sidecar(self):
+        key = "shared secret"
+        body = self.server.publish("/profile.json", {"modeset": "-9"})
+        source = self.source(key)
+        with self.assertRaisesRegex(RemoteProfileError, "Unsigned"):
+            source.fetch()
+        self.server.files["/profile.json.sig"] = (b"0" * 64 + b"\n", {})
+        with self.assertRaisesRegex(RemoteProfileError, "Bad signature"):
+            source.fetch()
+        signature = hmac.new(key.encode(), body, hashlib.sha256).hexdigest()
+        self.server.files["/profile.json.sig"] = (f"{signature}  profile.json\n".encode(), {})
+        self.assertEqual(source.fetch()["modeset"], "-9")
+        # With a key, a matching digest is no substitute for the signature
+        self.server.publish("/profile.json", {"modeset": "-5"}, **{DIGEST_HEADER: digest({"modeset": "-5"})})
+        with self.assertRaisesRegex(RemoteProfileError, "Bad signature"):
+            source.fetch()
+
+    def test_digest_mismatch_keeps_cache(self):
+        body = self.server.publish("/profile.json", {"modeset": "-9"})
+        self.server.files["/profile.json.sha256"] = (hashlib.sha256(body).hexdigest().encode(), {})
+        source = self.source()
+        self.assertEqual(source.fetch()["modeset"], "-9")
+        with open(source.cache_path, "rb") as f:
+            cached = f.read()
+        self.server.publish("/profile.json", {"modeset": "-5"})
+        with self.assertRaisesRegex(RemoteProfileError, "SHA-256"):
+            source.fetch()
+        self.server.publish("/profile.json", {"modeset": "-5"}, **{DIGEST_HEADER: "f" * 64})
+        with self.assertRaisesRegex(RemoteProfileError, "SHA-256"):
+            source.fetch()
+        with open(source.cache_path, "rb") as f:
+            self.assertEqual(f.read(), cached)
+        # The header takes precedence over the sidecar
+        self.server.publish("/profile.json", {"modeset": "-5"}, **{DIGEST_HEADER: digest({"modeset": "-5"})})
+        self.assertEqual(source.fetch()["modeset"], "-5")
+        self.assertEqual(source.meta["sha256"], digest({"modeset": "-5"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profile_store import DEFAULT_PROFILE, ProfileStore, UnknownProfileError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LegacyImportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.legacy = os.path.join(self.directory, "profile.json")
+        self.profiles = os.path.join(self.directory, "profiles")
+
+    def write_legacy(self, text):
+        with open(self.legacy, "w") as f:
+            f.write(text)
+
+    def test_imports_legacy_profile(self):
+        self.write_legacy(json.dumps({"modeset": "-9"}))
+        store = ProfileStore(self.profiles, self.legacy)
+        self.assertIsNone(store.import_error)
+        self.assertEqual(store.load(DEFAULT_PROFILE)["modeset"], "-9")
+
+    def test_corrupt_legacy_profile(self):
+        self.write_legacy("{not json")
+        store = ProfileStore(self.profiles, self.legacy)
+        self.assertIn("profile.json", store.import_error)
+        self.assertEqual(store.names(), [])
+        self.assertEqual(store.load()["modeset"], "")
+
+    def test_dangling_last_profile_pointer(self):
+        self.write_legacy(json.dumps({"last_profile": os.path.join(self.directory, "missing.json")}))
+        store = ProfileStore(self.profiles, self.legacy)
+        self.assertIsNotNone(store.import_error)
+        self.assertEqual(store.names(), [])
+
+    def test_import_retried_once_fixed(self):
+        self.write_legacy("[]")
+        self.assertIsNotNone(ProfileStore(self.profiles, self.legacy).import_error)
+        self.write_legacy(json.dumps({"modeset": "-5"}))
+        store = ProfileStore(self.profiles, self.legacy)
+        self.assertIsNone(store.import_error)
+        self.assertEqual(store.load()["modeset"], "-5")
+
+
+class LoadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.store = ProfileStore(os.path.join(self.directory, "profiles"), None)
+
+    def test_default_profile_exists_implicitly(self):
+        self.assertEqual(self.store.load()["modeset"], "")
+        self.assertEqual(self.store.load(DEFAULT_PROFILE)["modeset"], "")
+
+    def test_unknown_profile_raises(self):
+        self.store.save("web", {"modeset": "-9"})
+        self.assertEqual(self.store.load("web")["modeset"], "-9")
+        with self.assertRaises(KeyError) as caught:
+            self.store.load("wbe")
+        self.assertIsInstance(caught.exception, UnknownProfileError)
+        self.assertEqual(str(caught.exception), "Unknown profile: wbe")
+
+    def test_headless_rejects_unknown_profile(self):
+        result = subprocess.run([sys.executable, os.path.join(ROOT, "GoodByeDPI-Headless.py"), "--dry-run",
+                                 "--profile", "typo"], cwd=self.directory, capture_output=True, text=True,
+                                timeout=60)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("Unknown profile: typo", result.stderr)
+        self.assertNotIn("goodbyedpi", result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
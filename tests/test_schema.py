@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import goodbyedpi_core
+from goodbyedpi_core import FLAGS, MODES, PROFILE_SECTIONS, ProfileError, build_argv, build_command, read_profile
+
+
+SEED = 20261017
+RUNS = 500
+EXECUTABLE = "goodbyedpi.exe"
+
+
+def random_ipv4(rng):
+    return ".".join(str(rng.randint(0, 255)) for _ in range(4))
+
+
+def random_ipv6(rng):
+    return ":".join(f"{rng.randint(0, 0xffff):x}" for _ in range(8))
+
+
+# Valid text for every "line" flag; a flag added to FLAGS without an entry here fails the tests
+# noinspection SpellCheckingInspection
+VALID_LINES = {
+    "--port": lambda rng: str(rng.randint(1, 65535)),
+    "--ip-id": lambda rng: str(rng.randint(0, 65535)),
+    "--set-ttl": lambda rng: str(rng.randint(1, 255)),
+    "--auto-ttl": lambda rng: "-".join(str(rng.randint(1, 255)) for _ in range(rng.randint(1, 3))),
+    "--blacklist": lambda rng: f"list-{rng.randint(0, 99)}.txt",
+    "--dns-addr": random_ipv4,
+    "--dnsv6-addr": random_ipv6,
+    "--fake-from-hex": lambda rng: "".join(rng.choice("0123456789abcdefABCDEF") for _ in range(2 * rng.randint(1, 8))),
+    "--fake-with-sni": lambda rng: f"www.example-{rng.randint(0, 999)}.com",
+}
+# Values every flag of the kind must reject
+INVALID_VALUES = {
+    "check": ["yes", 1, 0],
+    "spin": ["5", 1.5, True],
+    "line": [5, ["a"], True],
+}
+# noinspection SpellCheckingInspection
+INVALID_LINES = {
+    "--port": ["0", "65536", "http"],
+    "--ip-id": ["65536", "-1"],
+    "--set-ttl": ["0", "256"],
+    "--auto-ttl": ["a-b", "1-2-3-4"],
+    "--dns-addr": ["2a02:6b8::feed:0ff", "1.2.3", "host"],
+    "--dnsv6-addr": ["77.88.8.8", "::g"],
+    "--fake-from-hex": ["abc", "zz"],
+    "--fake-with-sni": ["exa mple.com", "a/b"],
+}
+
+
+def random_value(rng, name, flag):
+    if flag.kind == "check":
+        return rng.random() < 0.5
+    if flag.kind == "spin":
+        if rng.random() < 0.3:
+            return 0
+        return rng.randint(max(1, flag.minimum), flag.maximum)
+    if rng.random() < 0.3:
+        return rng.choice(["", "  "])
+    value = VALID_LINES[name](rng)
+    return f" {value} " if rng.random() < 0.2 else value
+
+
+def random_profile(rng):
+    profile = {"modeset": "", **{section: {} for section in PROFILE_SECTIONS.values()}}
+    for name, flag in FLAGS.items():
+        if rng.random() < 0.6:
+            profile[PROFILE_SECTIONS[flag.kind]][name] = random_value(rng, name, flag)
+    return profile
+
+
+def expected_argv(profile):
+    argv = [EXECUTABLE]
+    for name, flag in FLAGS.items():
+        value = profile[PROFILE_SECTIONS[flag.kind]].get(name)
+        if flag.kind == "check" and value:
+            argv.append(name)
+        elif flag.kind == "spin" and value:
+            argv.extend([name, str(value)])
+        elif flag.kind == "line" and value and value.strip():
+            argv.extend([name, value.strip()])
+    return argv
+
+
+class BuildArgvTest(unittest.TestCase):
+    def setUp(self):
+        goodbyedpi_core._ARGV_CACHE.clear()
+
+    def test_valid_profiles(self):
+        rng = random.Random(SEED)
+        for _ in range(RUNS):
+            profile = random_profile(rng)
+            argv = build_argv(profile, EXECUTABLE)
+            self.assertEqual(argv, expected_argv(profile), profile)
+            names = [arg for arg in argv[1:] if arg in FLAGS]
+            self.assertEqual(len(names), len(set(names)))
+            self.assertEqual(names, [name for name in FLAGS if name in names])
+
+    def test_deterministic_and_cached(self):
+        rng = random.Random(SEED + 1)
+        for _ in range(RUNS):
+            profile = random_profile(rng)
+            first = build_argv(profile, EXECUTABLE)
+            # The cached copy must not be shared with callers
+            first.append("--mutated")
+            if rng.random() < 0.5:
+                goodbyedpi_core._ARGV_CACHE.clear()
+            self.assertEqual(build_argv(profile, EXECUTABLE), expected_argv(profile))
+
+    def test_section_order_does_not_matter(self):
+        rng = random.Random(SEED + 2)
+        for _ in range(RUNS):
+            profile = random_profile(rng)
+            shuffled = {"modeset": ""}
+            for section in rng.sample(list(PROFILE_SECTIONS.values()), len(PROFILE_SECTIONS)):
+                items = list(profile[section].items())
+                rng.shuffle(items)
+                shuffled[section] = dict(items)
+            self.assertEqual(build_argv(shuffled, EXECUTABLE), build_argv(profile, EXECUTABLE))
+
+    def test_invalid_values_are_all_reported(self):
+        rng = random.Random(SEED + 3)
+        for _ in range(RUNS):
+            profile = random_profile(rng)
+            bad = rng.sample(list(FLAGS), rng.randint(1, 4))
+            for name in bad:
+                flag = FLAGS[name]
+                choices = INVALID_VALUES[flag.kind] + INVALID_LINES.get(name, [])
+                if flag.kind == "spin":
+                    choices = choices + [flag.maximum + 1, -1]
+                profile[PROFILE_SECTIONS[flag.kind]][name] = rng.choice(choices)
+            with self.assertRaises(ProfileError) as caught:
+                build_argv(profile, EXECUTABLE)
+            for name in bad:
+                self.assertIn(name, str(caught.exception))
+
+    def test_preset_ignores_flags(self):
+        rng = random.Random(SEED + 4)
+        for _ in range(RUNS):
+            profile = random_profile(rng)
+            mode = rng.choice(list(MODES))
+            profile["modeset"] = mode
+            self.assertEqual(build_argv(profile, EXECUTABLE), [EXECUTABLE, mode])
+
+    def test_unknown_preset(self):
+        with self.assertRaises(ProfileError):
+            build_argv({"modeset": "-99"}, EXECUTABLE)
+
+    def test_malformed_sections(self):
+        # A hand-edited profile.json can hold anything; it must be reported as ProfileError
+        rng = random.Random(SEED + 5)
+        for _ in range(RUNS):
+            profile = random_profile(rng)
+            section = rng.choice(list(PROFILE_SECTIONS.values()))
+            profile[section] = rng.choice([None, [], "--port 80", 1, list(profile[section].items())])
+            with self.assertRaises(ProfileError) as caught:
+                build_argv(profile, EXECUTABLE)
+            self.assertIn(section, str(caught.exception))
+        for profile in ([], "profile", {"modeset": None}, {"modeset": ["-9"]}):
+            with self.assertRaises(ProfileError):
+                build_argv(profile, EXECUTABLE)
+
+    def test_uncompilable_blacklist_is_passed_per_file(self):
+        messages = []
+        missing = os.path.join(os.path.dirname(os.path.abspath(__file__)), "missing")
+        profile = {"line_values": {"--blacklist": f"{missing}-a.txt; {missing}-b.txt", "--port": "8080"}}
+        argv = build_command(profile, EXECUTABLE, on_message=messages.append)
+        self.assertEqual(argv, [EXECUTABLE, "--port", "8080", "--blacklist", f"{missing}-a.txt",
+                                "--blacklist", f"{missing}-b.txt"])
+        self.assertEqual(len(messages), 1)
+
+    def test_concurrent_builds_respect_cache_size(self):
+        rng = random.Random(SEED + 2)
+        profiles = [random_profile(rng) for _ in range(goodbyedpi_core.ARGV_CACHE_SIZE * 4)]
+        failures = []
+
+        def build(offset):
+            try:
+                for i in range(len(profiles)):
+                    profile = profiles[(i + offset) % len(profiles)]
+                    if build_argv(profile, EXECUTABLE) != expected_argv(profile):
+                        failures.append(profile)
+            except Exception as e:
+                failures.append(e)
+
+        threads = [threading.Thread(target=build, args=(offset * 7,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+        self.assertLessEqual(len(goodbyedpi_core._ARGV_CACHE), goodbyedpi_core.ARGV_CACHE_SIZE)
+
+
+class ReadProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name, profile):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            json.dump(profile, f)
+        return path
+
+    def test_pointers_are_followed(self):
+        target = self.write("target.json", {"modeset": "-9"})
+        pointer = self.write("pointer.json", {"last_profile": target})
+        self.assertEqual(read_profile(pointer), {"modeset": "-9"})
+        # A profile that points at itself is the profile
+        itself = os.path.join(self.directory, "itself.json")
+        self.write("itself.json", {"modeset": "-5", "last_profile": itself})
+        self.assertEqual(read_profile(itself)["modeset"], "-5")
+
+    def test_pointer_cycle_is_rejected(self):
+        a = os.path.join(self.directory, "a.json")
+        b = self.write("b.json", {"last_profile": a})
+        self.write("a.json", {"last_profile": b})
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            read_profile(a)
+        self.write("a.json", {"last_profile": 5})
+        with self.assertRaises(ValueError):
+            read_profile(b)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from goodbyedpi_core import RestartPolicy, Supervisor
+from goodbyedpi_stub import STUB_ENV
+
+
+STUB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "goodbyedpi_stub.py")
+
+
+def stub_command(*args):
+    return [sys.executable, STUB_PATH] + list(args)
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+class SupervisorLifecycleTest(unittest.TestCase):
+    def setUp(self):
+        self.supervisors = []
+        self.processes = []
+        self.spawned = threading.Lock()
+
+    def tearDown(self):
+        for supervisor in self.supervisors:
+            supervisor.stop(1.0)
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def supervisor(self, **kwargs):
+        supervisor = Supervisor(**kwargs)
+        spawn = supervisor._spawn
+
+        # Records every process, so an orphan that the supervisor lost track of is still seen
+        def tracked(command):
+            process = spawn(command)
+            with self.spawned:
+                self.processes.append(process)
+            return process
+
+        supervisor._spawn = tracked
+        self.supervisors.append(supervisor)
+        return supervisor
+
+    def alive(self):
+        return [process for process in self.processes if process.poll() is None]
+
+    def test_concurrent_apply_leaves_one_process(self):
+        supervisor = self.supervisor(auto_restart=False)
+        threads = [threading.Thread(target=supervisor.apply, args=(stub_command(f"-{i}"),)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertTrue(wait_until(lambda: len(self.alive()) == 1), self.alive())
+        self.assertEqual(self.alive()[0].pid, supervisor.owned_pid())
+
+    def test_start_replaces_owned_process(self):
+        supervisor = self.supervisor(auto_restart=False)
+        first = supervisor.start(stub_command("-1"))
+        second = supervisor.start(stub_command("-2"))
+        self.assertTrue(wait_until(lambda: first.poll() is not None))
+        self.assertEqual(supervisor.owned_pid(), second.pid)
+
+    def test_fired_restart_does_not_double_spawn(self):
+        policy = RestartPolicy(base_delay=0.05, max_delay=0.05, jitter=0, crash_loop_limit=1000)
+        supervisor = self.supervisor(policy=policy)
+        os.environ[STUB_ENV + "CRASH_AFTER"] = "0.1"
+        try:
+            supervisor.start(stub_command("-1"))
+            for i in range(10):
+                time.sleep(0.07)
+                supervisor.apply(stub_command(f"-{i + 2}"))
+        finally:
+            del os.environ[STUB_ENV + "CRASH_AFTER"]
+        supervisor.apply(stub_command("-final"))
+        time.sleep(0.3)
+        self.assertEqual(len(self.alive()), 1, self.alive())
+
+
+if __name__ == "__main__":
+    unittest.main()